@@ -1,22 +1,46 @@
 #################################################################################################################################
 #################################   SMLM IMAGE ANALYSIS TEMPLATE (FULL PIPELINE)   ##############################################
 #################################################################################################################################
+#
+# The stage functions (filtering, ambiguity deletion, pairing, Φ/θ, tracking) live in smlm_pipeline.py so worker processes
+# can import them. This script holds the settings and runs the pipeline; everything that executes is inside main() so that
+# worker processes started with "spawn"/"forkserver" do not re-run the analysis when they import this file.
+#################################################################################################################################
+
+import tempfile
 
 import numpy as np
-import pandas as pd
-import matplotlib.pyplot as plt
 
 from datetime import datetime
 from zoneinfo import ZoneInfo
 
-from scipy.spatial import cKDTree
 from scipy.stats import pearsonr
-from scipy.optimize import linear_sum_assignment
-from scipy.spatial.distance import cdist
 
-from matplotlib.ticker import MaxNLocator
+from smlm_pipeline import (
+    ROD_LENGTH_NM,
+    load_and_filter, remove_ambiguous_triplets,
+    radius_pair_indices, window_pair_indices, distance_table,
+    frame_pair_indices, frame_pair_table,
+    add_dipole_geometry, track_midpoints, close_track_gaps,
+)
+from smlm_tiling import tiled_ambiguity_and_pairing
+from smlm_io import columnar_path
+from smlm_output import BackgroundWriter
+from smlm_figures import publish_arrays, submit_figures, show_figures
+from smlm_autocorrelation import rotational_autocorrelation
+from smlm_accumulators import (
+    new_dipole_accumulator, distance_edges_for, out_of_range_counts, update_from_table, save_accumulator,
+)
+from smlm_cache import StageCache
+from smlm_precision import EMCCD_CAMERA
 
 
+# =================================================================================================
+# INPUT FILES
+# =================================================================================================
+C1_CSV = "TIRF560_imageregperformed.csv"
+C2_CSV = "TIRF647_imageregperformed.csv"
+
 # =================================================================================================
 # USER-ADJUSTABLE THRESHOLDS (edit these as needed)
 # =================================================================================================
@@ -35,6 +59,18 @@ intensity_upper_c1 = 100000
 intensity_lower_c2 = 0
 intensity_upper_c2 = 100000
 
+# Threshold a recomputed uncertainty instead of the exported one (Mortensen formula from photons, background and PSF width;
+# see smlm_precision.py). Background / PSF width are read from their ThunderSTORM columns when present, else the constants.
+RECOMPUTE_UNCERTAINTY = False
+CAMERA = {**EMCCD_CAMERA}      # README camera settings; override entries, e.g. {**EMCCD_CAMERA, "em_gain": 300.0}
+PRECISION_OPTIONS = {
+    "method": "lsq",                       # "lsq" (ThunderSTORM), "mle" or "thompson"
+    "background_col": "bkgstd [photon]",
+    "sigma_col": "sigma [nm]",
+    "background": None,                    # photons per pixel (std), used when the column is missing
+    "sigma_nm": None,                      # PSF σ (nm), used when the column is missing
+}
+
 # =================================================================================================
 # COLUMN NAMES (edit only if your CSV columns differ)
 # =================================================================================================
@@ -51,499 +87,295 @@ INTENSITY_COL = "intensity [photon]"   # set to None if your file does not have
 RADIUS_NM = 232.0              # C1–C2 pairing radius
 TRACK_LINK_NM = 400.0          # linking threshold for tracking midpoints across frames
 
+# Part A frame window: None = pair across ALL frames (original output); k = only pair C1/C2 localizations whose frames
+# differ by at most k (output grows linearly with the number of frames instead of quadratically per site)
+PART_A_FRAME_WINDOW = None
+PART_A_BLOCK_FRAMES = None     # frames per processing block in windowed mode (None = max(4k, 32))
+
+# Gap closing (off by default = original tracker, which can continue a track after any number of missing frames).
+# When on, the tracker only continues tracks seen in the previous frame and a second linking pass joins the segments split
+# by blinking, up to GAP_CLOSE_MAX_FRAMES frames without the dipole. Longer blinks end the track, so set it to the longest
+# off-time you expect (too small a value gives MORE tracks than the original tracker). Changes the Track IDs and adds a
+# "Segment ID" column to the Master sheet.
+CLOSE_TRACK_GAPS = False
+GAP_CLOSE_MAX_FRAMES = 10      # largest frame gap bridged (1 = consecutive frames only)
+GAP_CLOSE_NM = TRACK_LINK_NM   # largest midpoint distance bridged across a gap
+GAP_CLOSE_PENALTY_NM = 25.0    # added to the link cost per missing frame, so the segment nearest in time is joined first
+
+# Spatial tiling for very large fields of view (None = process the whole window at once)
+TILE_NM = None                 # e.g. 20000.0 -> 4 × 4 tiles over the 0–80,000 nm window
+TILE_HALO_NM = None            # None = 3 × RADIUS_NM (the minimum for results identical to the untiled run)
+TILE_WORKERS = None            # worker processes (None = all cores, 1 = run tiles in this process)
+
+# Rotational dynamics (autocorrelation of (cos Φ, sin Φ) along each track)
+COMPUTE_ROTATIONAL_ACF = True
+ACF_MAX_LAG = None             # None = every lag a track spans (frames)
+ACF_FIT_MAX_LAG = 20           # lags (frames) used to fit the rotational correlation time
+
+# Also write each table in a fast columnar format (Parquet, or .npz without pyarrow) for the plotting scripts
+WRITE_COLUMNAR = True
+
+# Background output (Excel / columnar / PNG writing overlaps with computation)
+OUTPUT_WORKERS = 4             # writer/renderer processes (0 = write synchronously in this process)
+
+# Figures (see smlm_figures.FIGURES for the names): rendered headless in parallel by the output workers
+FIGURES_TO_RENDER = None       # None = all, or e.g. ["qc_scatter", "midpoint_theta_arrows"]
+SHOW_FIGURES = True            # also open the rendered figures interactively at the end (False for batch runs)
+
+# Stage cache: reruns reuse filter / deletion / pairing / geometry / tracking results whose inputs and parameters
+# did not change (e.g. changing only TRACK_LINK_NM recomputes only the tracking)
+USE_STAGE_CACHE = True
+STAGE_CACHE_DIR = ".smlm_cache"
+STAGE_CACHE_MAX_GB = 2.0       # least recently used results are deleted beyond this size
+
+# Per-FOV histogram/moment accumulator of the tracked dipoles (merge many FOVs with smlm_accumulators.py)
+SAVE_SUMMARY_ACCUMULATOR = True
+
 # Colors (enforced consistently)
 C1_COLOR = "green"
 C2_COLOR = "red"
 
+FIGURE_OPTIONS = {"c1_color": C1_COLOR, "c2_color": C2_COLOR, "arrow_length": 1800.0, "dpi": 300}
+
 # Timestamped outputs (NY time)
 ts = datetime.now(ZoneInfo("America/New_York")).strftime("%Y%m%d_%H%M%S")
 OUT_XLSX = f"End-to-end distance_{ts}.xlsx"
 TRACKED_XLSX = f"Tracked_Dipoles_{ts}.xlsx"
+ROT_ACF_XLSX = f"Rotational_ACF_{ts}.xlsx"
+ROT_ACF_CURVES = columnar_path(f"Rotational_ACF_PerTrack_{ts}.xlsx")   # one row per lag per track: too long for Excel
+SUMMARY_NPZ = f"Dipole_Summary_{ts}.npz"
 
 
 # =================================================================================================
-# LOAD + FILTER
-#   - Loads the needed columns once
-#   - Applies uncertainty, (optional) intensity, and XY window thresholds
+# MAIN
+#   Tables go to a BackgroundWriter (worker processes) so the pipeline does not wait on Excel writing.
+#   Figures are declared in smlm_figures.py: each stage publishes the arrays its figures read, and the selected
+#   figures are rendered in parallel by the same worker processes (Agg, no display needed).
 # =================================================================================================
-def load_and_filter(
-    csv_path: str,
-    lower_unc: float, upper_unc: float,
-    x_lo: float, x_hi: float,
-    y_lo: float, y_hi: float,
-    intensity_lo: float, intensity_hi: float,
-    id_col: str = ID_COL,
-    frame_col: str = FRAME_COL,
-    xcol: str = XCOL,
-    ycol: str = YCOL,
-    ucol: str = UNCERTAINTY_COL,
-    icol: str | None = INTENSITY_COL,
-) -> pd.DataFrame:
-
-    usecols = [id_col, frame_col, xcol, ycol, ucol]
-    if icol is not None:
-        usecols.append(icol)
-
-    df = pd.read_csv(csv_path, usecols=usecols).dropna(subset=usecols).reset_index(drop=True)
-
-    m = (
-        (df[ucol] >= lower_unc) & (df[ucol] <= upper_unc) &
-        (df[xcol] >= x_lo) & (df[xcol] <= x_hi) &
-        (df[ycol] >= y_lo) & (df[ycol] <= y_hi)
-    )
-    if icol is not None:
-        m = m & (df[icol] >= intensity_lo) & (df[icol] <= intensity_hi)
+def main() -> None:
+    with tempfile.TemporaryDirectory(prefix="smlm_figures_") as array_dir:
+        cache = StageCache(STAGE_CACHE_DIR if USE_STAGE_CACHE else None, max_bytes=int(STAGE_CACHE_MAX_GB * 1024**3))
+        with BackgroundWriter(workers=OUTPUT_WORKERS) as writer:
+            figure_names = run_pipeline(writer, array_dir, cache)
+        print("All outputs written.")
 
-    return df.loc[m].reset_index(drop=True)
+        if SHOW_FIGURES:
+            show_figures(array_dir, figure_names, FIGURE_OPTIONS)
 
 
-# -------------------------------------------------------------------------------------------------
-# Load CSV files at the top (as requested)
-# -------------------------------------------------------------------------------------------------
-df_c1 = load_and_filter(
-    "TIRF560_imageregperformed.csv",
-    lower_unc=lower_threshold_c1, upper_unc=upper_threshold_c1,
-    x_lo=x_lower, x_hi=x_upper, y_lo=y_lower, y_hi=y_upper,
-    intensity_lo=intensity_lower_c1, intensity_hi=intensity_upper_c1
-)
-
-df_c2 = load_and_filter(
-    "TIRF647_imageregperformed.csv",
-    lower_unc=lower_threshold_c2, upper_unc=upper_threshold_c2,
-    x_lo=x_lower, x_hi=x_upper, y_lo=y_lower, y_hi=y_upper,
-    intensity_lo=intensity_lower_c2, intensity_hi=intensity_upper_c2
-)
-
-print(f"C1 after thresholds: {len(df_c1)}")
-print(f"C2 after thresholds: {len(df_c2)}")
-
-
-# =================================================================================================
-# HIGH-POPULATION AMBIGUITY DELETION (your rule)
-#   If a same-channel close pair (<= RADIUS_NM) exists AND either member is close to opposite channel
-#   (<= RADIUS_NM), remove BOTH same-channel puncta AND the opposite-channel puncta within RADIUS_NM.
 # =================================================================================================
-def remove_ambiguous_triplets(df_c1: pd.DataFrame, df_c2: pd.DataFrame, r_nm: float = 232.0) -> tuple[pd.DataFrame, pd.DataFrame, dict]:
-    c1_xy = df_c1[[XCOL, YCOL]].to_numpy(dtype=float)
-    c2_xy = df_c2[[XCOL, YCOL]].to_numpy(dtype=float)
-
-    remove_c1 = np.zeros(len(df_c1), dtype=bool)
-    remove_c2 = np.zeros(len(df_c2), dtype=bool)
-
-    if len(c1_xy) == 0 or len(c2_xy) == 0:
-        report = {
-            "r_nm": r_nm,
-            "initial_c1": len(df_c1), "initial_c2": len(df_c2),
-            "same_channel_pairs_checked_c1": 0, "same_channel_pairs_checked_c2": 0,
-            "removed_c1": 0, "removed_c2": 0,
-            "final_c1": len(df_c1), "final_c2": len(df_c2),
-        }
-        return df_c1, df_c2, report
-
-    c1_tree = cKDTree(c1_xy)
-    c2_tree = cKDTree(c2_xy)
-
-    def process_same_channel_pairs(same_tree, same_xy, other_tree, remove_same, remove_other) -> int:
-        pairs = same_tree.query_pairs(r=r_nm)
-        if not pairs:
-            return 0
-
-        for (i, j) in pairs:
-            neigh_i = other_tree.query_ball_point(same_xy[i], r=r_nm)
-            neigh_j = other_tree.query_ball_point(same_xy[j], r=r_nm)
-
-            if neigh_i or neigh_j:
-                remove_same[i] = True
-                remove_same[j] = True
-                if neigh_i:
-                    remove_other[neigh_i] = True
-                if neigh_j:
-                    remove_other[neigh_j] = True
-
-        return len(pairs)
-
-    n_c1_pairs = process_same_channel_pairs(c1_tree, c1_xy, c2_tree, remove_c1, remove_c2)
-    n_c2_pairs = process_same_channel_pairs(c2_tree, c2_xy, c1_tree, remove_c2, remove_c1)
-
-    df_c1_filt = df_c1.loc[~remove_c1].reset_index(drop=True)
-    df_c2_filt = df_c2.loc[~remove_c2].reset_index(drop=True)
-
-    report = {
-        "r_nm": r_nm,
-        "initial_c1": len(df_c1), "initial_c2": len(df_c2),
-        "same_channel_pairs_checked_c1": n_c1_pairs, "same_channel_pairs_checked_c2": n_c2_pairs,
-        "removed_c1": int(remove_c1.sum()), "removed_c2": int(remove_c2.sum()),
-        "final_c1": len(df_c1_filt), "final_c2": len(df_c2_filt),
-    }
-    return df_c1_filt, df_c2_filt, report
-
-
-# -------------------------------------------------------------------------------------------------
-# APPLY AMBIGUITY DELETION (THIS IS THE HIGH-POPULATION REMOVAL STEP)
-# -------------------------------------------------------------------------------------------------
-df_c1, df_c2, deletion_report = remove_ambiguous_triplets(df_c1, df_c2, r_nm=RADIUS_NM)
-print("High-population ambiguity deletion report:", deletion_report)
-
-
-# =================================================================================================
-# QC SCATTER PLOT (C1 green, C2 red)
+# CACHED STAGES
+#   Each returns exactly what the cache stores; the parameters they read are listed in run_pipeline's cache.run calls.
 # =================================================================================================
-plt.figure(figsize=(8, 6))
-plt.scatter(df_c1[XCOL], df_c1[YCOL], color=C1_COLOR, alpha=0.2, label="C1 (TIRF 560)")
-plt.scatter(df_c2[XCOL], df_c2[YCOL], color=C2_COLOR, alpha=0.2, label="C2 (TIRF 647)")
-plt.xlabel("X Position (nm)")
-plt.ylabel("Y Position (nm)")
-plt.title("Scatter Plot: CHANNELS BEFORE IMAGE REGISTRATION")
-plt.legend()
-plt.grid(True)
-plt.savefig("scatter_plot.png", dpi=300, bbox_inches="tight")
-plt.show()
+def ambiguity_stage(df_c1, df_c2):
+    if TILE_NM is None:
+        df_c1, df_c2, deletion_report = remove_ambiguous_triplets(df_c1, df_c2, r_nm=RADIUS_NM, xcol=XCOL, ycol=YCOL)
+        return df_c1, df_c2, deletion_report, None, None
+    return tiled_ambiguity_and_pairing(
+        df_c1, df_c2, r_nm=RADIUS_NM, tile_nm=TILE_NM,
+        bounds=(x_lower, x_upper, y_lower, y_upper), halo_nm=TILE_HALO_NM, workers=TILE_WORKERS,
+        part_a_window_frames=PART_A_FRAME_WINDOW, part_a_block_frames=PART_A_BLOCK_FRAMES,
+        frame_col=FRAME_COL, xcol=XCOL, ycol=YCOL
+    )
 
 
-# =================================================================================================
-# PART A: FRAME-AGNOSTIC PAIRING (your template output)
-#   - Computes all C1–C2 pairs within RADIUS_NM (across all frames)
-#   - Writes a timestamped Excel output: OUT_XLSX
-# =================================================================================================
-c1_xy = df_c1[[XCOL, YCOL]].to_numpy(dtype=float)
-c2_xy = df_c2[[XCOL, YCOL]].to_numpy(dtype=float)
-
-if len(c1_xy) == 0 or len(c2_xy) == 0:
-    distance_df = pd.DataFrame(columns=[
-        "C1 X (nm)", "C1 Y (nm)", "C2 X (nm)", "C2 Y (nm)",
-        "Distance (nm)", "C1 Uncertainty (nm)", "C2 Uncertainty (nm)",
-        "Dipole Angle (degrees)"
-    ])
-else:
-    c2_tree_global = cKDTree(c2_xy)
-    neighbors = c2_tree_global.query_ball_point(c1_xy, r=RADIUS_NM)
-
-    c1_idx = np.repeat(np.arange(len(neighbors)), [len(n) for n in neighbors])
-    if c1_idx.size == 0:
-        distance_df = pd.DataFrame(columns=[
-            "C1 X (nm)", "C1 Y (nm)", "C2 X (nm)", "C2 Y (nm)",
-            "Distance (nm)", "C1 Uncertainty (nm)", "C2 Uncertainty (nm)",
-            "Dipole Angle (degrees)"
-        ])
-    else:
-        c2_idx = np.concatenate([np.asarray(n, dtype=int) for n in neighbors])
-        c1_sel = c1_xy[c1_idx]
-        c2_sel = c2_xy[c2_idx]
-
-        dxy = c2_sel - c1_sel
-        dist = np.sqrt((dxy ** 2).sum(axis=1))
-        angles = (np.degrees(np.arctan2(dxy[:, 1], dxy[:, 0])) + 360) % 360
-
-        distance_df = pd.DataFrame({
-            "C1 X (nm)": c1_sel[:, 0],
-            "C1 Y (nm)": c1_sel[:, 1],
-            "C2 X (nm)": c2_sel[:, 0],
-            "C2 Y (nm)": c2_sel[:, 1],
-            "Distance (nm)": dist,
-            "C1 Uncertainty (nm)": df_c1.loc[c1_idx, UNCERTAINTY_COL].to_numpy(),
-            "C2 Uncertainty (nm)": df_c2.loc[c2_idx, UNCERTAINTY_COL].to_numpy(),
-            "Dipole Angle (degrees)": angles,
-        })
-
-distance_df.to_excel(OUT_XLSX, index=False)
-print(f"Saved output: {OUT_XLSX}")
-
-
-# -------------------------------------------------------------------------------------------------
-# End-to-end distance histogram (NO GRIDLINES + LESS CLUTTERED Y AXIS)
-# -------------------------------------------------------------------------------------------------
-plt.figure(figsize=(10, 6))
-plt.hist(distance_df["Distance (nm)"], bins=30, color="blue", alpha=0.7, edgecolor="black")
-plt.xlabel("Distance (nm)")
-plt.ylabel("Frequency")
-plt.title("END-TO-END DISTANCE DISTRIBUTION (nm)")
-
-# Less clutter: cap number of major ticks
-ax = plt.gca()
-ax.yaxis.set_major_locator(MaxNLocator(nbins=6, integer=True))
-
-# No gridlines here by request
-plt.savefig("Distance_Histogram.png", dpi=300, bbox_inches="tight")
-plt.show()
-
-# Polar histogram of azimuth angles (template)
-plt.figure(figsize=(8, 8))
-ax = plt.subplot(111, projection="polar")
-angles_rad = np.radians(distance_df["Dipole Angle (degrees)"].to_numpy())
-ax.hist(angles_rad, bins=30, color="pink", alpha=0.3, edgecolor="black")
-ax.set_theta_zero_location("E")
-ax.set_theta_direction(1)
-ax.set_title("Dipole Angle Distribution (Degrees)")
-plt.show()
+def pairing_stage(df_c1, df_c2, pairs_a, pairs_b):
+    # Tiling already produced both pairings; otherwise compute them here
+    if pairs_a is None and PART_A_FRAME_WINDOW is not None:
+        pairs_a = window_pair_indices(
+            df_c1, df_c2, RADIUS_NM, PART_A_FRAME_WINDOW, PART_A_BLOCK_FRAMES, frame_col=FRAME_COL, xcol=XCOL, ycol=YCOL
+        )
+    elif pairs_a is None:
+        pairs_a = radius_pair_indices(
+            df_c1[[XCOL, YCOL]].to_numpy(dtype=float), df_c2[[XCOL, YCOL]].to_numpy(dtype=float), RADIUS_NM
+        )
+    if pairs_b is None:
+        pairs_b = frame_pair_indices(df_c1, df_c2, RADIUS_NM, frame_col=FRAME_COL, xcol=XCOL, ycol=YCOL)
+    return pairs_a, pairs_b
+
+
+def geometry_stage(df_c1, df_c2, pairs_b):
+    distance_df_tracked = frame_pair_table(
+        df_c1, df_c2, *pairs_b,
+        id_col=ID_COL, frame_col=FRAME_COL, xcol=XCOL, ycol=YCOL, ucol=UNCERTAINTY_COL
+    )
+    if len(distance_df_tracked) == 0:
+        return distance_df_tracked
+    return add_dipole_geometry(distance_df_tracked, rod_length_nm=ROD_LENGTH_NM)
+
+
+def run_pipeline(writer: BackgroundWriter, array_dir: str, cache: StageCache) -> list[str]:
+    figure_names = []
+    columns = {"id_col": ID_COL, "frame_col": FRAME_COL, "xcol": XCOL, "ycol": YCOL, "ucol": UNCERTAINTY_COL}
+    precision = {"camera": CAMERA, "photon_col": INTENSITY_COL, **PRECISION_OPTIONS} if RECOMPUTE_UNCERTAINTY else None
+
+    # -------------------------------------------------------------------------------------------------
+    # Load CSV files at the top (as requested)
+    # -------------------------------------------------------------------------------------------------
+    c1_filter = dict(
+        lower_unc=lower_threshold_c1, upper_unc=upper_threshold_c1,
+        x_lo=x_lower, x_hi=x_upper, y_lo=y_lower, y_hi=y_upper,
+        intensity_lo=intensity_lower_c1, intensity_hi=intensity_upper_c1,
+        icol=INTENSITY_COL, precision=precision, **columns
+    )
+    c2_filter = dict(
+        lower_unc=lower_threshold_c2, upper_unc=upper_threshold_c2,
+        x_lo=x_lower, x_hi=x_upper, y_lo=y_lower, y_hi=y_upper,
+        intensity_lo=intensity_lower_c2, intensity_hi=intensity_upper_c2,
+        icol=INTENSITY_COL, precision=precision, **columns
+    )
+    df_c1, key_c1 = cache.run("filter", [cache.file_key(C1_CSV)], c1_filter, load_and_filter, C1_CSV, **c1_filter)
+    df_c2, key_c2 = cache.run("filter", [cache.file_key(C2_CSV)], c2_filter, load_and_filter, C2_CSV, **c2_filter)
+
+    print(f"C1 after thresholds: {len(df_c1)}")
+    print(f"C2 after thresholds: {len(df_c2)}")
+
+    # Verify required columns exist (id + frame) before any frame-aware work
+    required_cols = {ID_COL, FRAME_COL, XCOL, YCOL, UNCERTAINTY_COL}
+    missing_c1 = required_cols - set(df_c1.columns)
+    missing_c2 = required_cols - set(df_c2.columns)
+    if missing_c1 or missing_c2:
+        raise ValueError(
+            f"Missing required columns for frame-aware pairing/tracking.\n"
+            f"C1 missing: {sorted(missing_c1)}\n"
+            f"C2 missing: {sorted(missing_c2)}"
+        )
+
+    # -------------------------------------------------------------------------------------------------
+    # APPLY AMBIGUITY DELETION (THIS IS THE HIGH-POPULATION REMOVAL STEP)
+    #   If a same-channel close pair (<= RADIUS_NM) exists AND either member is close to opposite channel
+    #   (<= RADIUS_NM), remove BOTH same-channel puncta AND the opposite-channel puncta within RADIUS_NM.
+    #   In tiling mode the deletion and both pairings run per tile (in parallel) and are stitched back.
+    # -------------------------------------------------------------------------------------------------
+    #   Tiling gives identical tables, so only whether it ran (it also returns the pairings) is part of the key.
+    (df_c1, df_c2, deletion_report, pairs_a, pairs_b), key_ambiguity = cache.run(
+        "ambiguity", [key_c1, key_c2],
+        {"r_nm": RADIUS_NM, "tiled": TILE_NM is not None,
+         "part_a_window": PART_A_FRAME_WINDOW if TILE_NM is not None else None, **columns},
+        ambiguity_stage, df_c1, df_c2
+    )
+    print("High-population ambiguity deletion report:", deletion_report)
+
+    # =================================================================================================
+    # QC SCATTER PLOT (C1 green, C2 red)
+    # =================================================================================================
+    publish_arrays(
+        array_dir,
+        c1_x=df_c1[XCOL].to_numpy(dtype=float), c1_y=df_c1[YCOL].to_numpy(dtype=float),
+        c2_x=df_c2[XCOL].to_numpy(dtype=float), c2_y=df_c2[YCOL].to_numpy(dtype=float),
+    )
+    figure_names += submit_figures(writer, array_dir, ["qc_scatter"], FIGURES_TO_RENDER, FIGURE_OPTIONS)
+
+    # =================================================================================================
+    # PART A: FRAME-AGNOSTIC PAIRING (your template output)
+    #   - Computes all C1–C2 pairs within RADIUS_NM (across all frames)
+    #   - Writes a timestamped Excel output: OUT_XLSX
+    # =================================================================================================
+    (pairs_a, pairs_b), key_pairing = cache.run(
+        "pairing", [key_ambiguity], {"r_nm": RADIUS_NM, "part_a_window": PART_A_FRAME_WINDOW, **columns},
+        pairing_stage, df_c1, df_c2, pairs_a, pairs_b
+    )
+    distance_df = distance_table(df_c1, df_c2, *pairs_a, xcol=XCOL, ycol=YCOL, ucol=UNCERTAINTY_COL)
 
+    # The columnar copy is written after the workbook in the same job, so the plotting scripts never see it as stale
+    writer.write_table(distance_df, OUT_XLSX, columnar_copy=columnar_path(OUT_XLSX) if WRITE_COLUMNAR else None)
 
-# =================================================================================================
-# PART B: FRAME-AWARE PAIRING + Φ/θ + MIDPOINTS + TRACKING + TRACKED OUTPUT + ADDITIONAL PLOTS
-#   - Pairs C1↔C2 ONLY within the same frame
-#   - Computes Φ and θ (as in your second script)
-#   - Tracks dipole midpoints across frames using Hungarian assignment
-#   - Saves TRACKED_XLSX
-# =================================================================================================
-# Verify required columns exist (id + frame)
-required_cols = {ID_COL, FRAME_COL, XCOL, YCOL, UNCERTAINTY_COL}
-missing_c1 = required_cols - set(df_c1.columns)
-missing_c2 = required_cols - set(df_c2.columns)
-if missing_c1 or missing_c2:
-    raise ValueError(
-        f"Missing required columns for frame-aware pairing/tracking.\n"
-        f"C1 missing: {sorted(missing_c1)}\n"
-        f"C2 missing: {sorted(missing_c2)}"
+    # End-to-end distance histogram + polar histogram of azimuth angles (template)
+    publish_arrays(
+        array_dir,
+        pair_distance=distance_df["Distance (nm)"].to_numpy(dtype=float),
+        pair_angle=distance_df["Dipole Angle (degrees)"].to_numpy(dtype=float),
+    )
+    figure_names += submit_figures(writer, array_dir, ["distance_hist", "angle_polar"], FIGURES_TO_RENDER, FIGURE_OPTIONS)
+
+    # =================================================================================================
+    # PART B: FRAME-AWARE PAIRING + Φ/θ + MIDPOINTS + TRACKING + TRACKED OUTPUT + ADDITIONAL PLOTS
+    #   - Pairs C1↔C2 ONLY within the same frame
+    #   - Computes Φ and θ (as in your second script)
+    #   - Tracks dipole midpoints across frames using Hungarian assignment
+    #   - Saves TRACKED_XLSX
+    # =================================================================================================
+    # Same-frame pair table, Φ, θ (rod-length model; θ == 0 removed) and midpoints
+    distance_df_tracked, key_geometry = cache.run(
+        "geometry", [key_pairing], {"rod_length_nm": ROD_LENGTH_NM, **columns},
+        geometry_stage, df_c1, df_c2, pairs_b
     )
 
-# Build per-frame C2 trees
-grouped_c2 = {frame: group.reset_index(drop=True) for frame, group in df_c2.groupby(FRAME_COL)}
-tree_dict = {
-    frame: cKDTree(group[[XCOL, YCOL]].to_numpy(dtype=float))
-    for frame, group in grouped_c2.items()
-}
-
-results = []
-for _, row in df_c1.iterrows():
-    frame_val = row[FRAME_COL]
-    if frame_val not in tree_dict:
-        continue
-
-    idxs = tree_dict[frame_val].query_ball_point([row[XCOL], row[YCOL]], RADIUS_NM)
-    if not idxs:
-        continue
-
-    group = grouped_c2[frame_val]
-    for j in idxs:
-        other_row = group.iloc[j]
-        dx = other_row[XCOL] - row[XCOL]
-        dy = other_row[YCOL] - row[YCOL]
-        dist = float(np.sqrt(dx * dx + dy * dy))
-
-        results.append([
-            row[ID_COL], row[FRAME_COL], row[XCOL], row[YCOL],
-            other_row[ID_COL], other_row[FRAME_COL], other_row[XCOL], other_row[YCOL],
-            dist, row[UNCERTAINTY_COL], other_row[UNCERTAINTY_COL]
-        ])
-
-cols = [
-    "C1 id", "C1 Frame", "C1 X (nm)", "C1 Y (nm)",
-    "C2 id", "C2 Frame", "C2 X (nm)", "C2 Y (nm)",
-    "Distance (nm)", "C1 Uncertainty (nm)", "C2 Uncertainty (nm)"
-]
-distance_df_tracked = pd.DataFrame(results, columns=cols)
-
-if len(distance_df_tracked) == 0:
-    print("No frame-matched dipoles found (after filters). Tracking and tracked plots skipped.")
-else:
-    # Φ
-    dxy_x = distance_df_tracked["C2 X (nm)"].to_numpy() - distance_df_tracked["C1 X (nm)"].to_numpy()
-    dxy_y = distance_df_tracked["C2 Y (nm)"].to_numpy() - distance_df_tracked["C1 Y (nm)"].to_numpy()
-    phi_deg = (np.degrees(np.arctan2(dxy_y, dxy_x)) + 360) % 360
-    distance_df_tracked["Φ (degrees)"] = phi_deg
-
-    # θ (your provided model)
-    ratio = np.clip(distance_df_tracked["Distance (nm)"].to_numpy() / 120.0, -1.0, 1.0)
-    theta_deg = np.degrees(np.arccos(ratio))
-    distance_df_tracked["θ (degrees)"] = theta_deg
-
-    # Remove θ == 0 (as your second script)
-    distance_df_tracked = distance_df_tracked[distance_df_tracked["θ (degrees)"] != 0].reset_index(drop=True)
-
-    # Midpoints
-    distance_df_tracked["mid_x"] = (distance_df_tracked["C1 X (nm)"] + distance_df_tracked["C2 X (nm)"]) / 2.0
-    distance_df_tracked["mid_y"] = (distance_df_tracked["C1 Y (nm)"] + distance_df_tracked["C2 Y (nm)"]) / 2.0
+    if len(distance_df_tracked) == 0:
+        print("No frame-matched dipoles found (after filters). Tracking and tracked plots skipped.")
+        return figure_names
 
     # TRACKING across frames
-    distance_df_tracked = distance_df_tracked.sort_values(by="C1 Frame").reset_index(drop=True)
-    distance_df_tracked["Track ID"] = np.nan
-
-    unique_frames = sorted(distance_df_tracked["C1 Frame"].unique())
-    next_track_id = 1
-    tracks_prev = {}  # track_id -> last midpoint position
-
-    for frame in unique_frames:
-        mask = distance_df_tracked["C1 Frame"] == frame
-        current = distance_df_tracked.loc[mask].copy()
-        curr_pos = current[["mid_x", "mid_y"]].to_numpy()
-
-        if frame == unique_frames[0]:
-            n = len(current)
-            if n > 0:
-                new_ids = np.arange(next_track_id, next_track_id + n)
-                distance_df_tracked.loc[mask, "Track ID"] = new_ids
-                next_track_id += n
-                for k, idx in enumerate(current.index):
-                    tracks_prev[int(new_ids[k])] = np.array([
-                        distance_df_tracked.loc[idx, "mid_x"],
-                        distance_df_tracked.loc[idx, "mid_y"]
-                    ])
-            continue
-
-        if len(tracks_prev) == 0 or len(curr_pos) == 0:
-            n = len(curr_pos)
-            if n > 0:
-                new_ids = np.arange(next_track_id, next_track_id + n)
-                distance_df_tracked.loc[mask, "Track ID"] = new_ids
-                next_track_id += n
-                for k, idx in enumerate(current.index):
-                    tracks_prev[int(new_ids[k])] = np.array([
-                        distance_df_tracked.loc[idx, "mid_x"],
-                        distance_df_tracked.loc[idx, "mid_y"]
-                    ])
-            continue
-
-        prev_ids = list(tracks_prev.keys())
-        prev_pos = np.vstack([tracks_prev[t] for t in prev_ids])
-
-        cost = cdist(prev_pos, curr_pos)
-        r_ind, c_ind = linear_sum_assignment(cost)
-
-        assigned = np.full(len(curr_pos), np.nan)
-        for r, c in zip(r_ind, c_ind):
-            if cost[r, c] < TRACK_LINK_NM:
-                assigned[c] = prev_ids[r]
-
-        for i in range(len(curr_pos)):
-            if np.isnan(assigned[i]):
-                assigned[i] = next_track_id
-                next_track_id += 1
-
-        distance_df_tracked.loc[mask, "Track ID"] = assigned
-
-        current_ids = distance_df_tracked.loc[mask, "Track ID"].to_numpy().astype(int)
-        for i, idx in enumerate(current.index):
-            tracks_prev[int(current_ids[i])] = np.array([
-                distance_df_tracked.loc[idx, "mid_x"],
-                distance_df_tracked.loc[idx, "mid_y"]
-            ])
+    # With gap closing, the first pass only continues tracks seen in the previous frame (a blink ends the segment) and the
+    # segments are joined below; without it, a track can be continued after any number of missing frames.
+    memory_frames = 1 if CLOSE_TRACK_GAPS else None
+    distance_df_tracked, key_tracking = cache.run(
+        "tracking", [key_geometry], {"link_nm": TRACK_LINK_NM, "memory_frames": memory_frames},
+        track_midpoints, distance_df_tracked, link_nm=TRACK_LINK_NM, memory_frames=memory_frames
+    )
+
+    # GAP CLOSING: join segments across blinks / long jumps (one global sparse assignment); original IDs -> "Segment ID"
+    if CLOSE_TRACK_GAPS:
+        (distance_df_tracked, gap_report), _ = cache.run(
+            "gap_closing", [key_tracking],
+            {"max_gap_frames": GAP_CLOSE_MAX_FRAMES, "max_distance_nm": GAP_CLOSE_NM, "gap_penalty_nm": GAP_CLOSE_PENALTY_NM},
+            close_track_gaps, distance_df_tracked,
+            max_gap_frames=GAP_CLOSE_MAX_FRAMES, max_distance_nm=GAP_CLOSE_NM, gap_penalty_nm=GAP_CLOSE_PENALTY_NM
+        )
+        print("Gap closing report:", gap_report)
 
     # SAVE TRACKED EXCEL (timestamped)
-    with pd.ExcelWriter(TRACKED_XLSX, engine="xlsxwriter") as writer:
-        distance_df_tracked.to_excel(writer, sheet_name="Master", index=False)
-        for track_id, group in distance_df_tracked.groupby("Track ID"):
-            group_sorted = group.sort_values("C1 Frame")
-            track_df = group_sorted[[
-                "C1 Frame", "Distance (nm)", "Φ (degrees)", "θ (degrees)",
-                "C1 X (nm)", "C1 Y (nm)", "C2 X (nm)", "C2 Y (nm)"
-            ]]
-            track_df.to_excel(writer, sheet_name=f"Track_{int(track_id)}", index=False)
-
-    print(f"Saved tracked output: {TRACKED_XLSX}")
-
-    # GLOBAL ANALYSIS PLOTS (tracked set)
-    plt.figure(figsize=(10, 6))
-    plt.hist(distance_df_tracked["Distance (nm)"], bins=30, color="blue", alpha=0.7, edgecolor="black")
-    plt.xlabel("Distance (nm)")
-    plt.ylabel("Frequency")
-    plt.title("End-to-End Distance Distribution (nm) - All Tracks")
-    plt.savefig("Distance_Histogram_Filtered.png", dpi=300, bbox_inches="tight")
-    plt.show()
-
-    plt.figure(figsize=(8, 6))
-    plt.scatter(distance_df_tracked["Φ (degrees)"], distance_df_tracked["Distance (nm)"], color="purple", alpha=0.5)
-    plt.xlabel("Φ Angle (degrees)")
-    plt.ylabel("End-to-End Distance (nm)")
-    plt.title("Scatter Plot: Distance vs. Φ Angle (All Tracks)")
-    plt.grid(True)
-    plt.show()
+    writer.write_tracked_workbook(
+        distance_df_tracked, TRACKED_XLSX, columnar_copy=columnar_path(TRACKED_XLSX) if WRITE_COLUMNAR else None
+    )
+
+    # MERGEABLE SUMMARY (distance / Φ / θ histograms + Φ–distance running sums, no rows kept)
+    if SAVE_SUMMARY_ACCUMULATOR:
+        # Distance bins follow RADIUS_NM (FOVs analysed with the same radius can be merged)
+        summary_acc = update_from_table(new_dipole_accumulator(distance_edges_for(RADIUS_NM)), distance_df_tracked)
+        print(f"Saved summary accumulator: {save_accumulator(summary_acc, SUMMARY_NPZ)}")
+        outside = out_of_range_counts(summary_acc)
+        if outside:
+            print(f"Warning: summary accumulator values outside its histogram bins: {outside}")
+
+    # ROTATIONAL AUTOCORRELATION OF Φ (batched FFT over all tracks, gaps masked)
+    if COMPUTE_ROTATIONAL_ACF:
+        acf_curves, acf_ensemble, acf_summary, acf_report = rotational_autocorrelation(
+            distance_df_tracked, max_lag=ACF_MAX_LAG, fit_max_lag=ACF_FIT_MAX_LAG
+        )
+        print("Rotational autocorrelation report:", acf_report)
+
+        writer.write_sheets({"Ensemble": acf_ensemble, "Per-track τ": acf_summary}, ROT_ACF_XLSX)
+        writer.write_table(acf_curves, ROT_ACF_CURVES)
+
+        publish_arrays(
+            array_dir,
+            acf_lag=acf_ensemble["Lag (frames)"].to_numpy(dtype=float),
+            acf_c=acf_ensemble["C(τ)"].to_numpy(dtype=float),
+            acf_tau=np.array([acf_report["tau_ensemble_frames"]], dtype=float),
+        )
+        figure_names += submit_figures(writer, array_dir, ["rotational_acf"], FIGURES_TO_RENDER, FIGURE_OPTIONS)
+
+    # GLOBAL ANALYSIS PLOTS (tracked set): histogram, Φ vs distance, θ/Φ midpoint maps, Φ arrow overlays
+    publish_arrays(
+        array_dir,
+        dipole_distance=distance_df_tracked["Distance (nm)"].to_numpy(dtype=float),
+        dipole_phi=distance_df_tracked["Φ (degrees)"].to_numpy(dtype=float),
+        dipole_theta=distance_df_tracked["θ (degrees)"].to_numpy(dtype=float),
+        mid_x=distance_df_tracked["mid_x"].to_numpy(dtype=float),
+        mid_y=distance_df_tracked["mid_y"].to_numpy(dtype=float),
+    )
+    figure_names += submit_figures(writer, array_dir, [
+        "distance_hist_tracked", "phi_vs_distance",
+        "midpoint_theta", "midpoint_phi", "midpoint_phi_arrows", "midpoint_theta_arrows",
+    ], FIGURES_TO_RENDER, FIGURE_OPTIONS)
 
     if len(distance_df_tracked) > 1:
         corr_phi, p_val_phi = pearsonr(distance_df_tracked["Φ (degrees)"], distance_df_tracked["Distance (nm)"])
         print(f"Φ Pearson Correlation: {corr_phi:.4f}, P-Value: {p_val_phi:.4f}")
 
-    # Midpoints colored by θ
-    plt.figure(figsize=(10, 8))
-    sc = plt.scatter(
-        distance_df_tracked["mid_x"], distance_df_tracked["mid_y"],
-        c=distance_df_tracked["θ (degrees)"],
-        cmap="viridis", vmin=0, vmax=90,
-        s=20, alpha=0.9,
-        edgecolors="k", linewidths=0.1
-    )
-    cbar = plt.colorbar(sc)
-    cbar.set_label("θ (degrees)", rotation=270, labelpad=15)
-    plt.xlabel("X Position (nm)")
-    plt.ylabel("Y Position (nm)")
-    plt.title("Dipole Midpoints Colored by θ Angle")
-    plt.grid(True)
-    plt.gca().invert_yaxis()
-    plt.savefig("midpoint_theta_colormap.png", dpi=300, bbox_inches="tight")
-    plt.show()
-
-    # Midpoints colored by Φ
-    plt.figure(figsize=(10, 8))
-    sc_phi = plt.scatter(
-        distance_df_tracked["mid_x"], distance_df_tracked["mid_y"],
-        c=distance_df_tracked["Φ (degrees)"],
-        cmap="plasma", vmin=0, vmax=360,
-        s=20, alpha=0.9,
-        edgecolors="k", linewidths=0.1
-    )
-    cbar_phi = plt.colorbar(sc_phi)
-    cbar_phi.set_label("Φ (degrees)", rotation=270, labelpad=15)
-    plt.xlabel("X Position (nm)")
-    plt.ylabel("Y Position (nm)")
-    plt.title("Dipole Midpoints Colored by Φ Angle")
-    plt.grid(True)
-    plt.gca().invert_yaxis()
-    plt.savefig("midpoint_phi_colormap.png", dpi=300, bbox_inches="tight")
-    plt.show()
-
-    # Midpoints colored by Φ with arrows
-    plt.figure(figsize=(10, 8))
-    sc_phi2 = plt.scatter(
-        distance_df_tracked["mid_x"], distance_df_tracked["mid_y"],
-        c=distance_df_tracked["Φ (degrees)"],
-        cmap="plasma", vmin=0, vmax=360,
-        s=20, alpha=0.9,
-        edgecolors="k", linewidths=0.1
-    )
-
-    arrow_length = 1800.0
-    phi_rad = np.radians(distance_df_tracked["Φ (degrees)"].to_numpy())
-    dx = np.cos(phi_rad) * arrow_length
-    dy = np.sin(phi_rad) * arrow_length
-
-    plt.quiver(
-        distance_df_tracked["mid_x"], distance_df_tracked["mid_y"],
-        dx, dy,
-        angles="xy", scale_units="xy", scale=1,
-        color="black", width=0.0025, alpha=0.7
-    )
-
-    cbar_phi2 = plt.colorbar(sc_phi2)
-    cbar_phi2.set_label("Φ (degrees)", rotation=270, labelpad=15)
-    plt.xlabel("X Position (nm)")
-    plt.ylabel("Y Position (nm)")
-    plt.title("Dipole Midpoints Colored by Φ Angle with Arrows")
-    plt.grid(True)
-    plt.gca().invert_yaxis()
-    plt.savefig("midpoint_phi_colormap_arrows.png", dpi=300, bbox_inches="tight")
-    plt.show()
-
-    # Midpoints colored by θ with Φ arrows
-    plt.figure(figsize=(10, 8))
-    sc_theta = plt.scatter(
-        distance_df_tracked["mid_x"], distance_df_tracked["mid_y"],
-        c=distance_df_tracked["θ (degrees)"],
-        cmap="viridis", vmin=0, vmax=90,
-        s=20, alpha=0.9,
-        edgecolors="k", linewidths=0.1
-    )
+    return figure_names
 
-    plt.quiver(
-        distance_df_tracked["mid_x"], distance_df_tracked["mid_y"],
-        dx, dy,
-        angles="xy", scale_units="xy", scale=1,
-        color="black", width=0.0025, alpha=0.7
-    )
 
-    cbar_theta = plt.colorbar(sc_theta)
-    cbar_theta.set_label("θ (degrees)", rotation=270, labelpad=15)
-    plt.xlabel("X Position (nm)")
-    plt.ylabel("Y Position (nm)")
-    plt.title("Dipole Midpoints Colored by θ Angle with Φ Arrows")
-    plt.grid(True)
-    plt.gca().invert_yaxis()
-    plt.savefig("midpoint_theta_colormap_arrows.png", dpi=300, bbox_inches="tight")
-    plt.show()
+if __name__ == "__main__":
+    main()
@@ -1,15 +1,18 @@
-import pandas as pd
 import numpy as np
 import matplotlib.pyplot as plt
 from matplotlib.colors import LinearSegmentedColormap, Normalize
 from matplotlib.cm import ScalarMappable
 
+from smlm_io import read_table_cached
+
 # =============================================================================
 # INPUT (EDIT THIS ONE LINE AS NEEDED)
 # =============================================================================
-# Load the Excel file
+# Pipeline output: the .parquet/.npz written next to the Excel file loads fastest.
+# An Excel file also works; it is converted once and the cached copy is used on later runs.
 filename = 'End-to-end distance_20260115_204819.xlsx'
-data = pd.read_excel(filename)
+COORD_COLS = ["C1 X (nm)", "C1 Y (nm)", "C2 X (nm)", "C2 Y (nm)"]
+data = read_table_cached(filename, columns=COORD_COLS)
 
 # =============================================================================
 # COMPUTE VECTORS / MIDPOINTS / DISTANCES / ANGLES
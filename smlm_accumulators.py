@@ -0,0 +1,306 @@
+#################################################################################################################################
+#################################   MERGEABLE STREAMING SUMMARY ACCUMULATORS (DISTANCE / Φ / θ)   ###############################
+#################################################################################################################################
+#
+# The summary figures (distance histogram, polar Φ histogram, θ distribution) and the Φ–distance Pearson correlation only
+# need fixed-bin counts and running sums, not the dipole rows themselves. An accumulator is a plain dict of NumPy arrays:
+#
+#   - updated from array batches (one FOV, one chunk of a FOV, ...)
+#   - merged across processes / FOVs by adding counts and sums
+#   - saved as a small .npz file (a few kB, independent of the number of rows)
+#
+# Key naming decides how two accumulators merge:
+#   *_edges, *_shift  -> configuration, must be identical
+#   *_min / *_max     -> element-wise minimum / maximum
+#   everything else   -> added
+#
+# Pearson r between Φ and distance is rebuilt from shifted running sums (n, Σx, Σy, Σx², Σy², Σxy); the shift keeps the
+# sums well conditioned. The p-value uses the same exact null distribution as scipy.stats.pearsonr.
+#################################################################################################################################
+
+import numpy as np
+import pandas as pd
+import matplotlib.pyplot as plt
+
+from scipy import stats
+
+
+# =================================================================================================
+# DEFAULT BINNING (fixed so accumulators from different FOVs can be merged)
+# =================================================================================================
+DISTANCE_BIN_NM = 5.0
+DISTANCE_EDGES = np.linspace(0.0, 240.0, 49)     # 5 nm bins up to just above RADIUS_NM = 232 (see distance_edges_for)
+PHI_EDGES = np.linspace(0.0, 360.0, 37)          # 10° bins, circular
+THETA_EDGES = np.linspace(0.0, 90.0, 31)         # 3° bins
+
+DISTANCE_SHIFT = 120.0                           # running sums are taken about these values
+PHI_SHIFT = 180.0
+
+DISTANCE_COL = "Distance (nm)"
+PHI_COL = "Φ (degrees)"
+THETA_COL = "θ (degrees)"
+
+
+def distance_edges_for(radius_nm: float, bin_nm: float = DISTANCE_BIN_NM) -> np.ndarray:
+    """Distance bins covering every pair a run with this pairing radius can produce (DISTANCE_EDGES for 232 nm)."""
+    n_bins = int(np.ceil(radius_nm / bin_nm)) + 1
+    return np.linspace(0.0, n_bins * bin_nm, n_bins + 1)
+
+
+def out_of_range_counts(acc: dict) -> dict[str, int]:
+    """Values outside the histogram bins (they are in the moments but not in the saved / plotted histograms)."""
+    counts = {}
+    for name in ("distance", "phi", "theta"):
+        for side in ("under", "over"):
+            if int(acc[f"{name}_{side}"]):
+                counts[f"{name}_{side}"] = int(acc[f"{name}_{side}"])
+    return counts
+
+
+# =================================================================================================
+# CREATE / UPDATE
+# =================================================================================================
+def new_dipole_accumulator(
+    distance_edges: np.ndarray = DISTANCE_EDGES,
+    phi_edges: np.ndarray = PHI_EDGES,
+    theta_edges: np.ndarray = THETA_EDGES,
+    distance_shift: float = DISTANCE_SHIFT,
+    phi_shift: float = PHI_SHIFT,
+) -> dict:
+    acc = {
+        "distance_edges": np.asarray(distance_edges, dtype=float),
+        "phi_edges": np.asarray(phi_edges, dtype=float),
+        "theta_edges": np.asarray(theta_edges, dtype=float),
+        "distance_shift": np.array(float(distance_shift)),
+        "phi_shift": np.array(float(phi_shift)),
+    }
+    for name in ("distance", "phi", "theta"):
+        acc[f"{name}_counts"] = np.zeros(len(acc[f"{name}_edges"]) - 1, dtype=np.int64)
+        acc[f"{name}_under"] = np.array(0, dtype=np.int64)
+        acc[f"{name}_over"] = np.array(0, dtype=np.int64)
+        acc[f"{name}_nan"] = np.array(0, dtype=np.int64)
+        acc[f"{name}_n"] = np.array(0, dtype=np.int64)
+        acc[f"{name}_sum"] = np.array(0.0)
+        acc[f"{name}_sumsq"] = np.array(0.0)
+        acc[f"{name}_min"] = np.array(np.inf)
+        acc[f"{name}_max"] = np.array(-np.inf)
+
+    # circular statistics for Φ
+    acc["phi_sum_cos"] = np.array(0.0)
+    acc["phi_sum_sin"] = np.array(0.0)
+
+    # Φ–distance co-moments (shifted), rows where both are finite
+    acc["pair_n"] = np.array(0, dtype=np.int64)
+    acc["pair_sum_x"] = np.array(0.0)
+    acc["pair_sum_y"] = np.array(0.0)
+    acc["pair_sum_xx"] = np.array(0.0)
+    acc["pair_sum_yy"] = np.array(0.0)
+    acc["pair_sum_xy"] = np.array(0.0)
+    return acc
+
+
+def _update_one(acc: dict, name: str, values: np.ndarray, shift: float = 0.0) -> None:
+    values = np.asarray(values, dtype=float).ravel()
+    finite = np.isfinite(values)
+    acc[f"{name}_nan"] += int((~finite).sum())
+    v = values[finite]
+    if v.size == 0:
+        return
+
+    edges = acc[f"{name}_edges"]
+    if name == "phi":
+        v = np.mod(v - edges[0], edges[-1] - edges[0]) + edges[0]   # wrap onto the circle
+
+    counts, _ = np.histogram(v, bins=edges)
+    acc[f"{name}_counts"] += counts
+    acc[f"{name}_under"] += int((v < edges[0]).sum())
+    acc[f"{name}_over"] += int((v > edges[-1]).sum())
+
+    s = v - shift
+    acc[f"{name}_n"] += v.size
+    acc[f"{name}_sum"] += s.sum()
+    acc[f"{name}_sumsq"] += (s * s).sum()
+    acc[f"{name}_min"] = np.minimum(acc[f"{name}_min"], v.min())
+    acc[f"{name}_max"] = np.maximum(acc[f"{name}_max"], v.max())
+
+
+def update_dipole_accumulator(acc: dict, distance: np.ndarray, phi_deg: np.ndarray, theta_deg: np.ndarray | None = None) -> dict:
+    distance = np.asarray(distance, dtype=float).ravel()
+    phi_deg = np.asarray(phi_deg, dtype=float).ravel()
+
+    _update_one(acc, "distance", distance, float(acc["distance_shift"]))
+    _update_one(acc, "phi", phi_deg, float(acc["phi_shift"]))
+    if theta_deg is not None:
+        _update_one(acc, "theta", theta_deg)
+
+    phi_rad = np.radians(phi_deg[np.isfinite(phi_deg)])
+    acc["phi_sum_cos"] += np.cos(phi_rad).sum()
+    acc["phi_sum_sin"] += np.sin(phi_rad).sum()
+
+    both = np.isfinite(distance) & np.isfinite(phi_deg)
+    x = phi_deg[both] - float(acc["phi_shift"])
+    y = distance[both] - float(acc["distance_shift"])
+    acc["pair_n"] += int(both.sum())
+    acc["pair_sum_x"] += x.sum()
+    acc["pair_sum_y"] += y.sum()
+    acc["pair_sum_xx"] += (x * x).sum()
+    acc["pair_sum_yy"] += (y * y).sum()
+    acc["pair_sum_xy"] += (x * y).sum()
+    return acc
+
+
+def update_from_table(acc: dict, df: pd.DataFrame, distance_col: str = DISTANCE_COL,
+                      phi_col: str = PHI_COL, theta_col: str | None = THETA_COL) -> dict:
+    theta = df[theta_col].to_numpy(dtype=float) if theta_col is not None and theta_col in df.columns else None
+    return update_dipole_accumulator(acc, df[distance_col].to_numpy(dtype=float), df[phi_col].to_numpy(dtype=float), theta)
+
+
+# =================================================================================================
+# MERGE / SAVE / LOAD
+# =================================================================================================
+def merge_accumulators(a: dict, b: dict) -> dict:
+    if set(a) != set(b):
+        raise ValueError(f"Accumulators have different fields: {sorted(set(a) ^ set(b))}")
+
+    merged = {}
+    for key in a:
+        if key.endswith("_edges") or key.endswith("_shift"):
+            if a[key].shape != b[key].shape or not np.array_equal(a[key], b[key]):
+                raise ValueError(f"Cannot merge accumulators with different '{key}'.")
+            merged[key] = a[key].copy()
+        elif key.endswith("_min"):
+            merged[key] = np.minimum(a[key], b[key])
+        elif key.endswith("_max"):
+            merged[key] = np.maximum(a[key], b[key])
+        else:
+            merged[key] = a[key] + b[key]
+    return merged
+
+
+def save_accumulator(acc: dict, path: str) -> str:
+    np.savez(path, **acc)
+    return path if path.endswith(".npz") else path + ".npz"
+
+
+def load_accumulator(path: str) -> dict:
+    with np.load(path, allow_pickle=False) as npz:
+        return {key: npz[key] for key in npz.files}
+
+
+# =================================================================================================
+# STATISTICS FROM AN ACCUMULATOR
+# =================================================================================================
+def accumulator_pearsonr(acc: dict) -> tuple[float, float]:
+    """Φ–distance Pearson r and two-sided p-value, identical in definition to scipy.stats.pearsonr."""
+    n = int(acc["pair_n"])
+    if n < 2:
+        return np.nan, np.nan
+
+    sxx = float(acc["pair_sum_xx"]) - float(acc["pair_sum_x"]) ** 2 / n
+    syy = float(acc["pair_sum_yy"]) - float(acc["pair_sum_y"]) ** 2 / n
+    sxy = float(acc["pair_sum_xy"]) - float(acc["pair_sum_x"]) * float(acc["pair_sum_y"]) / n
+    if sxx <= 0 or syy <= 0:
+        return np.nan, np.nan
+
+    r = float(np.clip(sxy / np.sqrt(sxx * syy), -1.0, 1.0))
+    if n == 2:
+        return r, 1.0
+    dist = stats.beta(n / 2 - 1, n / 2 - 1, loc=-1, scale=2)
+    return r, float(2 * dist.sf(abs(r)))
+
+
+def accumulator_summary(acc: dict) -> dict:
+    summary = {}
+    for name in ("distance", "phi", "theta"):
+        n = int(acc[f"{name}_n"])
+        shift = float(acc.get(f"{name}_shift", 0.0))
+        mean = float(acc[f"{name}_sum"]) / n + shift if n else np.nan
+        var = (float(acc[f"{name}_sumsq"]) - float(acc[f"{name}_sum"]) ** 2 / n) / (n - 1) if n > 1 else np.nan
+        summary[f"{name}_n"] = n
+        summary[f"{name}_mean"] = mean
+        summary[f"{name}_std"] = float(np.sqrt(max(var, 0.0))) if n > 1 else np.nan
+
+    n_phi = int(acc["phi_n"])
+    if n_phi:
+        c, s = float(acc["phi_sum_cos"]) / n_phi, float(acc["phi_sum_sin"]) / n_phi
+        summary["phi_circular_mean"] = float(np.degrees(np.arctan2(s, c)) % 360)
+        summary["phi_resultant_length"] = float(np.hypot(c, s))
+    else:
+        summary["phi_circular_mean"] = np.nan
+        summary["phi_resultant_length"] = np.nan
+
+    summary["pearson_r_phi_distance"], summary["pearson_p_phi_distance"] = accumulator_pearsonr(acc)
+    return summary
+
+
+# =================================================================================================
+# PLOTS FROM AN ACCUMULATOR (same figures as the pipeline, from counts only)
+# =================================================================================================
+def plot_accumulator(acc: dict, prefix: str = "Merged", show: bool = True) -> None:
+    outside = out_of_range_counts(acc)
+    if outside:
+        print(f"Warning: values outside the histogram bins are not plotted: {outside}")
+
+    edges = acc["distance_edges"]
+    plt.figure(figsize=(10, 6))
+    plt.stairs(acc["distance_counts"], edges, fill=True, color="blue", alpha=0.7)
+    plt.stairs(acc["distance_counts"], edges, color="black")
+    plt.xlabel("Distance (nm)")
+    plt.ylabel("Frequency")
+    plt.title(f"End-to-End Distance Distribution (nm) - {prefix}")
+    plt.savefig(f"{prefix}_Distance_Histogram.png", dpi=300, bbox_inches="tight")
+    if show:
+        plt.show()
+
+    edges = np.radians(acc["phi_edges"])
+    plt.figure(figsize=(8, 8))
+    ax = plt.subplot(111, projection="polar")
+    ax.bar(edges[:-1], acc["phi_counts"], width=np.diff(edges), align="edge",
+           color="pink", alpha=0.3, edgecolor="black")
+    ax.set_theta_zero_location("E")
+    ax.set_theta_direction(1)
+    ax.set_title(f"Φ Distribution (Degrees) - {prefix}")
+    plt.savefig(f"{prefix}_Phi_Polar_Histogram.png", dpi=300, bbox_inches="tight")
+    if show:
+        plt.show()
+
+    edges = acc["theta_edges"]
+    plt.figure(figsize=(10, 6))
+    plt.stairs(acc["theta_counts"], edges, fill=True, color="teal", alpha=0.7)
+    plt.stairs(acc["theta_counts"], edges, color="black")
+    plt.xlabel("θ (degrees)")
+    plt.ylabel("Frequency")
+    plt.title(f"θ Distribution - {prefix}")
+    plt.savefig(f"{prefix}_Theta_Histogram.png", dpi=300, bbox_inches="tight")
+    if show:
+        plt.show()
+
+    corr_phi, p_val_phi = accumulator_pearsonr(acc)
+    print(f"Φ Pearson Correlation: {corr_phi:.4f}, P-Value: {p_val_phi:.4f}")
+
+
+# =================================================================================================
+# STANDALONE USE: merge per-FOV accumulators (.npz) and/or tracked tables, then plot
+#   python smlm_accumulators.py Dipole_Summary_FOV1.npz Dipole_Summary_FOV2.npz Tracked_Dipoles_FOV3.parquet ...
+# =================================================================================================
+if __name__ == "__main__":
+    import sys
+    from smlm_io import read_table_cached
+
+    merged = None
+    for path in sys.argv[1:]:
+        acc = load_accumulator(path) if path.endswith(".npz") else None
+        if acc is None or "__columns__" in acc:     # a columnar table written by smlm_io, not an accumulator
+            # bin a table like the accumulators already loaded so the two can be merged
+            edges = DISTANCE_EDGES if merged is None else merged["distance_edges"]
+            table = read_table_cached(path, columns=[DISTANCE_COL, PHI_COL, THETA_COL])
+            acc = update_from_table(new_dipole_accumulator(distance_edges=edges), table)
+        merged = acc if merged is None else merge_accumulators(merged, acc)
+        print(f"Added {path}")
+
+    if merged is None:
+        raise SystemExit("Usage: python smlm_accumulators.py <accumulator.npz | tracked table> ...")
+
+    print(f"Saved merged accumulator: {save_accumulator(merged, 'Merged_Dipole_Summary.npz')}")
+    print("Merged summary:", accumulator_summary(merged))
+    plot_accumulator(merged)
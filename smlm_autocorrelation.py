@@ -0,0 +1,301 @@
+#################################################################################################################################
+#################################   ROTATIONAL AUTOCORRELATION OF Φ (BATCHED FFT)   #############################################
+#################################################################################################################################
+#
+# Rotational dynamics of the DNA origami protractor from the "Tracked Dipoles" output.
+#
+# For every track the in-plane unit vector u(t) = (cos Φ, sin Φ) is correlated with itself:
+#
+#       C(τ) = < u(t) · u(t + τ) > = < cos(Φ(t + τ) − Φ(t)) >
+#
+# Instead of looping over tracks in Python, tracks are packed into padded, masked 2D arrays (one row per track),
+# bucketed by the FFT length their frame span needs, and all rows of a bucket are correlated with one batched rFFT.
+# Frames where a dipole blinked off are masked out, so gaps contribute neither to the sums nor to the pair counts:
+#
+#       C(τ) = Σ_t m(t) m(t+τ) u(t)·u(t+τ)  /  Σ_t m(t) m(t+τ)
+#
+# Buckets are processed in chunks of rows so memory stays bounded no matter how many / how long the tracks are.
+# Correlation times come from a single-exponential model C(τ) = exp(−τ / τ_r), fitted on ln C(τ) (weighted by the
+# number of contributing frame pairs), which vectorizes over all tracks at once.
+#
+# Can be imported by the pipeline or run directly on a "Tracked_Dipoles_<ts>.xlsx" workbook.
+#################################################################################################################################
+
+import numpy as np
+import pandas as pd
+
+
+# =================================================================================================
+# COLUMN NAMES (match the "Master" sheet of the tracked output)
+# =================================================================================================
+TRACK_COL = "Track ID"
+TRACK_FRAME_COL = "C1 Frame"
+PHI_COL = "Φ (degrees)"
+
+# =================================================================================================
+# PARAMETERS
+# =================================================================================================
+MAX_CHUNK_ELEMENTS = 2 ** 22   # upper bound on (rows × FFT length) processed at once, per bucket chunk
+MIN_TRACK_POINTS = 2           # tracks with fewer observed frames carry no lag > 0 information
+FIT_MAX_LAG = 20               # largest lag (frames) used when fitting τ_r
+FIT_MIN_PAIRS = 1              # lags with fewer contributing frame pairs are ignored in the fit
+
+
+# =================================================================================================
+# PACKING
+#   - One row per track, column = frame offset from the first frame of the track
+#   - Rows are grouped by FFT length (next power of two >= 2 × span, so circular wrap-around never mixes lags)
+# =================================================================================================
+def _pack_tracks(
+    df: pd.DataFrame,
+    track_col: str,
+    frame_col: str,
+    phi_col: str,
+    min_points: int,
+) -> tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+
+    d = df[[track_col, frame_col, phi_col]].dropna()
+    d = d.drop_duplicates(subset=[track_col, frame_col], keep="first")
+    d = d.sort_values([track_col, frame_col], kind="mergesort")
+
+    track_ids = d[track_col].to_numpy()
+    frames = d[frame_col].to_numpy(dtype=np.int64)
+    phi = np.radians(d[phi_col].to_numpy(dtype=float))
+
+    if track_ids.size == 0:
+        empty = np.empty(0, dtype=np.int64)
+        return np.empty(0), empty, empty, empty, empty, np.empty(0)
+
+    starts = np.flatnonzero(np.r_[True, track_ids[1:] != track_ids[:-1]])
+    counts = np.diff(np.r_[starts, track_ids.size])
+    keep = counts >= min_points
+
+    first_frame = np.repeat(frames[starts], counts)
+    offsets = frames - first_frame
+    row_of_point = np.repeat(np.arange(starts.size), counts)
+    spans = np.maximum.reduceat(offsets, starts) + 1
+
+    point_keep = keep[row_of_point]
+    new_row = np.cumsum(keep) - 1
+    return (
+        track_ids[starts][keep],
+        counts[keep],
+        spans[keep],
+        new_row[row_of_point[point_keep]],
+        offsets[point_keep],
+        phi[point_keep],
+    )
+
+
+def _next_pow2(n: np.ndarray) -> np.ndarray:
+    return (2 ** np.ceil(np.log2(np.maximum(n, 1)))).astype(np.int64)
+
+
+# =================================================================================================
+# BATCHED MASKED AUTOCORRELATION
+#   Returns, for one chunk of rows, the lag sums Σ m m' u·u' and the pair counts Σ m m' for lags 0..nfft/2-1
+# =================================================================================================
+def _masked_acf_sums(cos_mat: np.ndarray, sin_mat: np.ndarray, mask_mat: np.ndarray, nfft: int) -> tuple[np.ndarray, np.ndarray]:
+    f_cos = np.fft.rfft(cos_mat, n=nfft, axis=1)
+    f_sin = np.fft.rfft(sin_mat, n=nfft, axis=1)
+    f_msk = np.fft.rfft(mask_mat, n=nfft, axis=1)
+
+    num = np.fft.irfft(f_cos.real ** 2 + f_cos.imag ** 2 + f_sin.real ** 2 + f_sin.imag ** 2, n=nfft, axis=1)
+    den = np.fft.irfft(f_msk.real ** 2 + f_msk.imag ** 2, n=nfft, axis=1)
+
+    half = nfft // 2
+    return num[:, :half], np.rint(den[:, :half])
+
+
+# =================================================================================================
+# SINGLE-EXPONENTIAL FIT (vectorized over rows)
+#   ln C(τ) = −τ / τ_r, weighted least squares through the origin over valid lags
+# =================================================================================================
+def fit_rotational_time(lags: np.ndarray, acf: np.ndarray, pairs: np.ndarray,
+                        fit_max_lag: int = FIT_MAX_LAG, min_pairs: int = FIT_MIN_PAIRS) -> np.ndarray:
+    acf = np.atleast_2d(acf)
+    pairs = np.atleast_2d(pairs)
+    lags = np.broadcast_to(np.asarray(lags, dtype=float), acf.shape)
+
+    valid = (lags >= 1) & (lags <= fit_max_lag) & (pairs >= min_pairs) & np.isfinite(acf) & (acf > 0)
+    w = np.where(valid, pairs, 0.0)
+    log_c = np.log(np.where(valid, acf, 1.0))
+
+    sxx = (w * lags * lags).sum(axis=1)
+    sxy = (w * lags * log_c).sum(axis=1)
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        slope = np.where(sxx > 0, sxy / sxx, np.nan)
+        tau = np.where(slope < 0, -1.0 / slope, np.inf)
+    tau[~np.isfinite(slope)] = np.nan
+    return tau
+
+
+# =================================================================================================
+# MAIN ENTRY POINT
+# =================================================================================================
+def rotational_autocorrelation(
+    df: pd.DataFrame,
+    track_col: str = TRACK_COL,
+    frame_col: str = TRACK_FRAME_COL,
+    phi_col: str = PHI_COL,
+    max_lag: int | None = None,
+    min_points: int = MIN_TRACK_POINTS,
+    fit_max_lag: int = FIT_MAX_LAG,
+    fit_min_pairs: int = FIT_MIN_PAIRS,
+    max_chunk_elements: int = MAX_CHUNK_ELEMENTS,
+) -> tuple[pd.DataFrame, pd.DataFrame, pd.DataFrame, dict]:
+    """
+    Returns:
+      curves_df   : long table, one row per (track, lag) with C(τ) and the number of contributing frame pairs
+      ensemble_df : pair-weighted average over all tracks, one row per lag
+      summary_df  : one row per track (observed points, frame span, fitted τ_r in frames)
+      report      : counts + ensemble τ_r (frames)
+    """
+    track_ids, n_points, spans, rows, offsets, phi = _pack_tracks(df, track_col, frame_col, phi_col, min_points)
+
+    curve_cols = [track_col, "Lag (frames)", "C(τ)", "Pairs"]
+    if track_ids.size == 0:
+        curves_df = pd.DataFrame(columns=curve_cols)
+        ensemble_df = pd.DataFrame(columns=["Lag (frames)", "C(τ)", "Pairs", "Tracks"])
+        summary_df = pd.DataFrame(columns=[track_col, "Points", "Span (frames)", "τ_r (frames)"])
+        report = {"n_tracks": 0, "n_buckets": 0, "max_lag": 0, "tau_ensemble_frames": np.nan}
+        return curves_df, ensemble_df, summary_df, report
+
+    n_lags_track = spans if max_lag is None else np.minimum(spans, max_lag + 1)
+    n_lags_total = int(n_lags_track.max())
+
+    ens_num = np.zeros(n_lags_total)
+    ens_den = np.zeros(n_lags_total)
+    ens_tracks = np.zeros(n_lags_total, dtype=np.int64)
+
+    # Flat per-track curve storage: track r owns [curve_start[r], curve_start[r] + n_lags_track[r])
+    curve_start = np.r_[0, np.cumsum(n_lags_track)[:-1]]
+    curve_acf = np.full(int(n_lags_track.sum()), np.nan)
+    curve_pairs = np.zeros(int(n_lags_track.sum()))
+
+    # Points are sorted by row already (packing sorts by track then frame) -> row slices
+    row_starts = np.searchsorted(rows, np.arange(track_ids.size))
+    row_lens = n_points
+
+    nfft_all = _next_pow2(2 * spans)
+    buckets = np.unique(nfft_all)
+
+    for nfft in buckets:
+        bucket_rows = np.flatnonzero(nfft_all == nfft)
+        chunk = max(1, int(max_chunk_elements // nfft))
+
+        for c0 in range(0, bucket_rows.size, chunk):
+            sel = bucket_rows[c0:c0 + chunk]
+            width = int(spans[sel].max())
+
+            lens = row_lens[sel]
+            local_row = np.repeat(np.arange(sel.size), lens)
+            pt = np.arange(lens.sum()) - np.repeat(np.cumsum(lens) - lens, lens) + np.repeat(row_starts[sel], lens)
+
+            cos_mat = np.zeros((sel.size, width))
+            sin_mat = np.zeros((sel.size, width))
+            mask_mat = np.zeros((sel.size, width))
+            cos_mat[local_row, offsets[pt]] = np.cos(phi[pt])
+            sin_mat[local_row, offsets[pt]] = np.sin(phi[pt])
+            mask_mat[local_row, offsets[pt]] = 1.0
+
+            num, den = _masked_acf_sums(cos_mat, sin_mat, mask_mat, int(nfft))
+
+            n_l = n_lags_track[sel]
+            n_max = int(n_l.max())
+            num = num[:, :n_max]
+            den = den[:, :n_max]
+            in_curve = np.arange(n_max)[None, :] < n_l[:, None]
+
+            with np.errstate(divide="ignore", invalid="ignore"):
+                acf = np.where(den > 0, num / den, np.nan)
+            dest = (curve_start[sel][:, None] + np.arange(n_max)[None, :])[in_curve]
+            curve_acf[dest] = acf[in_curve]
+            curve_pairs[dest] = den[in_curve]
+
+            ens_num[:n_max] += np.where(in_curve, num, 0.0).sum(axis=0)
+            ens_den[:n_max] += np.where(in_curve, den, 0.0).sum(axis=0)
+            ens_tracks[:n_max] += (in_curve & (den > 0)).sum(axis=0)
+
+    lag_of_curve = np.arange(curve_acf.size) - np.repeat(curve_start, n_lags_track)
+    row_of_curve = np.repeat(np.arange(track_ids.size), n_lags_track)
+    curves_df = pd.DataFrame({
+        track_col: track_ids[row_of_curve],
+        "Lag (frames)": lag_of_curve,
+        "C(τ)": curve_acf,
+        "Pairs": curve_pairs.astype(np.int64),
+    })
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        ens_acf = np.where(ens_den > 0, ens_num / ens_den, np.nan)
+    lags = np.arange(n_lags_total)
+    ensemble_df = pd.DataFrame({
+        "Lag (frames)": lags,
+        "C(τ)": ens_acf,
+        "Pairs": ens_den.astype(np.int64),
+        "Tracks": ens_tracks,
+    })
+
+    # Per-track fit on a dense (tracks × fit lags) matrix
+    n_fit = min(fit_max_lag, n_lags_total - 1) + 1
+    acf_mat = np.full((track_ids.size, n_fit), np.nan)
+    pair_mat = np.zeros((track_ids.size, n_fit))
+    in_fit = lag_of_curve < n_fit
+    acf_mat[row_of_curve[in_fit], lag_of_curve[in_fit]] = curve_acf[in_fit]
+    pair_mat[row_of_curve[in_fit], lag_of_curve[in_fit]] = curve_pairs[in_fit]
+    tau_tracks = fit_rotational_time(np.arange(n_fit), acf_mat, pair_mat, fit_max_lag, fit_min_pairs)
+    tau_ens = fit_rotational_time(lags, ens_acf, ens_den, fit_max_lag, fit_min_pairs)[0]
+
+    summary_df = pd.DataFrame({
+        track_col: track_ids,
+        "Points": n_points,
+        "Span (frames)": spans,
+        "τ_r (frames)": tau_tracks,
+    })
+
+    report = {
+        "n_tracks": int(track_ids.size),
+        "n_buckets": int(buckets.size),
+        "max_lag": int(n_lags_total - 1),
+        "tau_ensemble_frames": float(tau_ens),
+    }
+    return curves_df, ensemble_df, summary_df, report
+
+
+# =================================================================================================
+# STANDALONE USE: python smlm_autocorrelation.py Tracked_Dipoles_<ts>.xlsx
+# =================================================================================================
+if __name__ == "__main__":
+    import sys
+    import matplotlib.pyplot as plt
+    from smlm_io import read_table_cached, columnar_path, write_columnar
+
+    tracked_xlsx = sys.argv[1] if len(sys.argv) > 1 else "Tracked_Dipoles.xlsx"
+    tracked = read_table_cached(tracked_xlsx, columns=[TRACK_COL, TRACK_FRAME_COL, PHI_COL])   # "Master" is the first sheet
+
+    curves_df, ensemble_df, summary_df, report = rotational_autocorrelation(tracked)
+    print("Rotational autocorrelation report:", report)
+
+    out_xlsx = tracked_xlsx.replace(".xlsx", "") + "_RotationalACF.xlsx"
+    with pd.ExcelWriter(out_xlsx, engine="xlsxwriter") as writer:
+        ensemble_df.to_excel(writer, sheet_name="Ensemble", index=False)
+        summary_df.to_excel(writer, sheet_name="Per-track τ", index=False)
+    print(f"Saved rotational ACF output: {out_xlsx}")
+    # One row per lag per track can exceed Excel's 1,048,576-row limit, so the per-track curves go to a columnar file
+    out_curves = write_columnar(curves_df, columnar_path(out_xlsx.replace(".xlsx", "") + "_PerTrack.xlsx"))
+    print(f"Saved rotational ACF output: {out_curves}")
+
+    tau = report["tau_ensemble_frames"]
+    lag = ensemble_df["Lag (frames)"].to_numpy()
+    plt.figure(figsize=(8, 6))
+    plt.plot(lag, ensemble_df["C(τ)"], "o", color="purple", markersize=3, label="Ensemble C(τ)")
+    if np.isfinite(tau):
+        plt.plot(lag, np.exp(-lag / tau), "-", color="black", label=f"exp(−τ/τ_r), τ_r = {tau:.2f} frames")
+    plt.xlabel("Lag τ (frames)")
+    plt.ylabel("C(τ) = <cos ΔΦ>")
+    plt.title("Rotational Autocorrelation of Φ (All Tracks)")
+    plt.legend()
+    plt.grid(True)
+    plt.savefig("Rotational_ACF.png", dpi=300, bbox_inches="tight")
+    plt.show()
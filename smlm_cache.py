@@ -0,0 +1,146 @@
+#################################################################################################################################
+#################################   STAGE-LEVEL MEMOIZATION (CONTENT-ADDRESSED, LRU-BOUNDED)   ##################################
+#################################################################################################################################
+#
+# Each pipeline stage (filter, ambiguity deletion, pairing, geometry, tracking) is looked up in an on-disk cache before it
+# runs. The key of a stage is a SHA-256 over
+#   - the stage name and CACHE_VERSION,
+#   - the keys of the stages it consumes (or the content digest of an input file), and
+#   - the parameters that stage actually reads.
+# A stage's output is a deterministic function of that key, so passing the key downstream stands in for hashing the
+# (possibly large) output itself. Changing TRACK_LINK_NM therefore only invalidates tracking; changing RADIUS_NM invalidates
+# deletion and everything after it; changing a plotting option invalidates nothing.
+#
+# Entries are pickles named <key>.pkl. A hit refreshes the file's modification time, and after every store the least
+# recently used entries are deleted until the cache fits in max_bytes.
+#################################################################################################################################
+
+import hashlib
+import json
+import os
+import pickle
+import tempfile
+
+
+CACHE_VERSION = 1   # bump when a stage function changes its output for the same inputs
+
+
+# =================================================================================================
+# KEYS
+# =================================================================================================
+def file_digest(path: str, chunk_bytes: int = 1 << 24) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_bytes), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def stage_key(stage: str, inputs: list[str], params: dict) -> str:
+    payload = json.dumps(
+        {"stage": stage, "version": CACHE_VERSION, "inputs": list(inputs), "params": params},
+        sort_keys=True, default=repr, ensure_ascii=False,
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+# =================================================================================================
+# CACHE
+# =================================================================================================
+class StageCache:
+    """
+    On-disk, content-addressed cache of stage outputs. directory=None disables caching (every stage is computed).
+    """
+
+    def __init__(self, directory: str | None = ".smlm_cache", max_bytes: int = 2 * 1024**3, verbose: bool = True):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.verbose = verbose
+        self.hits: list[str] = []
+        self.misses: list[str] = []
+        if directory is not None:
+            os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, f"{key}.pkl")
+
+    def file_key(self, path: str) -> str:
+        # Content digest of an input file (skipped when caching is off: the key is never used then)
+        return path if self.directory is None else file_digest(path)
+
+    def get(self, key: str):
+        """Returns (True, value) on a hit, (False, None) otherwise."""
+        if self.directory is None:
+            return False, None
+        path = self._path(key)
+        try:
+            with open(path, "rb") as f:
+                value = pickle.load(f)
+        except FileNotFoundError:
+            return False, None
+        except (pickle.UnpicklingError, EOFError, AttributeError, ImportError):
+            # Unreadable entry (interrupted write from an older run, or a changed module): drop it and recompute
+            os.remove(path)
+            return False, None
+        os.utime(path)   # mark as recently used
+        return True, value
+
+    def put(self, key: str, value) -> None:
+        if self.directory is None:
+            return
+        # Write to a temporary file first so a crash never leaves a truncated entry under the real name
+        fd, tmp = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp, self._path(key))
+        except BaseException:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+        self.evict()
+
+    def evict(self) -> int:
+        """Delete least recently used entries until the cache fits in max_bytes. Returns the number removed."""
+        if self.directory is None:
+            return 0
+        entries = []
+        for name in os.listdir(self.directory):
+            if name.endswith(".pkl"):
+                try:
+                    st = os.stat(os.path.join(self.directory, name))
+                except FileNotFoundError:
+                    continue   # removed by another run in the meantime
+                entries.append((st.st_mtime, st.st_size, name))
+        entries.sort()
+
+        total = sum(size for _, size, _ in entries)
+        removed = 0
+        for _, size, name in entries:
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(os.path.join(self.directory, name))
+            except FileNotFoundError:
+                pass
+            total -= size
+            removed += 1
+        return removed
+
+    def run(self, stage: str, inputs: list[str], params: dict, fn, *args, **kwargs):
+        """
+        Returns (value, key). `inputs` are the keys of upstream stages or file digests, `params` the settings the stage
+        reads; fn(*args, **kwargs) is only called on a miss.
+        """
+        key = stage_key(stage, inputs, params)
+        hit, value = self.get(key)
+        if hit:
+            self.hits.append(stage)
+            if self.verbose:
+                print(f"Stage '{stage}': reused cached result ({key[:12]})")
+            return value, key
+
+        value = fn(*args, **kwargs)
+        self.misses.append(stage)
+        self.put(key, value)
+        return value, key
@@ -0,0 +1,228 @@
+#################################################################################################################################
+#################################   DECLARATIVE FIGURE SET + PARALLEL HEADLESS RENDERING   ######################################
+#################################################################################################################################
+#
+# Every figure of the general pipeline is described by an entry in FIGURES:
+#
+#   name -> {"needs": arrays it reads, "path": default PNG name, "figsize": ..., "render": draw(fig, arrays, options)}
+#
+# The arrays are published once per run as read-only .npy files (memory-mapped by every worker, never pickled per figure),
+# and each selected figure is rendered on its own Figure object with the Agg canvas in a worker process. No pyplot global
+# state is involved, so figures render independently and in parallel, and no display is needed. The same draw functions
+# are reused to show the figures interactively at the end of a run.
+#################################################################################################################################
+
+import os
+
+import numpy as np
+
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.ticker import MaxNLocator
+
+
+DEFAULT_OPTIONS = {
+    "c1_color": "green",
+    "c2_color": "red",
+    "arrow_length": 1800.0,
+    "dpi": 300,
+}
+
+
+# =================================================================================================
+# SHARED READ-ONLY ARRAYS
+# =================================================================================================
+def publish_arrays(array_dir: str, **arrays) -> None:
+    for name, values in arrays.items():
+        np.save(os.path.join(array_dir, f"{name}.npy"), np.ascontiguousarray(values))
+
+
+def load_arrays(array_dir: str, names: list[str]) -> dict:
+    return {name: np.load(os.path.join(array_dir, f"{name}.npy"), mmap_mode="r") for name in names}
+
+
+# =================================================================================================
+# DRAW FUNCTIONS (object-oriented Matplotlib only)
+# =================================================================================================
+def _qc_scatter(fig, a, o):
+    ax = fig.add_subplot(111)
+    ax.scatter(a["c1_x"], a["c1_y"], color=o["c1_color"], alpha=0.2, label="C1 (TIRF 560)")
+    ax.scatter(a["c2_x"], a["c2_y"], color=o["c2_color"], alpha=0.2, label="C2 (TIRF 647)")
+    ax.set_xlabel("X Position (nm)")
+    ax.set_ylabel("Y Position (nm)")
+    ax.set_title("Scatter Plot: CHANNELS BEFORE IMAGE REGISTRATION")
+    ax.legend()
+    ax.grid(True)
+
+
+def _distance_hist(fig, a, o):
+    # No gridlines + less cluttered y axis
+    ax = fig.add_subplot(111)
+    ax.hist(a["pair_distance"], bins=30, color="blue", alpha=0.7, edgecolor="black")
+    ax.set_xlabel("Distance (nm)")
+    ax.set_ylabel("Frequency")
+    ax.set_title("END-TO-END DISTANCE DISTRIBUTION (nm)")
+    ax.yaxis.set_major_locator(MaxNLocator(nbins=6, integer=True))
+
+
+def _angle_polar(fig, a, o):
+    ax = fig.add_subplot(111, projection="polar")
+    ax.hist(np.radians(a["pair_angle"]), bins=30, color="pink", alpha=0.3, edgecolor="black")
+    ax.set_theta_zero_location("E")
+    ax.set_theta_direction(1)
+    ax.set_title("Dipole Angle Distribution (Degrees)")
+
+
+def _rotational_acf(fig, a, o):
+    ax = fig.add_subplot(111)
+    lag = np.asarray(a["acf_lag"], dtype=float)
+    tau_r = float(a["acf_tau"][0])
+    ax.plot(lag, a["acf_c"], "o", color="purple", markersize=3, label="Ensemble C(τ)")
+    if np.isfinite(tau_r):
+        ax.plot(lag, np.exp(-lag / tau_r), "-", color="black", label=f"exp(−τ/τ_r), τ_r = {tau_r:.2f} frames")
+    ax.set_xlabel("Lag τ (frames)")
+    ax.set_ylabel("C(τ) = <cos ΔΦ>")
+    ax.set_title("Rotational Autocorrelation of Φ (All Tracks)")
+    ax.legend()
+    ax.grid(True)
+
+
+def _distance_hist_tracked(fig, a, o):
+    ax = fig.add_subplot(111)
+    ax.hist(a["dipole_distance"], bins=30, color="blue", alpha=0.7, edgecolor="black")
+    ax.set_xlabel("Distance (nm)")
+    ax.set_ylabel("Frequency")
+    ax.set_title("End-to-End Distance Distribution (nm) - All Tracks")
+
+
+def _phi_vs_distance(fig, a, o):
+    ax = fig.add_subplot(111)
+    ax.scatter(a["dipole_phi"], a["dipole_distance"], color="purple", alpha=0.5)
+    ax.set_xlabel("Φ Angle (degrees)")
+    ax.set_ylabel("End-to-End Distance (nm)")
+    ax.set_title("Scatter Plot: Distance vs. Φ Angle (All Tracks)")
+    ax.grid(True)
+
+
+def _midpoint_map(fig, a, o, color_by: str, arrows: bool, title: str):
+    ax = fig.add_subplot(111)
+    if color_by == "theta":
+        values, cmap, vmax, label = a["dipole_theta"], "viridis", 90, "θ (degrees)"
+    else:
+        values, cmap, vmax, label = a["dipole_phi"], "plasma", 360, "Φ (degrees)"
+
+    sc = ax.scatter(
+        a["mid_x"], a["mid_y"],
+        c=values,
+        cmap=cmap, vmin=0, vmax=vmax,
+        s=20, alpha=0.9,
+        edgecolors="k", linewidths=0.1
+    )
+
+    if arrows:
+        phi_rad = np.radians(a["dipole_phi"])
+        ax.quiver(
+            a["mid_x"], a["mid_y"],
+            np.cos(phi_rad) * o["arrow_length"], np.sin(phi_rad) * o["arrow_length"],
+            angles="xy", scale_units="xy", scale=1,
+            color="black", width=0.0025, alpha=0.7
+        )
+
+    cbar = fig.colorbar(sc, ax=ax)
+    cbar.set_label(label, rotation=270, labelpad=15)
+    ax.set_xlabel("X Position (nm)")
+    ax.set_ylabel("Y Position (nm)")
+    ax.set_title(title)
+    ax.grid(True)
+    ax.invert_yaxis()
+
+
+_MIDPOINT_NEEDS = ["mid_x", "mid_y", "dipole_phi", "dipole_theta"]
+
+FIGURES = {
+    "qc_scatter": {
+        "needs": ["c1_x", "c1_y", "c2_x", "c2_y"], "path": "scatter_plot.png", "figsize": (8, 6),
+        "render": _qc_scatter,
+    },
+    "distance_hist": {
+        "needs": ["pair_distance"], "path": "Distance_Histogram.png", "figsize": (10, 6),
+        "render": _distance_hist,
+    },
+    "angle_polar": {
+        "needs": ["pair_angle"], "path": "Dipole_Angle_Polar_Histogram.png", "figsize": (8, 8),
+        "render": _angle_polar,
+    },
+    "rotational_acf": {
+        "needs": ["acf_lag", "acf_c", "acf_tau"], "path": "Rotational_ACF.png", "figsize": (8, 6),
+        "render": _rotational_acf,
+    },
+    "distance_hist_tracked": {
+        "needs": ["dipole_distance"], "path": "Distance_Histogram_Filtered.png", "figsize": (10, 6),
+        "render": _distance_hist_tracked,
+    },
+    "phi_vs_distance": {
+        "needs": ["dipole_phi", "dipole_distance"], "path": "Distance_vs_Phi_Scatter.png", "figsize": (8, 6),
+        "render": _phi_vs_distance,
+    },
+    "midpoint_theta": {
+        "needs": _MIDPOINT_NEEDS, "path": "midpoint_theta_colormap.png", "figsize": (10, 8),
+        "render": lambda fig, a, o: _midpoint_map(fig, a, o, "theta", False, "Dipole Midpoints Colored by θ Angle"),
+    },
+    "midpoint_phi": {
+        "needs": _MIDPOINT_NEEDS, "path": "midpoint_phi_colormap.png", "figsize": (10, 8),
+        "render": lambda fig, a, o: _midpoint_map(fig, a, o, "phi", False, "Dipole Midpoints Colored by Φ Angle"),
+    },
+    "midpoint_phi_arrows": {
+        "needs": _MIDPOINT_NEEDS, "path": "midpoint_phi_colormap_arrows.png", "figsize": (10, 8),
+        "render": lambda fig, a, o: _midpoint_map(fig, a, o, "phi", True, "Dipole Midpoints Colored by Φ Angle with Arrows"),
+    },
+    "midpoint_theta_arrows": {
+        "needs": _MIDPOINT_NEEDS, "path": "midpoint_theta_colormap_arrows.png", "figsize": (10, 8),
+        "render": lambda fig, a, o: _midpoint_map(fig, a, o, "theta", True, "Dipole Midpoints Colored by θ Angle with Φ Arrows"),
+    },
+}
+
+
+# =================================================================================================
+# RENDERING
+# =================================================================================================
+def render_figure(name: str, array_dir: str, path: str | None = None, options: dict | None = None) -> str:
+    """Worker entry point: draw one figure from the published arrays and save it with the Agg canvas."""
+    spec = FIGURES[name]
+    opts = {**DEFAULT_OPTIONS, **(options or {})}
+    path = path or spec["path"]
+
+    fig = Figure(figsize=spec["figsize"])
+    FigureCanvasAgg(fig)
+    spec["render"](fig, load_arrays(array_dir, spec["needs"]), opts)
+    fig.savefig(path, dpi=opts["dpi"], bbox_inches="tight")
+    return path
+
+
+def selected_figures(names: list[str], selection: list[str] | None) -> list[str]:
+    if selection is not None:
+        unknown = sorted(set(selection) - set(FIGURES))
+        if unknown:
+            raise ValueError(f"Unknown figure name(s): {unknown}. Available: {sorted(FIGURES)}")
+    return [n for n in names if selection is None or n in selection]
+
+
+def submit_figures(writer, array_dir: str, names: list[str], selection: list[str] | None = None,
+                   options: dict | None = None) -> list[str]:
+    """Queue figures on a BackgroundWriter (its worker processes render them in parallel)."""
+    chosen = selected_figures(names, selection)
+    for name in chosen:
+        writer.submit(FIGURES[name]["path"], render_figure, name, array_dir, None, options)
+    return chosen
+
+
+def show_figures(array_dir: str, names: list[str], options: dict | None = None) -> None:
+    """Interactive view of already-rendered figures, drawn with the same functions through pyplot."""
+    import matplotlib.pyplot as plt
+
+    opts = {**DEFAULT_OPTIONS, **(options or {})}
+    for name in names:
+        spec = FIGURES[name]
+        fig = plt.figure(figsize=spec["figsize"])
+        spec["render"](fig, load_arrays(array_dir, spec["needs"]), opts)
+    plt.show()
@@ -0,0 +1,103 @@
+#################################################################################################################################
+#################################   FAST COLUMNAR I/O FOR PIPELINE OUTPUTS   ####################################################
+#################################################################################################################################
+#
+# Excel (openpyxl) parsing is by far the slowest part of re-plotting a large pairing output. The pipeline therefore also
+# writes its tables in a columnar binary format, and any Excel file handed to a visualization script is converted once and
+# cached next to it. Later reads only load the requested columns.
+#
+#   - Parquet when pyarrow (or fastparquet) is installed
+#   - otherwise an uncompressed NumPy .npz archive (one array per column), which needs nothing beyond NumPy
+#
+# A cache is reused only while it is at least as new as the Excel file it was made from.
+#################################################################################################################################
+
+import os
+
+import numpy as np
+import pandas as pd
+
+
+def _parquet_available() -> bool:
+    for engine in ("pyarrow", "fastparquet"):
+        try:
+            __import__(engine)
+            return True
+        except ImportError:
+            continue
+    return False
+
+
+COLUMNAR_EXT = ".parquet" if _parquet_available() else ".npz"
+EXCEL_EXTS = (".xlsx", ".xlsm", ".xls")
+_NPZ_COLUMNS_KEY = "__columns__"
+
+
+# =================================================================================================
+# WRITE / READ ONE COLUMNAR FILE (format chosen by extension)
+# =================================================================================================
+def write_columnar(df: pd.DataFrame, path: str) -> str:
+    ext = os.path.splitext(path)[1].lower()
+    if ext == ".parquet":
+        df.to_parquet(path, index=False)
+    elif ext == ".npz":
+        arrays = {
+            f"c{k}": df[col].to_numpy() if pd.api.types.is_numeric_dtype(df[col]) else df[col].to_numpy().astype(str)
+            for k, col in enumerate(df.columns)
+        }
+        np.savez(path, **{_NPZ_COLUMNS_KEY: np.array([str(c) for c in df.columns])}, **arrays)
+    else:
+        raise ValueError(f"Unsupported columnar format '{ext}' (use .parquet or .npz).")
+    return path
+
+
+def read_columnar(path: str, columns: list[str] | None = None) -> pd.DataFrame:
+    ext = os.path.splitext(path)[1].lower()
+    if ext == ".parquet":
+        return pd.read_parquet(path, columns=columns)
+    if ext == ".npz":
+        with np.load(path, allow_pickle=False) as npz:
+            names = list(npz[_NPZ_COLUMNS_KEY])
+            wanted = names if columns is None else list(columns)
+            missing = [c for c in wanted if c not in names]
+            if missing:
+                raise KeyError(f"Columns not found in {path}: {missing}")
+            return pd.DataFrame({c: npz[f"c{names.index(c)}"] for c in wanted})
+    raise ValueError(f"Unsupported columnar format '{ext}' (use .parquet or .npz).")
+
+
+def columnar_path(path: str, ext: str = COLUMNAR_EXT) -> str:
+    return os.path.splitext(path)[0] + ext
+
+
+# =================================================================================================
+# READ ANY PIPELINE TABLE (Excel is converted + cached on first read)
+# =================================================================================================
+def read_table_cached(path: str, columns: list[str] | None = None, sheet_name: str | int = 0) -> pd.DataFrame:
+    ext = os.path.splitext(path)[1].lower()
+
+    if ext in (".parquet", ".npz"):
+        return read_columnar(path, columns)
+    if ext == ".csv":
+        return pd.read_csv(path, usecols=columns)
+    if ext not in EXCEL_EXTS:
+        raise ValueError(f"Unsupported input '{path}' (expected Excel, CSV, .parquet or .npz).")
+
+    # A cache is per sheet; the first sheet keeps the plain name so it matches what the pipeline writes
+    base = path if sheet_name == 0 else f"{os.path.splitext(path)[0]}_{sheet_name}{ext}"
+    for cache_ext in (".parquet", ".npz"):
+        cache = columnar_path(base, cache_ext)
+        if cache_ext == ".parquet" and not _parquet_available():
+            continue
+        if os.path.exists(cache) and os.path.getmtime(cache) >= os.path.getmtime(path):
+            return read_columnar(cache, columns)
+
+    df = pd.read_excel(path, sheet_name=sheet_name)
+    cache = columnar_path(base)
+    try:
+        write_columnar(df, cache)
+        print(f"Cached {path} -> {cache}")
+    except (OSError, ValueError, TypeError) as err:
+        print(f"Could not cache {path} ({err}); reading from Excel every time.")
+
+    return df if columns is None else df[list(columns)]
@@ -0,0 +1,311 @@
+#################################################################################################################################
+#################################   COMPUTE KERNELS: NUMPY BACKEND + OPTIONAL NUMBA (JIT) BACKEND   #############################
+#################################################################################################################################
+#
+# The inner loops of the pipeline, each with two implementations that give the same results:
+#
+#   radius_neighbors   -> every reference point within r of each query point (cross-channel pairing candidates,
+#                         the ambiguity rule's opposite-channel neighbours)
+#   same_channel_pairs -> every same-channel pair within r (crowding detection)
+#   crowding_masks     -> the high-population ambiguity rule applied to those pairs / neighbours
+#   dipole_geometry    -> distance, Φ, θ (rod-length model) and midpoints from C1/C2 coordinates
+#
+# Backends
+#   "numpy" -> cKDTree + vectorized NumPy (always available)
+#   "numba" -> cell-list / explicit loops compiled with Numba; compiled code is cached on disk (__pycache__), so only the
+#              first run after installing or changing this file pays the compile time
+#   "auto"  -> numba when it is installed, otherwise numpy (default)
+#   "check" -> runs both and raises AssertionError unless they agree (index/mask outputs exactly, floating-point outputs
+#              to within 4 ulp, since libm and NumPy's vectorized transcendental functions may round the last bit
+#              differently); returns the NumPy result
+#
+# Choose with set_backend("numba") or the environment variable SMLM_BACKEND. "python smlm_kernels.py" runs the check mode on
+# random data.
+#################################################################################################################################
+
+import os
+
+import numpy as np
+
+from scipy.spatial import cKDTree
+
+try:
+    import numba
+    NUMBA_AVAILABLE = True
+except ImportError:
+    numba = None
+    NUMBA_AVAILABLE = False
+
+
+BACKENDS = ("auto", "numpy", "numba", "check")
+_backend = os.environ.get("SMLM_BACKEND", "auto")
+
+
+def set_backend(name: str) -> None:
+    global _backend
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown backend {name!r}; choose from {BACKENDS}.")
+    _backend = name
+
+
+def get_backend() -> str:
+    """The backend that will actually run: 'numpy', 'numba' or 'check'."""
+    if _backend not in BACKENDS:
+        raise ValueError(f"Unknown backend {_backend!r} (SMLM_BACKEND); choose from {BACKENDS}.")
+    if _backend in ("numba", "check") and not NUMBA_AVAILABLE:
+        raise ImportError(f"Backend '{_backend}' needs numba (pip install numba); use 'numpy' or 'auto' instead.")
+    if _backend == "auto":
+        return "numba" if NUMBA_AVAILABLE else "numpy"
+    return _backend
+
+
+def _dispatch(numpy_fn, numba_fn, *args):
+    backend = get_backend()
+    if backend == "numpy":
+        return numpy_fn(*args)
+    if backend == "numba":
+        return numba_fn(*args)
+
+    expected = numpy_fn(*args)
+    got = numba_fn(*args)
+    for k, (a, b) in enumerate(zip(expected, got)):
+        a, b = np.asarray(a), np.asarray(b)
+        if a.shape != b.shape:
+            raise AssertionError(f"{numpy_fn.__name__}: output {k} has shape {a.shape} (numpy) vs {b.shape} (numba)")
+        if np.issubdtype(a.dtype, np.floating):
+            np.testing.assert_array_max_ulp(a, b, maxulp=4)
+        elif not np.array_equal(a, b):
+            raise AssertionError(f"{numpy_fn.__name__}: output {k} differs between numpy and numba")
+    return expected
+
+
+# =================================================================================================
+# NUMPY BACKEND
+# =================================================================================================
+def _radius_neighbors_numpy(query_xy, ref_xy, r):
+    neighbors = cKDTree(ref_xy).query_ball_point(query_xy, r=r)
+    counts = np.fromiter((len(n) for n in neighbors), dtype=np.int64, count=len(neighbors))
+    if counts.sum() == 0:
+        return counts, np.empty(0, dtype=np.int64)
+    return counts, np.concatenate([np.asarray(n, dtype=np.int64) for n in neighbors])
+
+
+def _same_channel_pairs_numpy(xy, r):
+    pairs = cKDTree(xy).query_pairs(r=r, output_type="ndarray").astype(np.int64).reshape(-1, 2)
+    return (pairs[np.lexsort((pairs[:, 1], pairs[:, 0]))],)
+
+
+def _crowding_masks_numpy(pairs, nb_counts, nb_indices, n_same, n_other):
+    remove_same = np.zeros(n_same, dtype=bool)
+    remove_other = np.zeros(n_other, dtype=bool)
+    if len(pairs) == 0:
+        return remove_same, remove_other
+
+    has_other = nb_counts > 0
+    flagged = pairs[has_other[pairs[:, 0]] | has_other[pairs[:, 1]]]
+    remove_same[flagged.ravel()] = True
+
+    # Every opposite-channel neighbour of a member of a flagged pair
+    starts = np.r_[0, np.cumsum(nb_counts)[:-1]]
+    members = np.flatnonzero(remove_same)
+    lengths = nb_counts[members]
+    offsets = np.repeat(starts[members] - np.r_[0, np.cumsum(lengths)[:-1]], lengths)
+    remove_other[nb_indices[np.arange(lengths.sum()) + offsets]] = True
+    return remove_same, remove_other
+
+
+def _dipole_geometry_numpy(c1_x, c1_y, c2_x, c2_y, rod_length_nm):
+    dx = c2_x - c1_x
+    dy = c2_y - c1_y
+    distance = np.sqrt(dx * dx + dy * dy)
+    phi = (np.degrees(np.arctan2(dy, dx)) + 360) % 360
+    theta = np.degrees(np.arccos(np.clip(distance / rod_length_nm, -1.0, 1.0)))
+    mid_x = (c1_x + c2_x) / 2.0
+    mid_y = (c1_y + c2_y) / 2.0
+    return distance, phi, theta, mid_x, mid_y
+
+
+# =================================================================================================
+# NUMBA BACKEND (compiled lazily on first use, cached on disk)
+# =================================================================================================
+def _grid_neighbors_py(query_xy, ref_xy, r, self_join):
+    """Cell list: each query point scans its own and the 8 surrounding cells (cells slightly wider than r)."""
+    nq, nr = query_xy.shape[0], ref_xy.shape[0]
+    counts = np.zeros(nq, dtype=np.int64)
+    indptr = np.zeros(nq + 1, dtype=np.int64)
+    indices = np.empty(0, dtype=np.int64)
+    if nq == 0 or nr == 0:
+        return counts, indices
+
+    cell = r * (1.0 + 1e-6)   # points <= r apart are then never more than one cell apart, despite rounding
+    x0 = ref_xy[:, 0].min()
+    y0 = ref_xy[:, 1].min()
+    ny = np.int64(np.floor((ref_xy[:, 1].max() - y0) / cell)) + 3
+    keys = np.empty(nr, dtype=np.int64)
+    for j in range(nr):
+        keys[j] = (np.int64(np.floor((ref_xy[j, 0] - x0) / cell)) + 1) * ny + np.int64(np.floor((ref_xy[j, 1] - y0) / cell)) + 1
+    order = np.argsort(keys, kind="mergesort")
+    sorted_keys = keys[order]
+    r2 = r * r
+
+    # pass 0 counts the neighbours of every query point, pass 1 writes them
+    for pass_no in range(2):
+        if pass_no == 1:
+            for i in range(nq):
+                indptr[i + 1] = indptr[i] + counts[i]
+            indices = np.empty(indptr[nq], dtype=np.int64)
+        for i in range(nq):
+            qx, qy = query_xy[i, 0], query_xy[i, 1]
+            cx = np.int64(np.floor((qx - x0) / cell)) + 1
+            cy = np.int64(np.floor((qy - y0) / cell)) + 1
+            k = 0
+            for ax in range(cx - 1, cx + 2):
+                for ay in range(cy - 1, cy + 2):
+                    if ay < 0 or ay >= ny:
+                        continue
+                    key = ax * ny + ay
+                    a = np.searchsorted(sorted_keys, key, side="left")
+                    b = np.searchsorted(sorted_keys, key, side="right")
+                    for s in range(a, b):
+                        j = order[s]
+                        if self_join and j <= i:
+                            continue
+                        dx = qx - ref_xy[j, 0]
+                        dy = qy - ref_xy[j, 1]
+                        if dx * dx + dy * dy <= r2:
+                            if pass_no == 1:
+                                indices[indptr[i] + k] = j
+                            k += 1
+            if pass_no == 0:
+                counts[i] = k
+            else:
+                indices[indptr[i]:indptr[i + 1]] = np.sort(indices[indptr[i]:indptr[i + 1]])
+    return counts, indices
+
+
+def _crowding_masks_py(pairs, nb_counts, nb_indices, n_same, n_other):
+    remove_same = np.zeros(n_same, dtype=np.bool_)
+    remove_other = np.zeros(n_other, dtype=np.bool_)
+    starts = np.zeros(n_same + 1, dtype=np.int64)
+    for i in range(n_same):
+        starts[i + 1] = starts[i] + nb_counts[i]
+    for p in range(pairs.shape[0]):
+        i, j = pairs[p, 0], pairs[p, 1]
+        if nb_counts[i] > 0 or nb_counts[j] > 0:
+            remove_same[i] = True
+            remove_same[j] = True
+            for s in range(starts[i], starts[i + 1]):
+                remove_other[nb_indices[s]] = True
+            for s in range(starts[j], starts[j + 1]):
+                remove_other[nb_indices[s]] = True
+    return remove_same, remove_other
+
+
+def _dipole_geometry_py(c1_x, c1_y, c2_x, c2_y, rod_length_nm):
+    n = c1_x.shape[0]
+    distance = np.empty(n)
+    phi = np.empty(n)
+    theta = np.empty(n)
+    mid_x = np.empty(n)
+    mid_y = np.empty(n)
+    to_deg = 180.0 / np.pi
+    for k in range(n):
+        dx = c2_x[k] - c1_x[k]
+        dy = c2_y[k] - c1_y[k]
+        d = np.sqrt(dx * dx + dy * dy)
+        distance[k] = d
+        phi[k] = (np.arctan2(dy, dx) * to_deg + 360) % 360
+        ratio = min(max(d / rod_length_nm, -1.0), 1.0)
+        theta[k] = np.arccos(ratio) * to_deg
+        mid_x[k] = (c1_x[k] + c2_x[k]) / 2.0
+        mid_y[k] = (c1_y[k] + c2_y[k]) / 2.0
+    return distance, phi, theta, mid_x, mid_y
+
+
+_compiled = {}
+
+
+def _jit(fn):
+    if fn not in _compiled:
+        _compiled[fn] = numba.njit(cache=True, nogil=True)(fn)
+    return _compiled[fn]
+
+
+def _radius_neighbors_numba(query_xy, ref_xy, r):
+    return _jit(_grid_neighbors_py)(query_xy, ref_xy, float(r), False)
+
+
+def _same_channel_pairs_numba(xy, r):
+    counts, indices = _jit(_grid_neighbors_py)(xy, xy, float(r), True)
+    return (np.column_stack([np.repeat(np.arange(len(counts), dtype=np.int64), counts), indices]),)
+
+
+def _crowding_masks_numba(pairs, nb_counts, nb_indices, n_same, n_other):
+    return _jit(_crowding_masks_py)(pairs, nb_counts, nb_indices, n_same, n_other)
+
+
+def _dipole_geometry_numba(c1_x, c1_y, c2_x, c2_y, rod_length_nm):
+    return _jit(_dipole_geometry_py)(c1_x, c1_y, c2_x, c2_y, float(rod_length_nm))
+
+
+# =================================================================================================
+# PUBLIC KERNELS
+# =================================================================================================
+def radius_neighbors(query_xy: np.ndarray, ref_xy: np.ndarray, r: float) -> tuple[np.ndarray, np.ndarray]:
+    """(counts, indices): for query point i, the ref rows within r (ascending) are the next counts[i] entries of indices."""
+    query_xy = np.ascontiguousarray(query_xy, dtype=float).reshape(-1, 2)
+    ref_xy = np.ascontiguousarray(ref_xy, dtype=float).reshape(-1, 2)
+    if len(query_xy) == 0 or len(ref_xy) == 0:
+        return np.zeros(len(query_xy), dtype=np.int64), np.empty(0, dtype=np.int64)
+    return _dispatch(_radius_neighbors_numpy, _radius_neighbors_numba, query_xy, ref_xy, r)
+
+
+def same_channel_pairs(xy: np.ndarray, r: float) -> np.ndarray:
+    """K × 2 array of row pairs (i < j) within r, sorted by i then j."""
+    xy = np.ascontiguousarray(xy, dtype=float).reshape(-1, 2)
+    if len(xy) < 2:
+        return np.empty((0, 2), dtype=np.int64)
+    return _dispatch(_same_channel_pairs_numpy, _same_channel_pairs_numba, xy, r)[0]
+
+
+def crowding_masks(pairs: np.ndarray, nb_counts: np.ndarray, nb_indices: np.ndarray,
+                   n_same: int, n_other: int) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Ambiguity rule: for every same-channel pair where either member has an opposite-channel neighbour, flag both members
+    and all their opposite-channel neighbours. nb_counts / nb_indices are radius_neighbors(same_xy, other_xy, r).
+    """
+    pairs = np.ascontiguousarray(pairs, dtype=np.int64).reshape(-1, 2)
+    return _dispatch(_crowding_masks_numpy, _crowding_masks_numba, pairs,
+                     np.ascontiguousarray(nb_counts, dtype=np.int64), np.ascontiguousarray(nb_indices, dtype=np.int64),
+                     int(n_same), int(n_other))
+
+
+def dipole_geometry(c1_x, c1_y, c2_x, c2_y, rod_length_nm: float) -> tuple[np.ndarray, ...]:
+    """(distance, Φ in 0–360°, θ from the rod-length model, mid_x, mid_y) for each C1/C2 coordinate pair."""
+    arrays = [np.ascontiguousarray(a, dtype=float) for a in (c1_x, c1_y, c2_x, c2_y)]
+    return _dispatch(_dipole_geometry_numpy, _dipole_geometry_numba, *arrays, rod_length_nm)
+
+
+if __name__ == "__main__":
+    import time
+
+    if not NUMBA_AVAILABLE:
+        raise SystemExit("numba is not installed: only the numpy backend is available, nothing to compare.")
+
+    set_backend("check")
+    rng = np.random.default_rng(0)
+    a = rng.uniform(0, 20000, (20000, 2))
+    b = rng.uniform(0, 20000, (20000, 2))
+    # include points on integer coordinates exactly r apart, where the comparison is decided by the last bit
+    a[:100] = np.round(a[:100])
+    b[:100] = a[:100] + [232.0, 0.0]
+
+    t0 = time.perf_counter()
+    counts, indices = radius_neighbors(a, b, 232.0)
+    pairs = same_channel_pairs(a, 232.0)
+    nb_counts, nb_indices = radius_neighbors(a, b, 232.0)
+    crowding_masks(pairs, nb_counts, nb_indices, len(a), len(b))
+    rows = np.repeat(np.arange(len(a)), counts)
+    dipole_geometry(a[rows, 0], a[rows, 1], b[indices, 0], b[indices, 1], 120.0)
+    print(f"numpy and numba backends agree ({len(indices)} pairs, {len(pairs)} same-channel pairs, "
+          f"{time.perf_counter() - t0:.2f} s including compilation)")
@@ -0,0 +1,338 @@
+#################################################################################################################################
+#################################   QUADTREE LEVEL-OF-DETAIL INDEX + INTERACTIVE DIPOLE MAP VIEWER   ############################
+#################################################################################################################################
+#
+# A full 80,000 × 80,000 nm midpoint map can hold millions of dipoles, far more than a figure can redraw interactively.
+# The index below is a linear (Morton-ordered) quadtree over the dipole midpoints:
+#
+#   - every midpoint gets a cell on the finest grid (2^MAX_DEPTH × 2^MAX_DEPTH cells over the bounds), and the rows are
+#     sorted by the cell's Morton (Z-order) code, so every quadtree node covers one contiguous range of rows
+#   - per level, each non-empty node stores: count, centroid, Σcos Φ / Σsin Φ (circular mean Φ and its resultant length)
+#     and Σθ (mean θ)
+#
+# A viewport query descends the tree from the coarsest level whose cells covering the viewport number at most max_items,
+# refining only into non-empty children, and stops at the finest level that still returns <= max_items nodes. If the
+# viewport holds <= max_items dipoles in total, the dipoles themselves are returned. The work per query depends on
+# max_items and the tree depth, not on the number of dipoles.
+#
+#   python smlm_lod.py Tracked_Dipoles_<timestamp>.parquet     (or .npz / .xlsx)  -> pan/zoom viewer with Φ arrows, θ color
+#################################################################################################################################
+
+import numpy as np
+import pandas as pd
+
+
+MAX_DEPTH = 16                  # finest level: 80,000 nm / 2^16 ≈ 1.2 nm cells
+MIDPOINT_COLS = ["mid_x", "mid_y", "Φ (degrees)", "θ (degrees)"]
+
+
+# =================================================================================================
+# MORTON CODES (x in the even bits, y in the odd bits)
+# =================================================================================================
+def _spread_bits(v: np.ndarray) -> np.ndarray:
+    v = v.astype(np.uint64) & np.uint64(0xFFFF)
+    v = (v | (v << np.uint64(8))) & np.uint64(0x00FF00FF)
+    v = (v | (v << np.uint64(4))) & np.uint64(0x0F0F0F0F)
+    v = (v | (v << np.uint64(2))) & np.uint64(0x33333333)
+    v = (v | (v << np.uint64(1))) & np.uint64(0x55555555)
+    return v
+
+
+def morton_code(ix: np.ndarray, iy: np.ndarray) -> np.ndarray:
+    return _spread_bits(ix) | (_spread_bits(iy) << np.uint64(1))
+
+
+# =================================================================================================
+# BUILD
+# =================================================================================================
+def build_lod_index(
+    x: np.ndarray,
+    y: np.ndarray,
+    phi_deg: np.ndarray,
+    theta_deg: np.ndarray,
+    bounds: tuple[float, float, float, float] | None = None,
+    max_depth: int = MAX_DEPTH,
+) -> dict:
+    """
+    Returns the index as a dict of arrays. levels[l] holds the non-empty nodes of level l (2^l × 2^l cells), sorted by
+    Morton code, with their row range [start, stop) into the Morton-sorted point arrays.
+    """
+    if not 0 < max_depth <= 16:
+        raise ValueError(f"max_depth must be between 1 and 16, got {max_depth}.")
+
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    phi = np.asarray(phi_deg, dtype=float)
+    theta = np.asarray(theta_deg, dtype=float)
+    keep = np.isfinite(x) & np.isfinite(y) & np.isfinite(phi) & np.isfinite(theta)
+    x, y, phi, theta = x[keep], y[keep], phi[keep], theta[keep]
+
+    if bounds is None:
+        bounds = (x.min(initial=0.0), x.max(initial=1.0), y.min(initial=0.0), y.max(initial=1.0))
+    x_lo, x_hi, y_lo, y_hi = (float(b) for b in bounds)
+    # square root node so every node is square in nm
+    size = max(x_hi - x_lo, y_hi - y_lo, 1e-9)
+
+    n_fine = 1 << max_depth
+    ix = np.clip(np.floor((x - x_lo) / size * n_fine), 0, n_fine - 1).astype(np.int64)
+    iy = np.clip(np.floor((y - y_lo) / size * n_fine), 0, n_fine - 1).astype(np.int64)
+    code = morton_code(ix, iy)
+
+    order = np.argsort(code, kind="stable")
+    code = code[order]
+    points = {
+        "x": x[order], "y": y[order], "phi": phi[order], "theta": theta[order],
+    }
+    cos_phi = np.cos(np.radians(points["phi"]))
+    sin_phi = np.sin(np.radians(points["phi"]))
+
+    levels = []
+    for level in range(max_depth + 1):
+        node_code = code >> np.uint64(2 * (max_depth - level))
+        if len(node_code):
+            start = np.flatnonzero(np.r_[True, node_code[1:] != node_code[:-1]])
+        else:
+            start = np.empty(0, dtype=np.int64)
+        stop = np.r_[start[1:], len(node_code)].astype(np.int64)
+
+        def node_sum(values):
+            return np.add.reduceat(values, start) if len(start) else np.empty(0)
+
+        levels.append({
+            "code": node_code[start],
+            "start": start.astype(np.int64),
+            "stop": stop,
+            "count": (stop - start).astype(np.int64),
+            "sum_x": node_sum(points["x"]),
+            "sum_y": node_sum(points["y"]),
+            "sum_cos": node_sum(cos_phi),
+            "sum_sin": node_sum(sin_phi),
+            "sum_theta": node_sum(points["theta"]),
+        })
+
+    return {
+        "bounds": (x_lo, x_lo + size, y_lo, y_lo + size),
+        "size": size,
+        "max_depth": max_depth,
+        "points": points,
+        "levels": levels,
+    }
+
+
+def build_lod_index_from_table(df: pd.DataFrame, bounds=None, max_depth: int = MAX_DEPTH) -> dict:
+    return build_lod_index(
+        df["mid_x"].to_numpy(), df["mid_y"].to_numpy(),
+        df["Φ (degrees)"].to_numpy(), df["θ (degrees)"].to_numpy(),
+        bounds=bounds, max_depth=max_depth,
+    )
+
+
+# =================================================================================================
+# VIEWPORT QUERY
+# =================================================================================================
+def _cell_range(index: dict, level: int, lo: float, hi: float, origin: float) -> tuple[int, int]:
+    n = 1 << level
+    cell = index["size"] / n
+    a = int(np.clip(np.floor((lo - origin) / cell), 0, n - 1))
+    b = int(np.clip(np.floor((hi - origin) / cell), 0, n - 1))
+    return a, b
+
+
+def _lookup(index: dict, level: int, ix: np.ndarray, iy: np.ndarray) -> np.ndarray:
+    """Positions (into levels[level]) of the non-empty nodes among cells (ix, iy)."""
+    node = index["levels"][level]
+    codes = morton_code(ix, iy)
+    if len(node["code"]) == 0:
+        return np.empty(0, dtype=np.int64)
+    pos = np.minimum(np.searchsorted(node["code"], codes), len(node["code"]) - 1)
+    return pos[node["code"][pos] == codes]
+
+
+def _node_result(index: dict, level: int, pos: np.ndarray) -> dict:
+    node = index["levels"][level]
+    count = node["count"][pos]
+    sum_cos, sum_sin = node["sum_cos"][pos], node["sum_sin"][pos]
+    return {
+        "kind": "nodes",
+        "level": level,
+        "cell_nm": index["size"] / (1 << level),
+        "x": node["sum_x"][pos] / count,
+        "y": node["sum_y"][pos] / count,
+        "count": count,
+        "phi": np.degrees(np.arctan2(sum_sin, sum_cos)) % 360.0,
+        "phi_r": np.hypot(sum_cos, sum_sin) / count,      # resultant length: 1 = all Φ aligned
+        "theta": node["sum_theta"][pos] / count,
+    }
+
+
+def query_viewport(index: dict, x0: float, x1: float, y0: float, y1: float, max_items: int = 5000) -> dict:
+    """
+    At most max_items items inside [x0, x1] × [y0, y1]: the individual dipoles if there are few enough, otherwise the
+    finest quadtree nodes that fit (centroid, count, circular-mean Φ, resultant length, mean θ).
+    """
+    x0, x1 = sorted((x0, x1))
+    y0, y1 = sorted((y0, y1))
+    bx_lo, _, by_lo, _ = index["bounds"]
+    depth = index["max_depth"]
+
+    # Coarsest level to start from: all cells it has over the viewport fit in max_items
+    level = 0
+    for lv in range(depth + 1):
+        ax, bx = _cell_range(index, lv, x0, x1, bx_lo)
+        ay, by = _cell_range(index, lv, y0, y1, by_lo)
+        if (bx - ax + 1) * (by - ay + 1) > max_items:
+            break
+        level = lv
+
+    ax, bx = _cell_range(index, level, x0, x1, bx_lo)
+    ay, by = _cell_range(index, level, y0, y1, by_lo)
+    gx, gy = np.meshgrid(np.arange(ax, bx + 1), np.arange(ay, by + 1), indexing="ij")
+    ix, iy = gx.ravel(), gy.ravel()
+    pos = _lookup(index, level, ix, iy)
+
+    # Refine into non-empty children while the result still fits
+    while True:
+        node = index["levels"][level]
+        if node["count"][pos].sum() <= max_items or level == depth:
+            break
+        code = node["code"][pos]
+        # decode parent cells from their codes (children are 2ix + {0,1}, 2iy + {0,1})
+        pix, piy = _decode(code)
+        cix = (2 * pix[:, None] + np.array([0, 1, 0, 1])).ravel()
+        ciy = (2 * piy[:, None] + np.array([0, 0, 1, 1])).ravel()
+        cax, cbx = _cell_range(index, level + 1, x0, x1, bx_lo)
+        cay, cby = _cell_range(index, level + 1, y0, y1, by_lo)
+        inside = (cix >= cax) & (cix <= cbx) & (ciy >= cay) & (ciy <= cby)
+        child_pos = _lookup(index, level + 1, cix[inside], ciy[inside])
+        if len(child_pos) > max_items:
+            break
+        level, pos = level + 1, child_pos
+
+    node = index["levels"][level]
+    if node["count"][pos].sum() <= max_items:
+        # Few enough dipoles: return them (nodes on the viewport edge may hold rows just outside it)
+        rows = _ranges(node["start"][pos], node["stop"][pos])
+        p = index["points"]
+        inside = (p["x"][rows] >= x0) & (p["x"][rows] <= x1) & (p["y"][rows] >= y0) & (p["y"][rows] <= y1)
+        rows = rows[inside]
+        return {
+            "kind": "points", "level": depth, "cell_nm": 0.0,
+            "x": p["x"][rows], "y": p["y"][rows], "count": np.ones(len(rows), dtype=np.int64),
+            "phi": p["phi"][rows] % 360.0, "phi_r": np.ones(len(rows)), "theta": p["theta"][rows],
+        }
+    return _node_result(index, level, pos)
+
+
+def _compact_bits(v: np.ndarray) -> np.ndarray:
+    v = v & np.uint64(0x55555555)
+    v = (v | (v >> np.uint64(1))) & np.uint64(0x33333333)
+    v = (v | (v >> np.uint64(2))) & np.uint64(0x0F0F0F0F)
+    v = (v | (v >> np.uint64(4))) & np.uint64(0x00FF00FF)
+    v = (v | (v >> np.uint64(8))) & np.uint64(0x0000FFFF)
+    return v.astype(np.int64)
+
+
+def _decode(code: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    return _compact_bits(code), _compact_bits(code >> np.uint64(1))
+
+
+def _ranges(start: np.ndarray, stop: np.ndarray) -> np.ndarray:
+    """Concatenation of arange(start[k], stop[k]) for all k."""
+    lengths = stop - start
+    if lengths.sum() == 0:
+        return np.empty(0, dtype=np.int64)
+    offsets = np.repeat(start - np.r_[0, np.cumsum(lengths)[:-1]], lengths)
+    return np.arange(lengths.sum(), dtype=np.int64) + offsets
+
+
+# =================================================================================================
+# INTERACTIVE VIEWER (matplotlib: pan / zoom with the toolbar, the map is re-queried on every view change)
+# =================================================================================================
+class DipoleMapViewer:
+    """
+    Midpoints colored by θ with Φ arrows. Aggregated nodes are drawn at their centroid with the circular-mean Φ; the
+    arrow length follows the node size and its resultant length (short arrows = mixed orientations in that node).
+    """
+
+    def __init__(self, index: dict, max_items: int = 5000, arrow_fraction: float = 0.02):
+        import matplotlib.pyplot as plt
+
+        self.index = index
+        self.max_items = max_items
+        self.arrow_fraction = arrow_fraction
+        self.fig, self.ax = plt.subplots(figsize=(10, 8))
+        self._artists = []
+        self._busy = False
+
+        x_lo, x_hi, y_lo, y_hi = index["bounds"]
+        self._sc = self.ax.scatter([], [], c=[], cmap="viridis", vmin=0, vmax=90, s=20,
+                                   edgecolors="k", linewidths=0.1)
+        cbar = self.fig.colorbar(self._sc, ax=self.ax)
+        cbar.set_label("θ (degrees)", rotation=270, labelpad=15)
+        self.ax.set_xlabel("X Position (nm)")
+        self.ax.set_ylabel("Y Position (nm)")
+        self.ax.grid(True)
+        self.ax.set_xlim(x_lo, x_hi)
+        self.ax.set_ylim(y_hi, y_lo)   # inverted y, as in the static midpoint maps
+        self.ax.callbacks.connect("xlim_changed", self._on_view_change)
+        self.ax.callbacks.connect("ylim_changed", self._on_view_change)
+        self.redraw()
+
+    def _on_view_change(self, _ax) -> None:
+        if not self._busy:
+            self.redraw()
+
+    def redraw(self) -> dict:
+        self._busy = True
+        try:
+            x0, x1 = self.ax.get_xlim()
+            y0, y1 = self.ax.get_ylim()
+            res = query_viewport(self.index, x0, x1, y0, y1, max_items=self.max_items)
+
+            for artist in self._artists:
+                artist.remove()
+            self._artists = []
+
+            xy = np.column_stack([res["x"], res["y"]]) if len(res["x"]) else np.empty((0, 2))
+            self._sc.set_offsets(xy)
+            self._sc.set_array(res["theta"])
+            sizes = 20 if res["kind"] == "points" else 20 + 40 * np.log10(res["count"])
+            self._sc.set_sizes(np.broadcast_to(sizes, len(res["x"])))
+
+            if len(res["x"]):
+                view = max(abs(x1 - x0), abs(y1 - y0))
+                length = self.arrow_fraction * view if res["kind"] == "points" else 0.8 * res["cell_nm"]
+                length = length * res["phi_r"]
+                phi_rad = np.radians(res["phi"])
+                self._artists.append(self.ax.quiver(
+                    res["x"], res["y"], np.cos(phi_rad) * length, np.sin(phi_rad) * length,
+                    angles="xy", scale_units="xy", scale=1,
+                    color="black", width=0.0025, alpha=0.7
+                ))
+
+            detail = "individual dipoles" if res["kind"] == "points" else f"quadtree level {res['level']}"
+            self.ax.set_title(f"Dipole Midpoints (θ color, Φ arrows): {len(res['x'])} items, {detail}")
+            self.fig.canvas.draw_idle()
+            return res
+        finally:
+            self._busy = False
+
+    def show(self) -> None:
+        import matplotlib.pyplot as plt
+        plt.show()
+
+
+if __name__ == "__main__":
+    import sys
+    import time
+    from smlm_io import read_table_cached
+
+    if len(sys.argv) < 2:
+        raise SystemExit("Usage: python smlm_lod.py <Tracked_Dipoles table (.parquet / .npz / .xlsx)> [max_items]")
+
+    table = read_table_cached(sys.argv[1], columns=MIDPOINT_COLS)
+    t0 = time.perf_counter()
+    lod = build_lod_index_from_table(table)
+    print(f"Indexed {len(lod['points']['x'])} dipoles in {time.perf_counter() - t0:.2f} s")
+
+    DipoleMapViewer(lod, max_items=int(sys.argv[2]) if len(sys.argv) > 2 else 5000).show()
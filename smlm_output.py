@@ -0,0 +1,202 @@
+#################################################################################################################################
+#################################   BACKGROUND OUTPUT WRITER (EXCEL / COLUMNAR / FIGURES)   #####################################
+#################################################################################################################################
+#
+# Writing a large Excel workbook or rendering a 300-dpi PNG can take as long as the analysis that produced it. Instead of
+# blocking on every to_excel() / savefig(), finished tables and figures are queued to a small pool of worker processes and
+# written while the pipeline keeps computing.
+#
+#   writer.write_table(df, path)               -> .xlsx / .csv / .parquet / .npz, chosen by extension
+#   writer.write_tracked_workbook(df, path)    -> "Master" sheet + one sheet per Track ID
+#   columnar_copy=<.parquet/.npz path>         -> (both) also write the columnar copy, in the same job AFTER the Excel file,
+#                                                 so the copy is never older than its workbook (smlm_io's staleness check)
+#   writer.submit(label, fn, *args)            -> any other job, e.g. smlm_figures.render_figure (Agg, from published arrays)
+#   writer.flush()                             -> barrier: waits for everything queued so far, re-raises the first failure
+#
+# Errors are not lost: a failed write is raised at the next submit, at flush(), or when the "with" block exits. An output
+# path with an extension that cannot be written is rejected immediately, when the job is queued.
+#################################################################################################################################
+
+import os
+import threading
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+
+import pandas as pd
+
+from smlm_io import write_columnar
+
+
+# Extensions that can be written (pandas can no longer write legacy .xls); checked when a job is queued, not in the worker
+EXCEL_WRITE_EXTS = (".xlsx", ".xlsm")
+TABLE_WRITE_EXTS = EXCEL_WRITE_EXTS + (".csv", ".parquet", ".npz")
+
+TRACK_SHEET_COLUMNS = [
+    "C1 Frame", "Distance (nm)", "Φ (degrees)", "θ (degrees)",
+    "C1 X (nm)", "C1 Y (nm)", "C2 X (nm)", "C2 Y (nm)"
+]
+
+
+# =================================================================================================
+# WORK FUNCTIONS (module level so worker processes can import them)
+# =================================================================================================
+def _init_worker() -> None:
+    import matplotlib
+    matplotlib.use("Agg")
+
+
+def write_table_file(df: pd.DataFrame, path: str, columnar_copy: str | None = None, **kwargs) -> str:
+    ext = os.path.splitext(path)[1].lower()
+    if ext in EXCEL_WRITE_EXTS:
+        df.to_excel(path, index=False, **kwargs)
+    elif ext == ".csv":
+        df.to_csv(path, index=False, **kwargs)
+    else:
+        write_columnar(df, path)
+    if columnar_copy is not None:
+        write_columnar(df, columnar_copy)
+    return path
+
+
+def write_tracked_workbook_file(distance_df_tracked: pd.DataFrame, path: str, columnar_copy: str | None = None) -> str:
+    with pd.ExcelWriter(path, engine="xlsxwriter") as writer:
+        distance_df_tracked.to_excel(writer, sheet_name="Master", index=False)
+        for track_id, group in distance_df_tracked.groupby("Track ID"):
+            group_sorted = group.sort_values("C1 Frame")
+            track_df = group_sorted[TRACK_SHEET_COLUMNS]
+            track_df.to_excel(writer, sheet_name=f"Track_{int(track_id)}", index=False)
+    if columnar_copy is not None:
+        write_columnar(distance_df_tracked, columnar_copy)
+    return path
+
+
+def write_sheets_file(sheets: dict[str, pd.DataFrame], path: str) -> str:
+    with pd.ExcelWriter(path, engine="xlsxwriter") as writer:
+        for sheet_name, df in sheets.items():
+            df.to_excel(writer, sheet_name=sheet_name, index=False)
+    return path
+
+
+def _check_extension(path: str, allowed: tuple[str, ...]) -> None:
+    ext = os.path.splitext(path)[1].lower()
+    if ext not in allowed:
+        raise ValueError(f"Cannot write '{path}': unsupported extension '{ext}' (use one of {', '.join(allowed)}).")
+
+
+# =================================================================================================
+# BACKGROUND WRITER
+# =================================================================================================
+class BackgroundWriter:
+    """
+    Queue of output jobs executed by a process pool (kind="process", default) or a thread pool (kind="thread").
+    workers=0 writes synchronously in the calling process, which is handy for debugging.
+    """
+
+    def __init__(self, workers: int | None = 2, kind: str = "process", verbose: bool = True):
+        if kind not in ("process", "thread"):
+            raise ValueError(f"kind must be 'process' or 'thread', got {kind!r}.")
+
+        self.verbose = verbose
+        self._lock = threading.Lock()
+        self._pending: list[tuple[str, Future]] = []
+        self._errors: list[tuple[str, BaseException]] = []
+        self._recorded: set[Future] = set()
+        self.written: list[str] = []
+
+        if workers == 0:
+            self._pool = None
+        elif kind == "process":
+            self._pool = ProcessPoolExecutor(max_workers=workers, initializer=_init_worker)
+        else:
+            self._pool = ThreadPoolExecutor(max_workers=workers)
+
+    # ---------------------------------------------------------------------------------------------
+    # submission
+    # ---------------------------------------------------------------------------------------------
+    def submit(self, label: str, fn, *args, **kwargs) -> Future:
+        self._raise_if_failed()
+
+        if self._pool is None:
+            fut = Future()
+            try:
+                fut.set_result(fn(*args, **kwargs))
+            except Exception as exc:
+                fut.set_exception(exc)
+        else:
+            fut = self._pool.submit(fn, *args, **kwargs)
+
+        with self._lock:
+            self._pending.append((label, fut))
+        fut.add_done_callback(lambda f, label=label: self._on_done(label, f))
+        return fut
+
+    def write_table(self, df: pd.DataFrame, path: str, columnar_copy: str | None = None, **kwargs) -> Future:
+        _check_extension(path, TABLE_WRITE_EXTS)
+        if columnar_copy is not None:
+            _check_extension(columnar_copy, (".parquet", ".npz"))
+        label = path if columnar_copy is None else f"{path} (+ {columnar_copy})"
+        return self.submit(label, write_table_file, df, path, columnar_copy, **kwargs)
+
+    def write_sheets(self, sheets: dict[str, pd.DataFrame], path: str) -> Future:
+        _check_extension(path, EXCEL_WRITE_EXTS)
+        return self.submit(path, write_sheets_file, sheets, path)
+
+    def write_tracked_workbook(self, distance_df_tracked: pd.DataFrame, path: str, columnar_copy: str | None = None) -> Future:
+        _check_extension(path, EXCEL_WRITE_EXTS)
+        if columnar_copy is not None:
+            _check_extension(columnar_copy, (".parquet", ".npz"))
+        label = path if columnar_copy is None else f"{path} (+ {columnar_copy})"
+        return self.submit(label, write_tracked_workbook_file, distance_df_tracked, path, columnar_copy)
+
+    # ---------------------------------------------------------------------------------------------
+    # completion / barrier
+    # ---------------------------------------------------------------------------------------------
+    def _on_done(self, label: str, fut: Future) -> None:
+        # Called from the executor's callback thread and again from flush(); records each job exactly once
+        exc = fut.exception()
+        with self._lock:
+            if fut in self._recorded:
+                return
+            self._recorded.add(fut)
+            if exc is not None:
+                self._errors.append((label, exc))
+            else:
+                self.written.append(label)
+        if exc is None and self.verbose:
+            print(f"Saved output: {label}")
+
+    def _raise_if_failed(self) -> None:
+        with self._lock:
+            if not self._errors:
+                return
+            label, exc = self._errors[0]
+            n_failed = len(self._errors)
+        raise RuntimeError(f"Background write of '{label}' failed ({n_failed} failed write(s) so far).") from exc
+
+    def flush(self) -> list[str]:
+        with self._lock:
+            pending, self._pending = self._pending, []
+        for label, fut in pending:
+            self._on_done(label, fut)   # blocks until the job is finished
+        self._raise_if_failed()
+        return list(self.written)
+
+    def close(self) -> None:
+        try:
+            self.flush()
+        finally:
+            if self._pool is not None:
+                self._pool.shutdown(wait=True)
+                self._pool = None
+
+    def __enter__(self) -> "BackgroundWriter":
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        if exc_type is None:
+            self.close()
+        else:
+            # The pipeline already failed: still finish/stop the workers, but report the original error
+            try:
+                self.close()
+            except Exception:
+                pass
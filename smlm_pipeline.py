@@ -0,0 +1,548 @@
+#################################################################################################################################
+#################################   SMLM PIPELINE STAGES (IMPORTABLE)   #########################################################
+#################################################################################################################################
+#
+# The stage functions of "02-08-25_SMLM_IMAGE ANALYSIS GENERAL_optimized.py", kept in a plain module so they can be
+# imported by worker processes (tiling, parallel rendering, ...) without re-running the analysis script.
+#
+#   load_and_filter            -> thresholds on uncertainty (exported, or recomputed by smlm_precision.py) / intensity / XY
+#   remove_ambiguous_triplets  -> high-population ambiguity deletion
+#   radius_pair_indices        -> Part A: every C1–C2 pair within RADIUS_NM (frame-agnostic)
+#   window_pair_indices        -> Part A restricted to |C1 frame − C2 frame| <= k, streamed over frame blocks
+#   frame_pair_indices         -> Part B: C1–C2 pairs within RADIUS_NM in the same frame
+#   distance_table / frame_pair_table -> output tables for the two pairings
+#   add_dipole_geometry        -> Φ, θ, midpoints
+#   track_midpoints            -> Hungarian linking of midpoints across frames
+#   close_track_gaps           -> second pass: joins track segments across blinks / long jumps (one sparse LAP)
+#
+# The neighbour searches, the ambiguity rule and the Φ/θ/midpoint arithmetic run through smlm_kernels.py (NumPy, or Numba
+# when installed).
+#################################################################################################################################
+
+import numpy as np
+import pandas as pd
+
+from scipy.spatial import cKDTree
+from scipy.optimize import linear_sum_assignment
+from scipy.sparse import coo_matrix
+from scipy.sparse.csgraph import min_weight_full_bipartite_matching
+from scipy.spatial.distance import cdist
+
+from smlm_kernels import radius_neighbors, same_channel_pairs, crowding_masks, dipole_geometry
+from smlm_precision import PHOTON_COL, BACKGROUND_COL, SIGMA_COL, recompute_uncertainty
+
+
+# =================================================================================================
+# DEFAULT COLUMN NAMES (the analysis scripts pass their own)
+# =================================================================================================
+ID_COL = "id"
+FRAME_COL = "frame"
+XCOL = "x [nm]"
+YCOL = "y [nm]"
+UNCERTAINTY_COL = "uncertainty_xy [nm]"
+INTENSITY_COL = "intensity [photon]"
+
+ROD_LENGTH_NM = 120.0          # θ model: cos θ = distance / rod length
+
+DISTANCE_COLUMNS = [
+    "C1 X (nm)", "C1 Y (nm)", "C2 X (nm)", "C2 Y (nm)",
+    "Distance (nm)", "C1 Uncertainty (nm)", "C2 Uncertainty (nm)",
+    "Dipole Angle (degrees)"
+]
+FRAME_PAIR_COLUMNS = [
+    "C1 id", "C1 Frame", "C1 X (nm)", "C1 Y (nm)",
+    "C2 id", "C2 Frame", "C2 X (nm)", "C2 Y (nm)",
+    "Distance (nm)", "C1 Uncertainty (nm)", "C2 Uncertainty (nm)"
+]
+
+
+# =================================================================================================
+# LOAD + FILTER
+#   - Loads the needed columns once
+#   - Applies uncertainty, (optional) intensity, and XY window thresholds
+# =================================================================================================
+def load_and_filter(
+    csv_path: str,
+    lower_unc: float, upper_unc: float,
+    x_lo: float, x_hi: float,
+    y_lo: float, y_hi: float,
+    intensity_lo: float, intensity_hi: float,
+    id_col: str = ID_COL,
+    frame_col: str = FRAME_COL,
+    xcol: str = XCOL,
+    ycol: str = YCOL,
+    ucol: str = UNCERTAINTY_COL,
+    icol: str | None = INTENSITY_COL,
+    precision: dict | None = None,
+) -> pd.DataFrame:
+    """
+    precision=None thresholds the exported uncertainty column. Otherwise ucol is replaced by the uncertainty recomputed
+    from photons, background and PSF width (precision = keyword arguments of smlm_precision.recompute_uncertainty,
+    e.g. {"camera": {...}, "method": "lsq", "sigma_nm": 130.0}) before the thresholds are applied.
+    """
+    usecols = [id_col, frame_col, xcol, ycol] + ([ucol] if precision is None else [])
+    if icol is not None:
+        usecols.append(icol)
+
+    extra = []
+    if precision is not None:
+        header = set(pd.read_csv(csv_path, nrows=0).columns)
+        photon_col = precision.get("photon_col", PHOTON_COL)
+        extra = [c for c in (photon_col, precision.get("background_col", BACKGROUND_COL), precision.get("sigma_col", SIGMA_COL))
+                 if c is not None and c in header and c not in usecols]
+
+    df = pd.read_csv(csv_path, usecols=usecols + extra).dropna(subset=usecols + extra).reset_index(drop=True)
+
+    if precision is not None:
+        df[ucol] = recompute_uncertainty(df, **precision)
+        df = df[[id_col, frame_col, xcol, ycol, ucol] + ([icol] if icol is not None else [])]
+
+    m = (
+        (df[ucol] >= lower_unc) & (df[ucol] <= upper_unc) &
+        (df[xcol] >= x_lo) & (df[xcol] <= x_hi) &
+        (df[ycol] >= y_lo) & (df[ycol] <= y_hi)
+    )
+    if icol is not None:
+        m = m & (df[icol] >= intensity_lo) & (df[icol] <= intensity_hi)
+
+    return df.loc[m].reset_index(drop=True)
+
+
+# =================================================================================================
+# HIGH-POPULATION AMBIGUITY DELETION
+#   If a same-channel close pair (<= r_nm) exists AND either member is close to opposite channel
+#   (<= r_nm), remove BOTH same-channel puncta AND the opposite-channel puncta within r_nm.
+# =================================================================================================
+def ambiguous_triplet_masks(c1_xy: np.ndarray, c2_xy: np.ndarray, r_nm: float) -> tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """Removal masks for both channels plus the same-channel pairs (K x 2 index arrays) that were checked."""
+    remove_c1 = np.zeros(len(c1_xy), dtype=bool)
+    remove_c2 = np.zeros(len(c2_xy), dtype=bool)
+    no_pairs = np.empty((0, 2), dtype=np.intp)
+
+    if len(c1_xy) == 0 or len(c2_xy) == 0:
+        return remove_c1, remove_c2, no_pairs, no_pairs
+
+    def process_same_channel_pairs(same_xy, other_xy) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        pairs = same_channel_pairs(same_xy, r_nm)
+
+        # opposite-channel neighbours, only looked up for puncta that are in a same-channel pair
+        members = np.unique(pairs)
+        member_counts, nb_indices = radius_neighbors(same_xy[members], other_xy, r_nm)
+        nb_counts = np.zeros(len(same_xy), dtype=np.int64)
+        nb_counts[members] = member_counts
+
+        remove_same, remove_other = crowding_masks(pairs, nb_counts, nb_indices, len(same_xy), len(other_xy))
+        return pairs, remove_same, remove_other
+
+    pairs_c1, remove_c1_by_c1, remove_c2_by_c1 = process_same_channel_pairs(c1_xy, c2_xy)
+    pairs_c2, remove_c2_by_c2, remove_c1_by_c2 = process_same_channel_pairs(c2_xy, c1_xy)
+    remove_c1 = remove_c1_by_c1 | remove_c1_by_c2
+    remove_c2 = remove_c2_by_c1 | remove_c2_by_c2
+    return remove_c1, remove_c2, pairs_c1, pairs_c2
+
+
+def remove_ambiguous_triplets(
+    df_c1: pd.DataFrame, df_c2: pd.DataFrame, r_nm: float = 232.0,
+    xcol: str = XCOL, ycol: str = YCOL,
+) -> tuple[pd.DataFrame, pd.DataFrame, dict]:
+    c1_xy = df_c1[[xcol, ycol]].to_numpy(dtype=float)
+    c2_xy = df_c2[[xcol, ycol]].to_numpy(dtype=float)
+
+    remove_c1, remove_c2, pairs_c1, pairs_c2 = ambiguous_triplet_masks(c1_xy, c2_xy, r_nm)
+
+    df_c1_filt = df_c1.loc[~remove_c1].reset_index(drop=True)
+    df_c2_filt = df_c2.loc[~remove_c2].reset_index(drop=True)
+
+    report = {
+        "r_nm": r_nm,
+        "initial_c1": len(df_c1), "initial_c2": len(df_c2),
+        "same_channel_pairs_checked_c1": len(pairs_c1), "same_channel_pairs_checked_c2": len(pairs_c2),
+        "removed_c1": int(remove_c1.sum()), "removed_c2": int(remove_c2.sum()),
+        "final_c1": len(df_c1_filt), "final_c2": len(df_c2_filt),
+    }
+    return df_c1_filt, df_c2_filt, report
+
+
+# =================================================================================================
+# PART A: FRAME-AGNOSTIC PAIRING
+#   All C1–C2 pairs within r_nm across all frames, ordered by C1 row then C2 row
+# =================================================================================================
+def radius_pair_indices(c1_xy: np.ndarray, c2_xy: np.ndarray, r_nm: float) -> tuple[np.ndarray, np.ndarray]:
+    empty = np.empty(0, dtype=int)
+    if len(c1_xy) == 0 or len(c2_xy) == 0:
+        return empty, empty
+
+    counts, c2_idx = radius_neighbors(c1_xy, c2_xy, r_nm)
+    if c2_idx.size == 0:
+        return empty, empty
+
+    c1_idx = np.repeat(np.arange(len(c1_xy)), counts)
+    return c1_idx, c2_idx
+
+
+# -------------------------------------------------------------------------------------------------
+# Windowed Part A: only pairs whose frames are within ±window_frames of each other
+#   On long acquisitions the frame-agnostic output grows with (localizations per site)² per site. With a frame window it
+#   grows linearly with the number of frames. Frames are processed in blocks of block_frames: the C1 localizations of one
+#   block are searched against the C2 localizations of that block ± window_frames only, so the neighbour lists in memory
+#   never cover more than one block.
+# -------------------------------------------------------------------------------------------------
+def iter_window_pair_blocks(
+    df_c1: pd.DataFrame, df_c2: pd.DataFrame, r_nm: float, window_frames: int, block_frames: int | None = None,
+    frame_col: str = FRAME_COL, xcol: str = XCOL, ycol: str = YCOL,
+):
+    """Yields (c1_idx, c2_idx) per frame block, in block order (pairs within a block ordered by C1 row then C2 row)."""
+    if window_frames < 0:
+        raise ValueError(f"window_frames must be >= 0, got {window_frames}.")
+    if block_frames is None:
+        block_frames = max(4 * window_frames, 32)
+    if len(df_c1) == 0 or len(df_c2) == 0:
+        return
+
+    f1 = df_c1[frame_col].to_numpy(dtype=float)
+    f2 = df_c2[frame_col].to_numpy(dtype=float)
+    c1_xy = df_c1[[xcol, ycol]].to_numpy(dtype=float)
+    c2_xy = df_c2[[xcol, ycol]].to_numpy(dtype=float)
+
+    order1 = np.argsort(f1, kind="stable")
+    order2 = np.argsort(f2, kind="stable")
+    f1_sorted, f2_sorted = f1[order1], f2[order2]
+
+    f_min = f1_sorted[0]
+    for block in np.unique(np.floor((f1_sorted - f_min) / block_frames)):
+        b0 = f_min + block * block_frames
+        b1 = b0 + block_frames
+        rows1 = np.sort(order1[np.searchsorted(f1_sorted, b0, "left"):np.searchsorted(f1_sorted, b1, "left")])
+        rows2 = np.sort(order2[np.searchsorted(f2_sorted, b0 - window_frames, "left"):
+                               np.searchsorted(f2_sorted, b1 + window_frames, "left")])
+        if len(rows1) == 0 or len(rows2) == 0:
+            continue
+
+        counts, local_c2 = radius_neighbors(c1_xy[rows1], c2_xy[rows2], r_nm)
+        c1_idx = np.repeat(rows1, counts)
+        c2_idx = rows2[local_c2]
+        keep = np.abs(f1[c1_idx] - f2[c2_idx]) <= window_frames
+        yield c1_idx[keep], c2_idx[keep]
+
+
+def window_pair_indices(
+    df_c1: pd.DataFrame, df_c2: pd.DataFrame, r_nm: float, window_frames: int, block_frames: int | None = None,
+    frame_col: str = FRAME_COL, xcol: str = XCOL, ycol: str = YCOL,
+) -> tuple[np.ndarray, np.ndarray]:
+    """All windowed Part A pairs, ordered by C1 row then C2 row like radius_pair_indices."""
+    blocks = list(iter_window_pair_blocks(df_c1, df_c2, r_nm, window_frames, block_frames, frame_col, xcol, ycol))
+    if not blocks:
+        empty = np.empty(0, dtype=int)
+        return empty, empty
+
+    c1_idx = np.concatenate([b[0] for b in blocks])
+    c2_idx = np.concatenate([b[1] for b in blocks])
+    order = np.lexsort((c2_idx, c1_idx))
+    return c1_idx[order], c2_idx[order]
+
+
+def distance_table(
+    df_c1: pd.DataFrame, df_c2: pd.DataFrame, c1_idx: np.ndarray, c2_idx: np.ndarray,
+    xcol: str = XCOL, ycol: str = YCOL, ucol: str = UNCERTAINTY_COL,
+) -> pd.DataFrame:
+    if len(c1_idx) == 0:
+        return pd.DataFrame(columns=DISTANCE_COLUMNS)
+
+    c1_sel = df_c1[[xcol, ycol]].to_numpy(dtype=float)[c1_idx]
+    c2_sel = df_c2[[xcol, ycol]].to_numpy(dtype=float)[c2_idx]
+
+    dist, angles, _, _, _ = dipole_geometry(c1_sel[:, 0], c1_sel[:, 1], c2_sel[:, 0], c2_sel[:, 1], ROD_LENGTH_NM)
+
+    return pd.DataFrame({
+        "C1 X (nm)": c1_sel[:, 0],
+        "C1 Y (nm)": c1_sel[:, 1],
+        "C2 X (nm)": c2_sel[:, 0],
+        "C2 Y (nm)": c2_sel[:, 1],
+        "Distance (nm)": dist,
+        "C1 Uncertainty (nm)": df_c1[ucol].to_numpy()[c1_idx],
+        "C2 Uncertainty (nm)": df_c2[ucol].to_numpy()[c2_idx],
+        "Dipole Angle (degrees)": angles,
+    })
+
+
+# =================================================================================================
+# PART B: FRAME-AWARE PAIRING
+#   C1↔C2 pairs within r_nm in the same frame, ordered by C1 row then C2 row
+# =================================================================================================
+def frame_pair_indices(
+    df_c1: pd.DataFrame, df_c2: pd.DataFrame, r_nm: float,
+    frame_col: str = FRAME_COL, xcol: str = XCOL, ycol: str = YCOL,
+) -> tuple[np.ndarray, np.ndarray]:
+    empty = np.empty(0, dtype=int)
+    if len(df_c1) == 0 or len(df_c2) == 0:
+        return empty, empty
+
+    c1_rows_by_frame = df_c1.groupby(frame_col, sort=False).indices
+    c2_rows_by_frame = df_c2.groupby(frame_col, sort=False).indices
+    c1_xy = df_c1[[xcol, ycol]].to_numpy(dtype=float)
+    c2_xy = df_c2[[xcol, ycol]].to_numpy(dtype=float)
+
+    c1_parts, c2_parts = [], []
+    for frame_val, rows1 in c1_rows_by_frame.items():
+        rows2 = c2_rows_by_frame.get(frame_val)
+        if rows2 is None:
+            continue
+
+        counts, local_c2 = radius_neighbors(c1_xy[rows1], c2_xy[rows2], r_nm)
+        if local_c2.size == 0:
+            continue
+
+        c1_parts.append(np.repeat(rows1, counts))
+        c2_parts.append(rows2[local_c2])
+
+    if not c1_parts:
+        return empty, empty
+
+    c1_idx = np.concatenate(c1_parts)
+    c2_idx = np.concatenate(c2_parts)
+    order = np.lexsort((c2_idx, c1_idx))
+    return c1_idx[order], c2_idx[order]
+
+
+def frame_pair_table(
+    df_c1: pd.DataFrame, df_c2: pd.DataFrame, c1_idx: np.ndarray, c2_idx: np.ndarray,
+    id_col: str = ID_COL, frame_col: str = FRAME_COL,
+    xcol: str = XCOL, ycol: str = YCOL, ucol: str = UNCERTAINTY_COL,
+) -> pd.DataFrame:
+    if len(c1_idx) == 0:
+        return pd.DataFrame(columns=FRAME_PAIR_COLUMNS)
+
+    c1_x = df_c1[xcol].to_numpy(dtype=float)[c1_idx]
+    c1_y = df_c1[ycol].to_numpy(dtype=float)[c1_idx]
+    c2_x = df_c2[xcol].to_numpy(dtype=float)[c2_idx]
+    c2_y = df_c2[ycol].to_numpy(dtype=float)[c2_idx]
+    dx = c2_x - c1_x
+    dy = c2_y - c1_y
+
+    return pd.DataFrame({
+        "C1 id": df_c1[id_col].to_numpy()[c1_idx],
+        "C1 Frame": df_c1[frame_col].to_numpy()[c1_idx],
+        "C1 X (nm)": c1_x,
+        "C1 Y (nm)": c1_y,
+        "C2 id": df_c2[id_col].to_numpy()[c2_idx],
+        "C2 Frame": df_c2[frame_col].to_numpy()[c2_idx],
+        "C2 X (nm)": c2_x,
+        "C2 Y (nm)": c2_y,
+        "Distance (nm)": np.sqrt(dx * dx + dy * dy),
+        "C1 Uncertainty (nm)": df_c1[ucol].to_numpy()[c1_idx],
+        "C2 Uncertainty (nm)": df_c2[ucol].to_numpy()[c2_idx],
+    })
+
+
+# =================================================================================================
+# Φ / θ / MIDPOINTS
+#   - Φ from atan2 (0–360)
+#   - θ from the rod-length model (θ == 0 rows removed, as in the original scripts)
+# =================================================================================================
+def add_dipole_geometry(distance_df_tracked: pd.DataFrame, rod_length_nm: float = ROD_LENGTH_NM) -> pd.DataFrame:
+    distance_df_tracked = distance_df_tracked.copy()
+
+    # Φ, θ (rod-length model) and midpoints in one pass over the coordinates
+    _, phi_deg, theta_deg, mid_x, mid_y = dipole_geometry(
+        distance_df_tracked["C1 X (nm)"].to_numpy(), distance_df_tracked["C1 Y (nm)"].to_numpy(),
+        distance_df_tracked["C2 X (nm)"].to_numpy(), distance_df_tracked["C2 Y (nm)"].to_numpy(),
+        rod_length_nm,
+    )
+    distance_df_tracked["Φ (degrees)"] = phi_deg
+    distance_df_tracked["θ (degrees)"] = theta_deg
+
+    # Remove θ == 0
+    keep = theta_deg != 0
+    distance_df_tracked = distance_df_tracked[keep].reset_index(drop=True)
+
+    # Midpoints
+    distance_df_tracked["mid_x"] = mid_x[keep]
+    distance_df_tracked["mid_y"] = mid_y[keep]
+    return distance_df_tracked
+
+
+# =================================================================================================
+# TRACKING ACROSS FRAMES
+#   Hungarian assignment of midpoints frame-to-frame; links longer than link_nm start a new Track ID
+# =================================================================================================
+def track_midpoints(distance_df_tracked: pd.DataFrame, link_nm: float, memory_frames: int | None = None) -> pd.DataFrame:
+    """
+    memory_frames=None: a track can be continued in any later frame (a dipole that blinks off keeps its ID).
+    memory_frames=k: only tracks seen in the last k frames are candidates, so longer blinks end the track (the segments
+    are joined afterwards by close_track_gaps).
+    """
+    distance_df_tracked = distance_df_tracked.sort_values(by="C1 Frame").reset_index(drop=True)
+    distance_df_tracked["Track ID"] = np.nan
+
+    unique_frames = sorted(distance_df_tracked["C1 Frame"].unique())
+    next_track_id = 1
+    tracks_prev = {}  # track_id -> last midpoint position
+    last_seen = {}    # track_id -> last frame
+
+    for frame in unique_frames:
+        mask = distance_df_tracked["C1 Frame"] == frame
+        current = distance_df_tracked.loc[mask].copy()
+        curr_pos = current[["mid_x", "mid_y"]].to_numpy()
+
+        if frame == unique_frames[0]:
+            n = len(current)
+            if n > 0:
+                new_ids = np.arange(next_track_id, next_track_id + n)
+                distance_df_tracked.loc[mask, "Track ID"] = new_ids
+                next_track_id += n
+                for k, idx in enumerate(current.index):
+                    tracks_prev[int(new_ids[k])] = np.array([
+                        distance_df_tracked.loc[idx, "mid_x"],
+                        distance_df_tracked.loc[idx, "mid_y"]
+                    ])
+                    last_seen[int(new_ids[k])] = frame
+            continue
+
+        prev_ids = [t for t in tracks_prev if memory_frames is None or frame - last_seen[t] <= memory_frames]
+
+        if len(prev_ids) == 0 or len(curr_pos) == 0:
+            n = len(curr_pos)
+            if n > 0:
+                new_ids = np.arange(next_track_id, next_track_id + n)
+                distance_df_tracked.loc[mask, "Track ID"] = new_ids
+                next_track_id += n
+                for k, idx in enumerate(current.index):
+                    tracks_prev[int(new_ids[k])] = np.array([
+                        distance_df_tracked.loc[idx, "mid_x"],
+                        distance_df_tracked.loc[idx, "mid_y"]
+                    ])
+                    last_seen[int(new_ids[k])] = frame
+            continue
+
+        prev_pos = np.vstack([tracks_prev[t] for t in prev_ids])
+
+        cost = cdist(prev_pos, curr_pos)
+        r_ind, c_ind = linear_sum_assignment(cost)
+
+        assigned = np.full(len(curr_pos), np.nan)
+        for r, c in zip(r_ind, c_ind):
+            if cost[r, c] < link_nm:
+                assigned[c] = prev_ids[r]
+
+        for i in range(len(curr_pos)):
+            if np.isnan(assigned[i]):
+                assigned[i] = next_track_id
+                next_track_id += 1
+
+        distance_df_tracked.loc[mask, "Track ID"] = assigned
+
+        current_ids = distance_df_tracked.loc[mask, "Track ID"].to_numpy().astype(int)
+        for i, idx in enumerate(current.index):
+            tracks_prev[int(current_ids[i])] = np.array([
+                distance_df_tracked.loc[idx, "mid_x"],
+                distance_df_tracked.loc[idx, "mid_y"]
+            ])
+            last_seen[int(current_ids[i])] = frame
+
+    return distance_df_tracked
+
+
+# =================================================================================================
+# GAP CLOSING / TRACK MERGING (second pass over the track segments of track_midpoints)
+#   Candidate links: end of segment i -> start of segment j with 1 <= start_j − end_i <= max_gap_frames and an endpoint
+#   distance <= max_distance_nm (found with one KD-tree query in space and time). All candidates are solved together as
+#   one sparse linear assignment problem (the gap-closing matrix of Jaqaman et al., 2008):
+#
+#                       starts j             "no predecessor"
+#       ends i      [ link cost d_ij  |  alternative cost (diag) ]
+#       "no succ."  [ alt. cost (diag)|  transpose of the links  ]
+#
+#   d_ij = endpoint distance + gap_penalty_nm per missing frame (gap − 1), so of two similar candidates the one
+#   nearest in time wins (otherwise an end can skip the next segment of the same dipole and leave it orphaned). A link
+#   over g frames therefore needs distance + gap_penalty_nm·(g − 1) < alternative cost.
+#   A segment end is linked only if that is cheaper than leaving both ends unlinked. Linked segments get one Track ID
+#   (renumbered 1..N in order of their first frame); the original ID is kept as "Segment ID".
+# =================================================================================================
+def close_track_gaps(
+    distance_df_tracked: pd.DataFrame,
+    max_gap_frames: int,
+    max_distance_nm: float,
+    alternative_cost_nm: float | None = None,
+    gap_penalty_nm: float = 25.0,
+    frame_col: str = "C1 Frame",
+) -> tuple[pd.DataFrame, dict]:
+    if alternative_cost_nm is None:
+        alternative_cost_nm = max_distance_nm
+
+    df = distance_df_tracked.copy()
+    df["Segment ID"] = df["Track ID"].astype(int)
+
+    by_frame = df.sort_values([frame_col, "Segment ID"], kind="stable")
+    groups = by_frame.groupby("Segment ID", sort=True)
+    first, last = groups.head(1).set_index("Segment ID"), groups.tail(1).set_index("Segment ID")
+    seg_ids = first.index.to_numpy()
+    last = last.loc[seg_ids]
+    n = len(seg_ids)
+
+    start_frame = first[frame_col].to_numpy(dtype=float)
+    end_frame = last[frame_col].to_numpy(dtype=float)
+    start_xy = first[["mid_x", "mid_y"]].to_numpy(dtype=float)
+    end_xy = last[["mid_x", "mid_y"]].to_numpy(dtype=float)
+
+    # Space-time gate: one KD-tree query on (x, y, scaled frame) with the Chebyshev norm. The end frames are shifted to the
+    # middle of the allowed gap window and the frame axis is scaled so the window spans ± max_distance_nm, so only endpoints
+    # that are close in space AND 1..max_gap_frames apart become candidates (not every pair of a site over the whole movie).
+    # The exact distance and gap are checked afterwards.
+    if n > 1 and max_distance_nm > 0 and max_gap_frames >= 1:
+        scale = max_distance_nm / (max_gap_frames / 2.0)
+        end_pts = np.column_stack([end_xy, (end_frame + (max_gap_frames + 1) / 2.0) * scale])
+        start_pts = np.column_stack([start_xy, start_frame * scale])
+        cand = cKDTree(end_pts).sparse_distance_matrix(cKDTree(start_pts), max_distance_nm, p=np.inf, output_type="ndarray")
+        ci, cj = cand["i"], cand["j"]
+        cd = np.hypot(start_xy[cj, 0] - end_xy[ci, 0], start_xy[cj, 1] - end_xy[ci, 1])
+    else:
+        ci = cj = np.empty(0, dtype=np.int64)
+        cd = np.empty(0)
+    gap = start_frame[cj] - end_frame[ci]
+    ok = (gap >= 1) & (gap <= max_gap_frames) & (cd <= max_distance_nm)
+    ci, cj, cd, gap = ci[ok], cj[ok], cd[ok], gap[ok]
+
+    succ = np.full(n, -1, dtype=np.int64)
+    if len(ci):
+        # Costs are shifted by a small epsilon so none is an (ignored) explicit zero
+        eps = 1e-6 * max(alternative_cost_nm, 1.0)
+        diag = np.arange(n)
+        rows = np.concatenate([ci, diag, n + diag, n + cj])
+        cols = np.concatenate([cj, n + diag, diag, n + ci])
+        cost = np.concatenate([
+            cd + gap_penalty_nm * (gap - 1) + eps,
+            np.full(n, alternative_cost_nm / 2.0 + eps),
+            np.full(n, alternative_cost_nm / 2.0 + eps),
+            np.full(len(ci), eps),
+        ])
+        matrix = coo_matrix((cost, (rows, cols)), shape=(2 * n, 2 * n)).tocsr()
+        _, match = min_weight_full_bipartite_matching(matrix)
+        match = match[:n]
+        linked = match < n
+        succ[linked] = match[linked]
+
+    # Follow successor chains from every segment without a predecessor
+    has_pred = np.zeros(n, dtype=bool)
+    has_pred[succ[succ >= 0]] = True
+    chain = np.full(n, -1, dtype=np.int64)
+    heads = np.flatnonzero(~has_pred)
+    heads = heads[np.lexsort((seg_ids[heads], start_frame[heads]))]
+    for new_id, head in enumerate(heads, start=1):
+        k = head
+        while k >= 0:
+            chain[k] = new_id
+            k = succ[k]
+
+    new_track = dict(zip(seg_ids, chain))
+    df["Track ID"] = df["Segment ID"].map(new_track).astype(float)
+
+    report = {
+        "segments": int(n),
+        "candidate_links": int(len(ci)),
+        "links": int((succ >= 0).sum()),
+        "tracks": int(len(heads)),
+        "max_gap_frames": max_gap_frames,
+        "max_distance_nm": max_distance_nm,
+        "gap_penalty_nm": gap_penalty_nm,
+    }
+    return df, report
@@ -0,0 +1,154 @@
+#################################################################################################################################
+#################################   LOCALIZATION PRECISION FROM PHOTONS, BACKGROUND AND PSF WIDTH (EMCCD)   #####################
+#################################################################################################################################
+#
+# Recomputes the lateral localization uncertainty of every row instead of trusting the exported "uncertainty_xy [nm]", so the
+# uncertainty thresholds can be changed (or the camera settings corrected) without re-running ThunderSTORM.
+#
+#   N   photons in the spot             b   background noise per pixel (photons, std)      s   PSF width σ (nm)
+#   a   pixel size (nm)                 sa² = s² + a²/12                                 F   EMCCD excess-noise factor
+#                                                                                             (2 with EM gain, 1 without)
+#
+#   "lsq"       Mortensen et al. 2010, least-squares Gaussian fit (the ThunderSTORM formula):
+#                   Δx² = F · [ 16 sa² / (9 N) + 8π sa⁴ b² / (N² a²) ]
+#   "mle"       Mortensen et al. 2010, maximum-likelihood fit, with the closed-form approximation of the integral
+#               (Rieger & Stallinga, 2014):   Δx² = F · sa² / N · [ 1 + 4τ + √(2τ / (1 + 4τ)) ],   τ = 2π sa² b² / (N a²)
+#   "thompson"  Thompson et al. 2002 (no EMCCD excess noise):   Δx² = sa² / N + 8π s⁴ b² / (a² N²)
+#
+# The camera model is a plain dict (EMCCD_CAMERA holds the acquisition settings listed in the README). Photon counts and
+# background can be given in photons (ThunderSTORM's "[photon]" columns) or in A/D counts, which are converted with the
+# camera's photoelectrons per count, EM gain and quantum efficiency. Rows are processed in chunks of chunk_rows, so the
+# temporaries stay small however many rows the table has. Rows with N <= 0 get an infinite uncertainty (never kept by a
+# threshold).
+#################################################################################################################################
+
+import numpy as np
+import pandas as pd
+
+
+METHODS = ("lsq", "mle", "thompson")
+
+# Acquisition settings (README, "EMCCD imaging conditions")
+EMCCD_CAMERA = {
+    "pixel_nm": 150.0,
+    "photoelectrons_per_adu": 15.1,
+    "em_gain": 800.0,
+    "base_level_adu": 166.0,
+    "quantum_efficiency": 1.0,
+}
+
+# ThunderSTORM column names
+PHOTON_COL = "intensity [photon]"
+BACKGROUND_COL = "bkgstd [photon]"
+SIGMA_COL = "sigma [nm]"
+
+CHUNK_ROWS = 1 << 20
+
+
+# =================================================================================================
+# CAMERA
+# =================================================================================================
+def excess_noise_factor(camera: dict) -> float:
+    return 2.0 if camera["em_gain"] > 1.0 else 1.0
+
+
+def adu_to_photons(adu, camera: dict = EMCCD_CAMERA, subtract_base: bool = False) -> np.ndarray:
+    """
+    A/D counts -> photons. subtract_base=True for raw pixel values; leave it off for fitted amplitudes / background noise,
+    which are already offset-free.
+    """
+    adu = np.asarray(adu, dtype=float)
+    if subtract_base:
+        adu = adu - camera["base_level_adu"]
+    return adu * camera["photoelectrons_per_adu"] / (camera["em_gain"] * camera["quantum_efficiency"])
+
+
+# =================================================================================================
+# PRECISION
+# =================================================================================================
+def localization_precision(
+    photons, background, sigma_nm,
+    camera: dict = EMCCD_CAMERA, method: str = "lsq",
+) -> np.ndarray:
+    """Lateral (per-axis) localization uncertainty in nm; the inputs broadcast against each other."""
+    if method not in METHODS:
+        raise ValueError(f"Unknown method '{method}'. Use one of {METHODS}.")
+
+    n = np.asarray(photons, dtype=float)
+    b2 = np.square(np.asarray(background, dtype=float))
+    s2 = np.square(np.asarray(sigma_nm, dtype=float))
+    a = float(camera["pixel_nm"])
+    sa2 = s2 + a * a / 12.0
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        if method == "lsq":
+            var = excess_noise_factor(camera) * (16.0 * sa2 / (9.0 * n) + 8.0 * np.pi * sa2 * sa2 * b2 / (n * n * a * a))
+        elif method == "mle":
+            tau = 2.0 * np.pi * sa2 * b2 / (n * a * a)
+            var = excess_noise_factor(camera) * sa2 / n * (1.0 + 4.0 * tau + np.sqrt(2.0 * tau / (1.0 + 4.0 * tau)))
+        else:
+            var = sa2 / n + 8.0 * np.pi * s2 * s2 * b2 / (a * a * n * n)
+        unc = np.sqrt(var)
+
+    return np.where(n > 0, unc, np.inf)
+
+
+def _column_or_value(df: pd.DataFrame, col: str | None, value, what: str, start: int, stop: int):
+    if col is not None and col in df.columns:
+        return df[col].iloc[start:stop].to_numpy(dtype=float)
+    if value is None:
+        raise KeyError(f"No {what}: column '{col}' is missing and no constant value was given.")
+    return float(value)
+
+
+def recompute_uncertainty(
+    df: pd.DataFrame,
+    camera: dict | None = None,
+    method: str = "lsq",
+    units: str = "photon",
+    photon_col: str = PHOTON_COL,
+    background_col: str | None = BACKGROUND_COL,
+    sigma_col: str | None = SIGMA_COL,
+    background: float | None = None,
+    sigma_nm: float | None = None,
+    chunk_rows: int = CHUNK_ROWS,
+) -> np.ndarray:
+    """
+    Uncertainty (nm) of every row of df. Background and PSF width come from their columns when present, otherwise from the
+    constants `background` / `sigma_nm`. units="adu": photon and background columns (and `background`) are A/D counts.
+    """
+    camera = EMCCD_CAMERA if camera is None else {**EMCCD_CAMERA, **camera}
+    if units not in ("photon", "adu"):
+        raise ValueError("units must be 'photon' or 'adu'.")
+    if photon_col not in df.columns:
+        raise KeyError(f"Photon column '{photon_col}' not found.")
+
+    out = np.empty(len(df), dtype=float)
+    for start in range(0, len(df), max(int(chunk_rows), 1)):
+        stop = min(start + max(int(chunk_rows), 1), len(df))
+        photons = df[photon_col].iloc[start:stop].to_numpy(dtype=float)
+        bkg = _column_or_value(df, background_col, background, "background", start, stop)
+        sigma = _column_or_value(df, sigma_col, sigma_nm, "PSF width", start, stop)
+        if units == "adu":
+            photons = adu_to_photons(photons, camera)
+            bkg = adu_to_photons(bkg, camera)
+        out[start:stop] = localization_precision(photons, bkg, sigma, camera, method)
+    return out
+
+
+if __name__ == "__main__":
+    import sys
+
+    if len(sys.argv) < 2:
+        raise SystemExit("Usage: python smlm_precision.py <localizations.csv> [sigma_nm] [background_photons]")
+
+    table = pd.read_csv(sys.argv[1])
+    kw = {}
+    if len(sys.argv) > 2:
+        kw["sigma_nm"] = float(sys.argv[2])
+    if len(sys.argv) > 3:
+        kw["background"] = float(sys.argv[3])
+    for m in METHODS:
+        table[f"uncertainty_xy {m} [nm]"] = recompute_uncertainty(table, method=m, **kw)
+    cols = [c for c in table.columns if c.startswith("uncertainty_xy")]
+    print(table[cols].describe())
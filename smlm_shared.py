@@ -0,0 +1,164 @@
+#################################################################################################################################
+#################################   SHARED-MEMORY LOCALIZATION STORE (ZERO-COPY FOR WORKERS)   #################################
+#################################################################################################################################
+#
+# Passing df_c1 / df_c2 to worker processes pickles a full copy into every worker. With 10^7 localizations that is
+# gigabytes per worker. Instead, the filtered columns (id, frame, x, y, uncertainty, intensity) are copied ONCE into named
+# shared-memory segments (or .npy files that are memory-mapped), and workers receive only a small handle:
+#
+#   with LocalizationStore({"c1": df_c1, "c2": df_c2}) as store:
+#       pool.submit(work, store.handle, rows)          # handle = segment names, dtypes, shapes (a few hundred bytes)
+#
+#   def work(handle, rows):
+#       cols = attach(handle)                          # read-only NumPy views, attached once per worker process
+#       x = cols["c1"]["x [nm]"][rows]
+#
+# Lifecycle
+#   - The process that creates the store owns the segments and unlinks them in close() (or when the "with" block exits,
+#     or at interpreter exit if close() was never called).
+#   - Workers only attach. They never unlink, and their attachments are reused for every task they run.
+#################################################################################################################################
+
+import os
+import uuid
+import weakref
+from multiprocessing import shared_memory
+
+import numpy as np
+import pandas as pd
+
+from smlm_pipeline import ID_COL, FRAME_COL, XCOL, YCOL, UNCERTAINTY_COL, INTENSITY_COL
+
+
+STORE_COLUMNS = [ID_COL, FRAME_COL, XCOL, YCOL, UNCERTAINTY_COL, INTENSITY_COL]
+
+# Per-process attachments: store name -> (views, keep-alive objects)
+_ATTACHED: dict[str, tuple[dict, list]] = {}
+
+
+# =================================================================================================
+# OWNER SIDE
+# =================================================================================================
+def _release(segments: list, directory: str | None, files: list[str]) -> None:
+    for shm in segments:
+        try:
+            shm.close()
+        except BufferError:
+            pass   # a caller still holds a view; the mapping goes away with it, the name is removed below
+        try:
+            shm.unlink()
+        except FileNotFoundError:
+            pass
+    for path in files:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+    if directory is not None:
+        try:
+            os.rmdir(directory)
+        except OSError:
+            pass
+
+
+class LocalizationStore:
+    """
+    Copies the chosen numeric columns of one or more localization tables into shared memory (directory=None)
+    or into memory-mapped .npy files inside `directory`. store.handle is what workers need to attach.
+    """
+
+    def __init__(self, tables: dict[str, pd.DataFrame], columns: list[str] | None = None, directory: str | None = None):
+        columns = STORE_COLUMNS if columns is None else list(columns)
+        self.name = f"smlm_{uuid.uuid4().hex[:12]}"
+        self._segments: list[shared_memory.SharedMemory] = []
+        self._files: list[str] = []
+        self._directory = None
+
+        if directory is not None:
+            self._directory = os.path.join(directory, self.name)
+            os.makedirs(self._directory)
+
+        arrays = {}
+        layout = {}
+        for table_key, df in tables.items():
+            arrays[table_key], layout[table_key] = {}, {}
+            for col in columns:
+                if col is None or col not in df.columns:
+                    continue
+                if not pd.api.types.is_numeric_dtype(df[col]):
+                    raise TypeError(f"Column '{col}' of '{table_key}' is not numeric; only numeric columns can be shared.")
+                values = np.ascontiguousarray(df[col].to_numpy())
+                view, location = self._allocate(values)
+                view[...] = values
+                view.flags.writeable = False
+                arrays[table_key][col] = view
+                layout[table_key][col] = (location, values.dtype.str, values.shape)
+
+        self.arrays = arrays
+        self.handle = {"name": self.name, "kind": "shm" if directory is None else "mmap", "layout": layout}
+        self._finalizer = weakref.finalize(self, _release, self._segments, self._directory, self._files)
+
+    def _allocate(self, values: np.ndarray) -> tuple[np.ndarray, str]:
+        if self._directory is None:
+            shm = shared_memory.SharedMemory(create=True, size=max(values.nbytes, 1))
+            self._segments.append(shm)
+            return np.ndarray(values.shape, dtype=values.dtype, buffer=shm.buf), shm.name
+
+        path = os.path.join(self._directory, f"{len(self._files)}.npy")
+        self._files.append(path)
+        view = np.lib.format.open_memmap(path, mode="w+", dtype=values.dtype, shape=values.shape)
+        return view, path
+
+    @property
+    def nbytes(self) -> int:
+        return sum(arr.nbytes for cols in self.arrays.values() for arr in cols.values())
+
+    def close(self) -> None:
+        # Drop our own views (and any attach() made in this process) first so the shared buffers can be released
+        self.arrays = {}
+        detach(self.handle)
+        self._finalizer()
+
+    def __enter__(self) -> "LocalizationStore":
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        self.close()
+
+
+# =================================================================================================
+# WORKER SIDE
+# =================================================================================================
+def attach(handle: dict) -> dict[str, dict[str, np.ndarray]]:
+    """Read-only views of every shared column: {table_key: {column: array}}. Cached per process."""
+    cached = _ATTACHED.get(handle["name"])
+    if cached is not None:
+        return cached[0]
+
+    views, keep = {}, []
+    for table_key, cols in handle["layout"].items():
+        views[table_key] = {}
+        for col, (location, dtype, shape) in cols.items():
+            if handle["kind"] == "shm":
+                # Worker processes share their parent's resource tracker, so attaching does not add a second owner
+                shm = shared_memory.SharedMemory(name=location)
+                keep.append(shm)
+                arr = np.ndarray(shape, dtype=np.dtype(dtype), buffer=shm.buf)
+            else:
+                arr = np.load(location, mmap_mode="r")
+            arr.flags.writeable = False
+            views[table_key][col] = arr
+
+    _ATTACHED[handle["name"]] = (views, keep)
+    return views
+
+
+def detach(handle: dict) -> None:
+    """Forget a store in this process (the owner still unlinks it)."""
+    views, keep = _ATTACHED.pop(handle["name"], ({}, []))
+    views.clear()
+    for shm in keep:
+        try:
+            shm.close()
+        except BufferError:
+            pass
@@ -0,0 +1,300 @@
+#################################################################################################################################
+#################################   PAIR-CORRELATION / RIPLEY'S K ENGINE (CHOOSING RADIUS_NM AND TRACK_LINK_NM)   ##############
+#################################################################################################################################
+#
+# Spatial statistics of the localizations, used to pick the pairing and linking radii from the data instead of guessing:
+#
+#   - Ripley's K, L(r) − r and the pair-correlation function g(r), same-channel (C1–C1, C2–C2) or cross-channel (C1–C2)
+#   - nearest-neighbour distance distributions
+#
+# Pair counts for ALL radii come from one dual-tree pass per frame (cKDTree.count_neighbors with an array of radii), so the
+# cost does not depend on the number of radii and no pairwise distance list is ever built. Edge effects are corrected with
+# the isotropized set covariance of the rectangular window W = a × b (Ohser, 1983):
+#
+#   γ̄(r) = ab − 2r(a + b)/π + r²/π          K(r) = |W|² / Σ nA·nB · Σ_{bins <= r} ΔC(bin) / γ̄(bin centre)
+#
+# per_frame=True pairs only localizations of the same frame (or of frame f with frame f + lag), which is what the pairing
+# and tracking steps do; frames are counted in parallel worker processes that read the coordinates from a shared
+# LocalizationStore. per_frame=False treats all localizations as one pattern.
+#
+# Recommendations are NaN ("no correlation detected") unless the peak excess is significant. Under complete spatial
+# randomness the pair count of a bin is Poisson with mean E (the expected pairs), so g − 1 has standard error √(1 / E)
+# and the peak must exceed k of them. The exact Poisson tail is used, since bins at small r expect far fewer than one
+# pair and a single pair there would otherwise look like a huge excess, and the k-sigma level is divided by the number
+# of bins because the peak is the best of all of them.
+#   RADIUS_NM      where the cross-channel (C1–C2, same frame) excess g(r) − 1 has fallen below 5 % of its peak
+#   TRACK_LINK_NM  the same rule applied to C1 localizations in consecutive frames (lag 1): the distance over which a
+#                  punctum reappears near itself in the next frame
+#
+#   python smlm_spatialstats.py TIRF560_imageregperformed.csv TIRF647_imageregperformed.csv
+#################################################################################################################################
+
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from scipy.spatial import cKDTree
+from scipy.stats import norm, poisson
+
+from smlm_pipeline import FRAME_COL, XCOL, YCOL
+from smlm_shared import LocalizationStore, attach
+
+
+RADII_NM = np.arange(10.0, 1010.0, 10.0)   # bin upper edges (nm)
+EXCESS_FRACTION = 0.05                      # a radius is recommended where g − 1 < 5 % of its peak
+SIGNIFICANCE_SIGMA = 4.0                    # the peak excess must be this many standard errors (after the bin correction)
+
+
+# =================================================================================================
+# EDGE CORRECTION
+# =================================================================================================
+def window_set_covariance(r: np.ndarray, width: float, height: float) -> np.ndarray:
+    """Isotropized set covariance γ̄(r) of a width × height rectangle (valid for r <= min(width, height))."""
+    r = np.asarray(r, dtype=float)
+    return width * height - 2.0 * r * (width + height) / np.pi + r * r / np.pi
+
+
+# =================================================================================================
+# PER-FRAME WORKER
+#   task["ranges"]: (a_start, a_stop, b_start, b_stop) row ranges of the frame-sorted tables
+# =================================================================================================
+def _count_frames(task: dict, columns: dict | None = None) -> dict:
+    if columns is None:
+        columns = attach(task["store"])
+    ax, ay = columns["a"]["x"], columns["a"]["y"]
+    bx, by = columns["b"]["x"], columns["b"]["y"]
+    radii = task["radii"]
+    self_pairs = task["self_pairs"]
+
+    counts = np.zeros(len(radii), dtype=np.int64)
+    nn_hist = np.zeros(len(radii) + 1, dtype=np.int64)   # last bin: farther than the largest radius / no neighbour
+    n_ab = 0
+    for a0, a1, b0, b1 in task["ranges"]:
+        na, nb = a1 - a0, b1 - b0
+        if na == 0 or nb == 0 or (self_pairs and na < 2):
+            continue
+        a_xy = np.column_stack([ax[a0:a1], ay[a0:a1]])
+        b_xy = a_xy if self_pairs else np.column_stack([bx[b0:b1], by[b0:b1]])
+        a_tree = cKDTree(a_xy)
+        b_tree = a_tree if self_pairs else cKDTree(b_xy)
+
+        c = a_tree.count_neighbors(b_tree, radii)
+        if self_pairs:
+            counts += c - na              # drop the zero-distance self pairs (i, i)
+            n_ab += na * (na - 1)
+            d = b_tree.query(a_xy, k=2)[0][:, 1]
+        else:
+            counts += c
+            n_ab += na * nb
+            d = b_tree.query(a_xy, k=1)[0]
+        nn_hist += np.bincount(np.searchsorted(radii, d, side="left"), minlength=len(radii) + 1)
+
+    return {"counts": counts, "n_ab": n_ab, "nn_hist": nn_hist}
+
+
+def _frame_ranges(frames_a: np.ndarray, frames_b: np.ndarray, lag: int) -> list[tuple[int, int, int, int]]:
+    """Row ranges pairing frame f of A with frame f + lag of B (both sorted by frame)."""
+    values, a_start = np.unique(frames_a, return_index=True)
+    a_stop = np.r_[a_start[1:], len(frames_a)]
+    b_start = np.searchsorted(frames_b, values + lag, side="left")
+    b_stop = np.searchsorted(frames_b, values + lag, side="right")
+    return [(int(p), int(q), int(s), int(t)) for p, q, s, t in zip(a_start, a_stop, b_start, b_stop) if t > s]
+
+
+# =================================================================================================
+# K / L / g
+# =================================================================================================
+def pair_correlation(
+    df_a: pd.DataFrame,
+    df_b: pd.DataFrame | None = None,
+    radii_nm: np.ndarray = RADII_NM,
+    bounds: tuple[float, float, float, float] | None = None,
+    per_frame: bool = True,
+    lag: int = 0,
+    workers: int | None = 1,
+    frame_col: str = FRAME_COL,
+    xcol: str = XCOL,
+    ycol: str = YCOL,
+) -> tuple[pd.DataFrame, dict]:
+    """
+    Same-channel statistics when df_b is None (lag > 0: A at frame f against A at frame f + lag), cross-channel otherwise.
+    Returns one row per radius bin (upper edge "r (nm)") and a report.
+    """
+    radii = np.asarray(radii_nm, dtype=float)
+    if np.any(np.diff(radii) <= 0) or radii[0] <= 0:
+        raise ValueError("radii_nm must be positive and strictly increasing.")
+    if not per_frame and lag != 0:
+        raise ValueError("lag needs per_frame=True.")
+
+    self_pairs = df_b is None and lag == 0
+    df_b = df_a if df_b is None else df_b
+
+    if bounds is None:
+        xs = np.r_[df_a[xcol].to_numpy(dtype=float), df_b[xcol].to_numpy(dtype=float)]
+        ys = np.r_[df_a[ycol].to_numpy(dtype=float), df_b[ycol].to_numpy(dtype=float)]
+        bounds = (xs.min(), xs.max(), ys.min(), ys.max())
+    width, height = float(bounds[1] - bounds[0]), float(bounds[3] - bounds[2])
+    if radii[-1] > min(width, height):
+        raise ValueError(f"Largest radius ({radii[-1]} nm) exceeds the window's shorter side ({min(width, height)} nm).")
+
+    if per_frame:
+        a = df_a.sort_values(frame_col, kind="stable")
+        b = df_b.sort_values(frame_col, kind="stable")
+        ranges = _frame_ranges(a[frame_col].to_numpy(), b[frame_col].to_numpy(), lag)
+    else:
+        a, b = df_a, df_b
+        ranges = [(0, len(a), 0, len(b))]
+    tables = {
+        "a": pd.DataFrame({"x": a[xcol].to_numpy(dtype=float), "y": a[ycol].to_numpy(dtype=float)}),
+        "b": pd.DataFrame({"x": b[xcol].to_numpy(dtype=float), "y": b[ycol].to_numpy(dtype=float)}),
+    }
+
+    base = {"radii": radii, "self_pairs": self_pairs}
+    n_workers = workers or os.cpu_count() or 1
+    if n_workers == 1 or len(ranges) < 2:
+        local = {k: {"x": t["x"].to_numpy(), "y": t["y"].to_numpy()} for k, t in tables.items()}
+        results = [_count_frames({**base, "ranges": ranges}, local)]
+    else:
+        chunks = np.array_split(np.arange(len(ranges)), min(len(ranges), 4 * n_workers))
+        with LocalizationStore(tables, columns=["x", "y"]) as store, ProcessPoolExecutor(max_workers=n_workers) as pool:
+            futures = [
+                pool.submit(_count_frames, {**base, "store": store.handle, "ranges": [ranges[k] for k in chunk]})
+                for chunk in chunks if len(chunk)
+            ]
+            results = [f.result() for f in futures]
+
+    counts = sum(res["counts"] for res in results)
+    n_ab = sum(res["n_ab"] for res in results)
+    nn_hist = sum(res["nn_hist"] for res in results)
+
+    lower = np.r_[0.0, radii[:-1]]
+    centre = (lower + radii) / 2.0
+    d_counts = np.diff(np.r_[0, counts]).astype(float)
+    area = width * height
+    with np.errstate(divide="ignore", invalid="ignore"):
+        d_k = area * area * d_counts / (n_ab * window_set_covariance(centre, width, height))
+        k = np.cumsum(d_k)
+        g = d_k / (np.pi * (radii ** 2 - lower ** 2))
+        l_minus_r = np.sqrt(k / np.pi) - radii
+    # pairs expected in each bin for independent uniform points (the Poisson variance of the bin count)
+    expected = n_ab * window_set_covariance(centre, width, height) * np.pi * (radii ** 2 - lower ** 2) / (area * area)
+
+    n_a_total = sum(q - p for p, q, _, _ in ranges)
+    curve = pd.DataFrame({
+        "r (nm)": radii,
+        "Pairs <= r": counts,
+        "K(r) (nm²)": k,
+        "L(r) − r (nm)": l_minus_r,
+        "g(r)": g,
+        "Expected pairs (CSR)": expected,
+        "NN count": nn_hist[:-1],
+        "NN fraction <= r": np.cumsum(nn_hist[:-1]) / max(n_a_total, 1),
+    })
+    report = {
+        "kind": "same-channel" if df_b is df_a else "cross-channel",
+        "per_frame": per_frame, "lag": lag,
+        "frames": len(ranges), "n_a": int(n_a_total), "normalizing_pairs": int(n_ab),
+        "window_nm": (float(width), float(height)),
+        "nn_beyond_max_radius": int(nn_hist[-1]),
+    }
+    return curve, report
+
+
+def excess_radius(curve: pd.DataFrame, fraction: float = EXCESS_FRACTION, sigma: float = SIGNIFICANCE_SIGMA) -> float:
+    """
+    The peak is the bin with the most significant excess of pairs over the Poisson expectation. NaN unless it is
+    significant at `sigma` standard errors (corrected for the number of bins); otherwise the first radius after the peak
+    where g − 1 drops below fraction × (peak − 1).
+    """
+    g = curve["g(r)"].to_numpy()
+    r = curve["r (nm)"].to_numpy()
+    expected = curve["Expected pairs (CSR)"].to_numpy()
+    observed = np.diff(np.r_[0, curve["Pairs <= r"].to_numpy()])
+    finite = np.isfinite(g) & (expected > 0)
+    if not finite.any():
+        return float("nan")
+    # P(count >= observed) for a Poisson bin with mean `expected`
+    p_excess = np.where(finite & (observed > expected), poisson.sf(observed - 1, np.where(finite, expected, 1.0)), 1.0)
+    peak = int(np.argmin(p_excess))
+    if p_excess[peak] * finite.sum() >= norm.sf(sigma):
+        return float("nan")
+    excess = g[peak] - 1.0
+    below = np.flatnonzero(finite[peak:] & (g[peak:] - 1.0 < fraction * excess))
+    return float(r[peak + below[0]]) if len(below) else float("nan")
+
+
+# =================================================================================================
+# RECOMMENDED RADII
+# =================================================================================================
+def recommend_radii(
+    df_c1: pd.DataFrame, df_c2: pd.DataFrame,
+    radii_nm: np.ndarray = RADII_NM, bounds=None, workers: int | None = 1,
+    frame_col: str = FRAME_COL, xcol: str = XCOL, ycol: str = YCOL,
+) -> tuple[dict, dict[str, pd.DataFrame]]:
+    kw = dict(radii_nm=radii_nm, bounds=bounds, workers=workers, frame_col=frame_col, xcol=xcol, ycol=ycol)
+    curves, reports = {}, {}
+    curves["C1–C2"], reports["C1–C2"] = pair_correlation(df_c1, df_c2, **kw)
+    curves["C1–C1"], reports["C1–C1"] = pair_correlation(df_c1, **kw)
+    curves["C2–C2"], reports["C2–C2"] = pair_correlation(df_c2, **kw)
+    curves["C1–C1 lag 1"], reports["C1–C1 lag 1"] = pair_correlation(df_c1, lag=1, **kw)
+
+    recommendation = {
+        "RADIUS_NM": excess_radius(curves["C1–C2"]),
+        "TRACK_LINK_NM": excess_radius(curves["C1–C1 lag 1"]),
+        "reports": reports,
+    }
+    for key, name in (("RADIUS_NM", "C1–C2"), ("TRACK_LINK_NM", "C1–C1 lag 1")):
+        if not np.isfinite(recommendation[key]):
+            print(f"{key}: no correlation detected in {name} (no excess of g(r) − 1 above {SIGNIFICANCE_SIGMA:g} Poisson errors)")
+    return recommendation, curves
+
+
+def plot_curves(curves: dict[str, pd.DataFrame], recommendation: dict | None = None, show: bool = True):
+    import matplotlib.pyplot as plt
+
+    fig, axes = plt.subplots(1, 2, figsize=(14, 6))
+    for name, curve in curves.items():
+        axes[0].plot(curve["r (nm)"], curve["g(r)"], label=name)
+        axes[1].plot(curve["r (nm)"], curve["L(r) − r (nm)"], label=name)
+    axes[0].axhline(1.0, color="black", linewidth=0.8)
+    if recommendation is not None:
+        for key, style in (("RADIUS_NM", "--"), ("TRACK_LINK_NM", ":")):
+            if np.isfinite(recommendation[key]):
+                axes[0].axvline(recommendation[key], color="gray", linestyle=style, label=f"{key} = {recommendation[key]:.0f} nm")
+    axes[0].set_xlabel("r (nm)")
+    axes[0].set_ylabel("g(r)")
+    axes[0].set_title("Pair-Correlation Function")
+    axes[1].set_xlabel("r (nm)")
+    axes[1].set_ylabel("L(r) − r (nm)")
+    axes[1].set_title("Ripley's L(r) − r")
+    for ax in axes:
+        ax.legend()
+        ax.grid(True)
+    fig.tight_layout()
+    if show:
+        plt.show()
+    return fig
+
+
+if __name__ == "__main__":
+    import sys
+
+    if len(sys.argv) != 3:
+        raise SystemExit("Usage: python smlm_spatialstats.py <C1 localizations.csv> <C2 localizations.csv>")
+
+    cols = [FRAME_COL, XCOL, YCOL]
+    c1 = pd.read_csv(sys.argv[1], usecols=cols).dropna()
+    c2 = pd.read_csv(sys.argv[2], usecols=cols).dropna()
+    rec, all_curves = recommend_radii(c1, c2, workers=None)
+
+    for name, rep in rec["reports"].items():
+        print(f"{name}: {rep}")
+    print(f"Recommended RADIUS_NM = {rec['RADIUS_NM']:.0f} nm, TRACK_LINK_NM = {rec['TRACK_LINK_NM']:.0f} nm")
+
+    with pd.ExcelWriter("Pair_Correlation.xlsx", engine="xlsxwriter") as writer:
+        for name, curve in all_curves.items():
+            curve.to_excel(writer, sheet_name=name.replace("–", "-"), index=False)
+    print("Saved output: Pair_Correlation.xlsx")
+    plot_curves(all_curves, rec)
@@ -0,0 +1,270 @@
+#################################################################################################################################
+#################################   SPATIAL TILING WITH HALO OVERLAP (LARGE FIELDS OF VIEW)   ###################################
+#################################################################################################################################
+#
+# Splits the XY window into square tiles and runs, per tile and in parallel worker processes:
+#   - the high-population ambiguity deletion
+#   - Part A (frame-agnostic) pairing
+#   - Part B (same-frame) pairing
+# Each worker only ever holds its tile plus a halo, so memory scales with the tile size instead of the field size.
+#
+# Halo width
+#   Whether a punctum is deleted depends on every punctum within 2 × r of it (its same-channel partner's opposite-channel
+#   neighbours, or its opposite-channel neighbour's same-channel partner). Pairs are formed with puncta up to r outside
+#   the tile, whose deletion status must itself be exact, so the halo must be at least 3 × r for results to be exact.
+#
+# Deterministic ownership
+#   Every punctum is owned by exactly one tile: floor((x − x_lo) / tile), floor((y − y_lo) / tile), clipped to the grid.
+#   A tile only reports deletions of the puncta it owns, pairs whose C1 punctum it owns, and same-channel pairs whose
+#   lower-row member it owns. Stitched results are re-sorted by (C1 row, C2 row), which is the order of the untiled run,
+#   so the output tables are identical to the untiled pipeline.
+#
+# Shared localizations
+#   The frame and x/y columns are placed once in a LocalizationStore (smlm_shared.py). A tile task only carries the row
+#   numbers of its tile + halo; the worker slices them out of its read-only shared views, so no table is pickled per tile.
+#
+# Tracking is NOT tiled: the frame-to-frame Hungarian assignment uses an ungated cost matrix, so one link can depend on
+# dipoles anywhere in the field. It runs once on the stitched (and much smaller) dipole table.
+#################################################################################################################################
+
+import os
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+
+import numpy as np
+import pandas as pd
+
+from smlm_pipeline import (
+    FRAME_COL, XCOL, YCOL,
+    ambiguous_triplet_masks, radius_pair_indices, window_pair_indices, frame_pair_indices,
+)
+from smlm_shared import LocalizationStore, attach
+
+
+# =================================================================================================
+# TILE GRID + OWNERSHIP
+# =================================================================================================
+def tile_grid(x_lo: float, x_hi: float, y_lo: float, y_hi: float, tile_nm: float) -> tuple[int, int]:
+    nx = max(1, int(np.ceil((x_hi - x_lo) / tile_nm)))
+    ny = max(1, int(np.ceil((y_hi - y_lo) / tile_nm)))
+    return nx, ny
+
+
+def owner_tiles(xy: np.ndarray, x_lo: float, y_lo: float, tile_nm: float, nx: int, ny: int) -> np.ndarray:
+    ix = np.clip(np.floor((xy[:, 0] - x_lo) / tile_nm).astype(np.int64), 0, nx - 1)
+    iy = np.clip(np.floor((xy[:, 1] - y_lo) / tile_nm).astype(np.int64), 0, ny - 1)
+    return ix * ny + iy
+
+
+def _extent_rows(x_order: np.ndarray, x_sorted: np.ndarray, y: np.ndarray,
+                 x0: float, x1: float, y0: float, y1: float) -> np.ndarray:
+    a = np.searchsorted(x_sorted, x0, side="left")
+    b = np.searchsorted(x_sorted, x1, side="right")
+    strip = x_order[a:b]
+    inside = (y[strip] >= y0) & (y[strip] <= y1)
+    return np.sort(strip[inside])
+
+
+# =================================================================================================
+# PER-TILE WORKER
+#   Receives the rows of the puncta inside tile + halo (global row numbers of the filtered tables) and reads their
+#   coordinates from the shared store (or from `columns` when run in this process)
+# =================================================================================================
+def _process_tile(task: dict, columns: dict | None = None) -> dict:
+    if columns is None:
+        columns = attach(task["store"])
+    c1_cols, c2_cols = columns["c1"], columns["c2"]
+    xcol, ycol, frame_col = task["xcol"], task["ycol"], task["frame_col"]
+
+    r_nm = task["r_nm"]
+    c1_rows, c2_rows = task["c1_rows"], task["c2_rows"]
+    c1_xy = np.column_stack([c1_cols[xcol][c1_rows], c1_cols[ycol][c1_rows]]).astype(float)
+    c2_xy = np.column_stack([c2_cols[xcol][c2_rows], c2_cols[ycol][c2_rows]]).astype(float)
+    c1_own, c2_own = task["c1_own"], task["c2_own"]
+
+    remove_c1, remove_c2, pairs_c1, pairs_c2 = ambiguous_triplet_masks(c1_xy, c2_xy, r_nm)
+
+    def owned_pair_count(pairs: np.ndarray, rows: np.ndarray, own: np.ndarray) -> int:
+        if len(pairs) == 0:
+            return 0
+        lower = np.where(rows[pairs[:, 0]] < rows[pairs[:, 1]], pairs[:, 0], pairs[:, 1])
+        return int(own[lower].sum())
+
+    out = {
+        "tile": task["tile"],
+        "pairs_checked_c1": owned_pair_count(pairs_c1, c1_rows, c1_own),
+        "pairs_checked_c2": owned_pair_count(pairs_c2, c2_rows, c2_own),
+        "removed_c1": c1_rows[c1_own & remove_c1],
+        "removed_c2": c2_rows[c2_own & remove_c2],
+    }
+
+    keep1 = np.flatnonzero(~remove_c1)
+    keep2 = np.flatnonzero(~remove_c2)
+    query1 = keep1[c1_own[keep1]]
+
+    if task["part_a_window"] is None:
+        a1, a2 = radius_pair_indices(c1_xy[query1], c2_xy[keep2], r_nm)
+    else:
+        c1_frame = c1_cols[frame_col][c1_rows]
+        c2_frame = c2_cols[frame_col][c2_rows]
+        a1, a2 = window_pair_indices(
+            pd.DataFrame({"frame": c1_frame[query1], "x": c1_xy[query1, 0], "y": c1_xy[query1, 1]}),
+            pd.DataFrame({"frame": c2_frame[keep2], "x": c2_xy[keep2, 0], "y": c2_xy[keep2, 1]}),
+            r_nm, task["part_a_window"], task["part_a_block"], frame_col="frame", xcol="x", ycol="y"
+        )
+    out["part_a"] = (c1_rows[query1[a1]], c2_rows[keep2[a2]])
+
+    if task["frame_aware"]:
+        c1_frame = c1_cols[frame_col][c1_rows]
+        c2_frame = c2_cols[frame_col][c2_rows]
+        t1 = pd.DataFrame({"frame": c1_frame[query1], "x": c1_xy[query1, 0], "y": c1_xy[query1, 1]})
+        t2 = pd.DataFrame({"frame": c2_frame[keep2], "x": c2_xy[keep2, 0], "y": c2_xy[keep2, 1]})
+        b1, b2 = frame_pair_indices(t1, t2, r_nm, frame_col="frame", xcol="x", ycol="y")
+        out["part_b"] = (c1_rows[query1[b1]], c2_rows[keep2[b2]])
+
+    return out
+
+
+# =================================================================================================
+# TILED DELETION + PAIRING (drop-in for remove_ambiguous_triplets + both pairings)
+# =================================================================================================
+def tiled_ambiguity_and_pairing(
+    df_c1: pd.DataFrame,
+    df_c2: pd.DataFrame,
+    r_nm: float,
+    tile_nm: float,
+    bounds: tuple[float, float, float, float] | None = None,
+    halo_nm: float | None = None,
+    workers: int | None = None,
+    frame_aware: bool = True,
+    part_a_window_frames: int | None = None,
+    part_a_block_frames: int | None = None,
+    frame_col: str = FRAME_COL,
+    xcol: str = XCOL,
+    ycol: str = YCOL,
+) -> tuple[pd.DataFrame, pd.DataFrame, dict, tuple[np.ndarray, np.ndarray], tuple[np.ndarray, np.ndarray] | None]:
+    """
+    Returns the same filtered tables and deletion report as remove_ambiguous_triplets, plus the Part A and
+    Part B pair indices (rows of the filtered tables, ordered by C1 row then C2 row; Part B is None if not frame_aware).
+    With part_a_window_frames, Part A only pairs localizations within ±that many frames (see window_pair_indices).
+    """
+    if halo_nm is None:
+        halo_nm = 3.0 * r_nm
+    if halo_nm < 3.0 * r_nm:
+        raise ValueError(f"halo_nm ({halo_nm}) must be at least 3 × r_nm ({3.0 * r_nm}) for exact tiled results.")
+    if tile_nm <= 0:
+        raise ValueError(f"tile_nm must be positive, got {tile_nm}.")
+
+    c1_xy = df_c1[[xcol, ycol]].to_numpy(dtype=float)
+    c2_xy = df_c2[[xcol, ycol]].to_numpy(dtype=float)
+
+    if bounds is None:
+        all_xy = np.vstack([c1_xy, c2_xy]) if len(c1_xy) + len(c2_xy) else np.zeros((1, 2))
+        bounds = (all_xy[:, 0].min(), all_xy[:, 0].max(), all_xy[:, 1].min(), all_xy[:, 1].max())
+    x_lo, x_hi, y_lo, y_hi = bounds
+    nx, ny = tile_grid(x_lo, x_hi, y_lo, y_hi, tile_nm)
+
+    own1 = owner_tiles(c1_xy, x_lo, y_lo, tile_nm, nx, ny)
+    own2 = owner_tiles(c2_xy, x_lo, y_lo, tile_nm, nx, ny)
+
+    order1 = np.argsort(c1_xy[:, 0], kind="stable")
+    order2 = np.argsort(c2_xy[:, 0], kind="stable")
+    xs1, xs2 = c1_xy[order1, 0], c2_xy[order2, 0]
+
+    def make_task(tile: int) -> dict | None:
+        ix, iy = divmod(tile, ny)
+        x0, y0 = x_lo + ix * tile_nm, y_lo + iy * tile_nm
+        x1, y1 = x0 + tile_nm, y0 + tile_nm
+        # Edge tiles own everything clipped onto them, so their extent reaches the data on that side
+        if ix == 0:
+            x0 = min(x0, c1_xy[:, 0].min(initial=x0), c2_xy[:, 0].min(initial=x0))
+        if ix == nx - 1:
+            x1 = max(x1, c1_xy[:, 0].max(initial=x1), c2_xy[:, 0].max(initial=x1))
+        if iy == 0:
+            y0 = min(y0, c1_xy[:, 1].min(initial=y0), c2_xy[:, 1].min(initial=y0))
+        if iy == ny - 1:
+            y1 = max(y1, c1_xy[:, 1].max(initial=y1), c2_xy[:, 1].max(initial=y1))
+
+        rows1 = _extent_rows(order1, xs1, c1_xy[:, 1], x0 - halo_nm, x1 + halo_nm, y0 - halo_nm, y1 + halo_nm)
+        rows2 = _extent_rows(order2, xs2, c2_xy[:, 1], x0 - halo_nm, x1 + halo_nm, y0 - halo_nm, y1 + halo_nm)
+        c1_own = own1[rows1] == tile
+        c2_own = own2[rows2] == tile
+        if not c1_own.any() and not c2_own.any():
+            return None
+
+        return {
+            "tile": tile, "r_nm": r_nm, "frame_aware": frame_aware,
+            "part_a_window": part_a_window_frames, "part_a_block": part_a_block_frames,
+            "frame_col": frame_col, "xcol": xcol, "ycol": ycol, "store": store_handle,
+            "c1_rows": rows1, "c1_own": c1_own,
+            "c2_rows": rows2, "c2_own": c2_own,
+        }
+
+    needs_frames = frame_aware or part_a_window_frames is not None
+    shared_cols = [frame_col, xcol, ycol] if needs_frames else [xcol, ycol]
+    tiles = range(nx * ny)
+    results = []
+    if workers == 1:
+        store_handle = None
+        local = {
+            "c1": {col: df_c1[col].to_numpy() for col in shared_cols},
+            "c2": {col: df_c2[col].to_numpy() for col in shared_cols},
+        }
+        for tile in tiles:
+            task = make_task(tile)
+            if task is not None:
+                results.append(_process_tile(task, local))
+    else:
+        # Bounded submission: only a few tiles' worth of row numbers is in flight at once
+        n_workers = workers or os.cpu_count() or 1
+        with LocalizationStore({"c1": df_c1, "c2": df_c2}, columns=shared_cols) as store, \
+                ProcessPoolExecutor(max_workers=n_workers) as pool:
+            store_handle = store.handle
+            pending = set()
+            for tile in tiles:
+                task = make_task(tile)
+                if task is None:
+                    continue
+                pending.add(pool.submit(_process_tile, task))
+                if len(pending) >= 2 * n_workers:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    results.extend(f.result() for f in done)
+            results.extend(f.result() for f in pending)
+
+    results.sort(key=lambda res: res["tile"])
+
+    # -------------------------------------------------------------------------------------------------
+    # STITCH
+    # -------------------------------------------------------------------------------------------------
+    remove_c1 = np.zeros(len(df_c1), dtype=bool)
+    remove_c2 = np.zeros(len(df_c2), dtype=bool)
+    for res in results:
+        remove_c1[res["removed_c1"]] = True
+        remove_c2[res["removed_c2"]] = True
+
+    df_c1_filt = df_c1.loc[~remove_c1].reset_index(drop=True)
+    df_c2_filt = df_c2.loc[~remove_c2].reset_index(drop=True)
+
+    # global row -> row of the filtered table
+    new_row1 = np.cumsum(~remove_c1) - 1
+    new_row2 = np.cumsum(~remove_c2) - 1
+
+    def stitch_pairs(key: str) -> tuple[np.ndarray, np.ndarray]:
+        if not results:
+            return np.empty(0, dtype=int), np.empty(0, dtype=int)
+        g1 = np.concatenate([res[key][0] for res in results]).astype(int)
+        g2 = np.concatenate([res[key][1] for res in results]).astype(int)
+        order = np.lexsort((g2, g1))
+        return new_row1[g1[order]], new_row2[g2[order]]
+
+    pairs_a = stitch_pairs("part_a")
+    pairs_b = stitch_pairs("part_b") if frame_aware else None
+
+    report = {
+        "r_nm": r_nm,
+        "initial_c1": len(df_c1), "initial_c2": len(df_c2),
+        "same_channel_pairs_checked_c1": sum(res["pairs_checked_c1"] for res in results),
+        "same_channel_pairs_checked_c2": sum(res["pairs_checked_c2"] for res in results),
+        "removed_c1": int(remove_c1.sum()), "removed_c2": int(remove_c2.sum()),
+        "final_c1": len(df_c1_filt), "final_c2": len(df_c2_filt),
+    }
+    return df_c1_filt, df_c2_filt, report, pairs_a, pairs_b